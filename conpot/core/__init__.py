@@ -16,8 +16,13 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 from session_manager import SessionManager
+from response_scheduler import ResponseScheduler
+from workers import get_listener
+from metrics import Metrics
 
 sessionManager = SessionManager()
+responseScheduler = ResponseScheduler()
+metrics = Metrics()
 
 
 def get_sessionManager():
@@ -31,3 +36,10 @@ def get_databus():
 def get_session(*args, **kwargs):
     return sessionManager.get_session(*args, **kwargs)
 
+
+def get_response_scheduler():
+    return responseScheduler
+
+
+def get_metrics():
+    return metrics
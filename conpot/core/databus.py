@@ -34,12 +34,14 @@ class Databus(object):
         self._data = {}
         self._observer_map = {}
         self.initialized = gevent.event.Event()
+        # called with every value set in this process, conpot.core.workers forwards them to the other processes
+        self.replicate = None
 
     # the idea here is that we can store both values and functions in the key value store
     # functions could be used if a profile wants to simulate a sensor, or the function
     # could interface with a real sensor
     def get_value(self, key):
-        logger.debug('DataBus: Get value from key: [%s]', key)
+        # not logged, reads are the hot path of every request
         assert key in self._data
         item = self._data[key]
         if getattr(item, "get_value", None):
@@ -54,6 +56,12 @@ class Databus(object):
 
     def set_value(self, key, value):
         logger.debug('DataBus: Storing key: [%s] value: [%s]', key, value)
+        self.apply_value(key, value)
+        if self.replicate:
+            self.replicate(key, value)
+
+    def apply_value(self, key, value):
+        """ Stores a value without replicating it, used for values set by another process. """
         self._data[key] = value
         # notify observers
         if key in self._observer_map:
@@ -99,6 +107,9 @@ class Databus(object):
                 raise Exception('Unknown value type: {0}'.format(value_type))
         self.initialized.set()
 
+    def keys(self):
+        return self._data.keys()
+
     def get_shapshot(self):
         # takes a snapshot of the internal honeypot state and returns it as json.
         snapsnot = {}
@@ -0,0 +1,166 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# Handlers keeping the per-packet log messages of the protocol servers cheap during scans: records are queued
+# unformatted, formatted and written in batches by a greenlet, and repeated messages are summarized.
+
+import logging
+import os
+import time
+from collections import deque
+
+import gevent
+import gevent.event
+
+
+class RateLimiter(object):
+    """
+    Lets through burst records per interval for every message and source, the others are counted and reported in a
+    summary at the end of the interval. Records above level are never limited.
+
+    The message is the unformatted template of the record, the source is the 'source' attribute given with
+    extra={'source': ...}. Records without a source are never limited, a summary of them would lose the
+    addresses they log.
+    """
+
+    def __init__(self, burst=20, interval=10, level=logging.INFO):
+        self.burst = burst
+        self.interval = interval
+        self.level = level
+        # (logger name, message, source) -> records in this interval
+        self.counts = {}
+        self.started = time.time()
+
+    def allow(self, record):
+        source = getattr(record, 'source', None)
+        if record.levelno > self.level or source is None:
+            return True
+        key = (record.name, record.msg, source)
+        count = self.counts.get(key, 0) + 1
+        self.counts[key] = count
+        return count <= self.burst
+
+    def summaries(self, now=None, force=False):
+        """ :return: Records summarizing the suppressed messages, once the interval is over or if forced. """
+        now = now or time.time()
+        if now - self.started < self.interval and not force:
+            return []
+        records = []
+        for (name, msg, source), count in sorted(self.counts.items()):
+            if count > self.burst:
+                records.append(logging.makeLogRecord({
+                    'name': name, 'levelno': logging.INFO, 'levelname': 'INFO', 'created': now,
+                    'msg': 'Suppressed %d messages like "%s" from %s in the last %d seconds',
+                    'args': (count - self.burst, msg, source, now - self.started)
+                }))
+        self.counts.clear()
+        self.started = now
+        return records
+
+
+class QueueHandler(logging.Handler):
+    """
+    Queues the records without formatting them, a greenlet formats them and writes them to the streams of the target
+    handlers in batches. Records are dropped, and counted, while max_pending records are waiting.
+    """
+
+    def __init__(self, targets, rate_limiter=None, max_pending=10000, batch_size=500, flush_interval=0.5):
+        """ :param targets: StreamHandlers, including FileHandlers, whose formatter and level are used. """
+        logging.Handler.__init__(self)
+        self.targets = targets
+        self.rate_limiter = rate_limiter
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = deque()
+        self.dropped = 0
+        self.wakeup = gevent.event.Event()
+        self.writer = None
+        self.pid = os.getpid()
+
+    def _check_process(self):
+        # a forked process inherits the records the parent process still has to write
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.pending.clear()
+            self.dropped = 0
+            self.writer = None
+
+    def emit(self, record):
+        self._check_process()
+        if self.rate_limiter and not self.rate_limiter.allow(record):
+            return
+        if len(self.pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self.pending.append(record)
+        if self.writer is None:
+            self.writer = gevent.spawn(self._write, self.pid)
+        if len(self.pending) >= self.batch_size:
+            self.wakeup.set()
+
+    def _write(self, pid):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            if os.getpid() != pid:
+                # inherited by a forked process, which starts its own
+                return
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self, final=False):
+        self._check_process()
+        records = list(self.pending)
+        self.pending.clear()
+        if self.rate_limiter:
+            records.extend(self.rate_limiter.summaries(force=final))
+        if self.dropped:
+            records.append(logging.makeLogRecord({
+                'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'msg': 'Dropped %d log records, the log could not be written fast enough', 'args': (self.dropped,)
+            }))
+            self.dropped = 0
+        if not records:
+            return
+        for target in self.targets:
+            lines = []
+            for record in records:
+                if record.levelno >= target.level and target.filter(record):
+                    try:
+                        line = target.format(record)
+                    except Exception:
+                        self.handleError(record)
+                        continue
+                    if isinstance(line, unicode):
+                        line = line.encode('utf-8')
+                    lines.append(line)
+            if lines:
+                target.acquire()
+                try:
+                    target.stream.write('\n'.join(lines) + '\n')
+                    target.flush()
+                finally:
+                    target.release()
+
+    def close(self):
+        self.flush(final=True)
+        if self.writer is not None and self.pid == os.getpid():
+            self.writer.kill(block=False)
+        self.writer = None
+        for target in self.targets:
+            target.close()
+        logging.Handler.close(self)
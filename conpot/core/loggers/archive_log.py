@@ -0,0 +1,327 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# Columnar event archive.
+#
+# Events are partitioned by protocol and hour into <directory>/<protocol>/<YYYY-MM-DD>/<HH>.cpa. A partition file
+# is a sequence of row groups, each one a header followed by one compressed block per column:
+#
+#   header:  magic 'CPRG', codec, row count, column count, first and last timestamp
+#   column:  name, type, compressed size
+#
+# Column types are 'q' (int64), 'I' (uint32), 'H' (uint16), 'F' (fixed 16 byte binary) and 'B' (variable length
+# binary, a uint32 length per row followed by the concatenated values). Numbers are stored little endian.
+# The header keeps the timestamp range so scans skip row groups and columns without decompressing them.
+
+import bz2
+import calendar
+import grp
+import json
+import logging
+import os
+import platform
+import pwd
+import socket
+import struct
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta
+
+from conpot.core.loggers.helpers import json_dumps
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = 'CPRG'
+ROW_GROUP_HEADER = struct.Struct('<4sBIBqq')
+COLUMN_HEADER = struct.Struct('<16scI')
+CODECS = {'zlib': (1, zlib.compress, zlib.decompress),
+          'bz2': (2, bz2.compress, bz2.decompress),
+          'none': (0, str, str)}
+CODEC_IDS = dict((codec_id, decompress) for codec_id, _, decompress in CODECS.values())
+
+COLUMNS = (('timestamp', 'q'), ('session', 'F'), ('remote_ip', 'I'), ('remote_ip6', 'B'), ('remote_port', 'H'),
+           ('request', 'B'), ('response', 'B'), ('extra', 'B'))
+# protocols logging request and response as hex strings, archived as the raw bytes
+HEX_ENCODED = ('s7comm', 'modbus', 'kamstrup_protocol')
+
+
+def to_microseconds(value):
+    return calendar.timegm(value.utctimetuple()) * 1000000 + value.microsecond
+
+
+def from_microseconds(value):
+    return datetime(1970, 1, 1) + timedelta(microseconds=value)
+
+
+def encode_ip(address):
+    """ :return: (IPv4 address as integer, IPv6 address as bytes), the unused one is 0 or empty. """
+    try:
+        return struct.unpack('!I', socket.inet_aton(address))[0], ''
+    except socket.error:
+        return 0, socket.inet_pton(socket.AF_INET6, address)
+
+
+def decode_ip(ip, ip6):
+    if ip6:
+        return socket.inet_ntop(socket.AF_INET6, ip6)
+    return socket.inet_ntoa(struct.pack('!I', ip))
+
+
+def _pack_numbers(type_code, values):
+    return struct.pack('<{0}{1}'.format(len(values), type_code), *values)
+
+
+def _unpack_numbers(type_code, data):
+    return struct.unpack('<{0}{1}'.format(len(data) // struct.calcsize(type_code), type_code), data)
+
+
+def pack_column(type_code, values):
+    if type_code == 'F':
+        return ''.join(values)
+    if type_code == 'B':
+        return _pack_numbers('I', [len(value) for value in values]) + ''.join(values)
+    return _pack_numbers(type_code, values)
+
+
+def unpack_column(type_code, data, rows):
+    if type_code == 'F':
+        return [data[n * 16:n * 16 + 16] for n in xrange(rows)]
+    if type_code == 'B':
+        values = []
+        offset = rows * 4
+        for length in _unpack_numbers('I', data[:offset]):
+            values.append(data[offset:offset + length])
+            offset += length
+        return values
+    return _unpack_numbers(type_code, data)
+
+
+class RowGroup(object):
+    """ Column buffers of the events of one partition not written yet. """
+
+    def __init__(self):
+        self.columns = dict((name, []) for name, _ in COLUMNS)
+        self.rows = 0
+        self.created = time.time()
+
+    def append(self, row):
+        for name, _ in COLUMNS:
+            self.columns[name].append(row[name])
+        self.rows += 1
+
+    def pack(self, codec):
+        codec_id, compress, _ = CODECS[codec]
+        timestamps = self.columns['timestamp']
+        blocks = []
+        headers = [ROW_GROUP_HEADER.pack(MAGIC, codec_id, self.rows, len(COLUMNS), min(timestamps), max(timestamps))]
+        for name, type_code in COLUMNS:
+            block = compress(pack_column(type_code, self.columns[name]))
+            headers.append(COLUMN_HEADER.pack(name, type_code, len(block)))
+            blocks.append(block)
+        return ''.join(headers + blocks)
+
+
+class ArchiveLogger(object):
+    """
+    Writes events to hourly, per protocol partitions of compressed columns.
+
+    Events are buffered per partition and written as a row group once row_group_size events are buffered,
+    the oldest buffered event is older than flush_interval seconds or the hour is over.
+    """
+
+    def __init__(self, directory='logs/archive', row_group_size=10000, flush_interval=60, codec='zlib'):
+        if codec not in CODECS:
+            raise ValueError('Unknown archive compression: {0}'.format(codec))
+        self.directory = directory
+        self.row_group_size = row_group_size
+        self.flush_interval = flush_interval
+        self.codec = codec
+        # (protocol, hour) -> RowGroup
+        self.row_groups = {}
+        self.hour = None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        if os.getuid() == 0:
+            self._chown_dir(directory)
+
+    def _chown_dir(self, path, uid_name='nobody', gid_name='nogroup'):
+        # conpot drops its privileges after the loggers are created
+        wanted_uid = pwd.getpwnam(uid_name)[2]
+        # special handling for os x. (getgrname has trouble with gid below 0)
+        if platform.mac_ver()[0]:
+            wanted_gid = -2
+        else:
+            wanted_gid = grp.getgrnam(gid_name)[2]
+        os.chown(path, wanted_uid, wanted_gid)
+
+    def log(self, event, timestamp=None):
+        """ :param timestamp: UTC datetime of the event, defaults to now. """
+        timestamp = to_microseconds(timestamp or datetime.utcnow())
+        hour = timestamp // 3600000000
+        if hour != self.hour:
+            # rotation, events of past hours still buffered are written to their partitions
+            self.flush(lambda key: key[1] != hour)
+            self.hour = hour
+        key = (event['data_type'], hour)
+        if key not in self.row_groups:
+            self.row_groups[key] = RowGroup()
+        row_group = self.row_groups[key]
+        row_group.append(self._row(event, timestamp))
+        if row_group.rows >= self.row_group_size:
+            self.flush(lambda k: k == key)
+        else:
+            self.flush_expired()
+
+    def _row(self, event, timestamp):
+        data = dict(event['data'])
+        request = data.pop('request', None) or ''
+        response = data.pop('response', None) or ''
+        if event['data_type'] in HEX_ENCODED:
+            try:
+                request, response = request.decode('hex'), response.decode('hex')
+            except TypeError:
+                # kept as logged
+                pass
+        remote_ip, remote_port = event['remote']
+        ip, ip6 = encode_ip(remote_ip)
+        session = event['id']
+        return {'timestamp': timestamp,
+                'session': session.bytes if isinstance(session, uuid.UUID) else uuid.UUID(str(session)).bytes,
+                'remote_ip': ip,
+                'remote_ip6': ip6,
+                'remote_port': remote_port,
+                'request': request.encode('utf-8') if isinstance(request, unicode) else str(request),
+                'response': response.encode('utf-8') if isinstance(response, unicode) else str(response),
+                'extra': json_dumps(data, default=str) if data else ''}
+
+    def flush_expired(self):
+        deadline = time.time() - self.flush_interval
+        self.flush(lambda key: self.row_groups[key].created <= deadline)
+
+    def flush(self, predicate=None):
+        for key in sorted(self.row_groups):
+            if predicate is None or predicate(key):
+                self._write(key, self.row_groups.pop(key))
+
+    def _write(self, key, row_group):
+        protocol, hour = key
+        filename = partition_path(self.directory, protocol, hour)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        # a row group is appended with a single write, readers ignore a truncated last row group
+        with open(filename, 'ab') as f:
+            f.write(row_group.pack(self.codec))
+        logger.debug('Archived %s %s events to %s', row_group.rows, protocol, filename)
+
+    def close(self):
+        self.flush()
+
+
+def partition_path(directory, protocol, hour):
+    start = from_microseconds(hour * 3600000000)
+    return os.path.join(directory, protocol, start.strftime('%Y-%m-%d'), start.strftime('%H.cpa'))
+
+
+class ArchiveReader(object):
+    """ Scans the archive, reading one row group at a time. """
+
+    def __init__(self, directory='logs/archive'):
+        self.directory = directory
+
+    def partitions(self, protocol=None, start=None, end=None):
+        """ :return: Sorted (protocol, filename) pairs of the partitions overlapping [start, end). """
+        if not os.path.isdir(self.directory):
+            return []
+        protocols = [protocol] if protocol else sorted(os.listdir(self.directory))
+        partitions = []
+        for name in protocols:
+            protocol_dir = os.path.join(self.directory, name)
+            if not os.path.isdir(protocol_dir):
+                continue
+            for day in sorted(os.listdir(protocol_dir)):
+                for hour_file in sorted(os.listdir(os.path.join(protocol_dir, day))):
+                    hour_start = datetime.strptime(day + hour_file, '%Y-%m-%d%H.cpa')
+                    if start and hour_start + timedelta(hours=1) <= start:
+                        continue
+                    if end and hour_start >= end:
+                        continue
+                    partitions.append((hour_start, name, os.path.join(protocol_dir, day, hour_file)))
+        return [(name, filename) for _, name, filename in sorted(partitions)]
+
+    def scan(self, protocol=None, start=None, end=None, columns=None):
+        """
+        :param start: First UTC datetime included.
+        :param end: UTC datetime the scan ends before.
+        :param columns: Names of the columns to read, defaults to all. Other columns are not decompressed.
+        :return: Iterator over dicts with the requested columns and the protocol, ordered by partition.
+        """
+        columns = set(columns or [name for name, _ in COLUMNS])
+        start_us = to_microseconds(start) if start else None
+        end_us = to_microseconds(end) if end else None
+        for name, filename in self.partitions(protocol, start, end):
+            for row_group in self._read(filename, columns | set(['timestamp']), start_us, end_us):
+                for n in xrange(row_group['rows']):
+                    timestamp = row_group['timestamp'][n]
+                    if (start_us is not None and timestamp < start_us) or (end_us is not None and timestamp >= end_us):
+                        continue
+                    row = dict((column, row_group[column][n]) for column in columns)
+                    row['protocol'] = name
+                    yield row
+
+    def _read(self, filename, columns, start_us, end_us):
+        with open(filename, 'rb') as f:
+            while True:
+                header = f.read(ROW_GROUP_HEADER.size)
+                if len(header) < ROW_GROUP_HEADER.size:
+                    return
+                magic, codec_id, rows, column_count, first, last = ROW_GROUP_HEADER.unpack(header)
+                if magic != MAGIC:
+                    logger.warning('Corrupt row group in %s, skipping the rest of the file', filename)
+                    return
+                column_headers = f.read(COLUMN_HEADER.size * column_count)
+                if len(column_headers) < COLUMN_HEADER.size * column_count:
+                    return
+                skip = (start_us is not None and last < start_us) or (end_us is not None and first >= end_us)
+                row_group = {'rows': rows}
+                for n in xrange(column_count):
+                    name, type_code, size = COLUMN_HEADER.unpack_from(column_headers, n * COLUMN_HEADER.size)
+                    name = name.rstrip('\x00')
+                    if skip or name not in columns:
+                        f.seek(size, os.SEEK_CUR)
+                        continue
+                    block = f.read(size)
+                    if len(block) < size:
+                        return
+                    row_group[name] = unpack_column(type_code, CODEC_IDS[codec_id](block), rows)
+                if not skip:
+                    yield row_group
+
+
+def decode_row(row):
+    """ :return: The row with readable timestamp, session and remote address columns. """
+    decoded = dict(row)
+    if 'timestamp' in row:
+        decoded['timestamp'] = from_microseconds(row['timestamp'])
+    if 'session' in row:
+        decoded['session'] = uuid.UUID(bytes=row['session'])
+    if 'remote_ip' in row and 'remote_ip6' in row:
+        decoded['remote'] = decode_ip(decoded.pop('remote_ip'), decoded.pop('remote_ip6'))
+    if row.get('extra'):
+        decoded['extra'] = json.loads(row['extra'])
+    return decoded
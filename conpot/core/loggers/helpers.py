@@ -0,0 +1,43 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+import json
+
+
+def byte_safe(obj):
+    """ :return: obj with every str that is not valid UTF-8 replaced by its hex encoding. """
+    if isinstance(obj, str):
+        try:
+            obj.decode('utf-8')
+        except UnicodeDecodeError:
+            return obj.encode('hex')
+        return obj
+    elif isinstance(obj, dict):
+        return dict((byte_safe(key), byte_safe(value)) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        return [byte_safe(value) for value in obj]
+    return obj
+
+
+def json_dumps(obj, **kwargs):
+    """ json.dumps for event data, which may hold raw bytes of the attacker. """
+    try:
+        return json.dumps(obj, **kwargs)
+    except UnicodeDecodeError:
+        # the common case of valid UTF-8 is not walked
+        return json.dumps(byte_safe(obj), **kwargs)
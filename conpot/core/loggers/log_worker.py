@@ -16,10 +16,8 @@
 # Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
-import json
 import logging
 import uuid
-import time
 
 from datetime import datetime
 
@@ -31,6 +29,8 @@ from conpot.core.loggers.mysql_log import MySQLlogger
 from conpot.core.loggers.hpfriends import HPFriendsLogger
 from conpot.core.loggers.syslog import SysLogger
 from conpot.core.loggers.taxii_log import TaxiiLogger
+from conpot.core.loggers.archive_log import ArchiveLogger
+from conpot.core.loggers.helpers import json_dumps
 
 logger = logging.getLogger(__name__)
 
@@ -46,6 +46,7 @@ class LogWorker(object):
         self.syslog_client = None
         self.public_ip = public_ip
         self.taxii_logger = None
+        self.archive_logger = None
 
         if config.getboolean('sqlite', 'enabled'):
             self.sqlite_logger = SQLiteLogger()
@@ -79,12 +80,20 @@ class LogWorker(object):
             facility = config.get('syslog', 'facility')
             logdevice = config.get('syslog', 'device')
             logsocket = config.get('syslog', 'socket')
-            self.syslog_client = SysLogger(host, port, facility, logdevice, logsocket)
+            sensorid = config.get('common', 'sensorid')
+            self.syslog_client = SysLogger(host, port, facility, logdevice, logsocket, sensorid)
 
         if config.getboolean('taxii', 'enabled'):
             # TODO: support for certificates
             self.taxii_logger = TaxiiLogger(config, dom)
 
+        if config.getboolean('archive', 'enabled'):
+            directory = config.get('archive', 'directory')
+            row_group_size = config.getint('archive', 'row_group_size')
+            flush_interval = config.getint('archive', 'flush_interval')
+            compression = config.get('archive', 'compression')
+            self.archive_logger = ArchiveLogger(directory, row_group_size, flush_interval, compression)
+
         self.enabled = True
 
     def _json_default(self, obj):
@@ -96,23 +105,26 @@ class LogWorker(object):
             return None
 
     def _process_sessions(self):
-        sessions = self.session_manager._sessions
         try:
-            session_timeout = self.config.get("session", "timeout")
+            session_timeout = self.config.getfloat("session", "timeout")
         except (ConfigParser.NoSectionError, ConfigParser.NoOptionError):
             session_timeout = 5
-        for session in sessions:
-            if len(session.data) > 0:
-                sec_last_event = max(session.data) / 1000
-            else:
-                sec_last_event = 0
-            sec_session_start = time.mktime(session.timestamp.timetuple())
-            sec_now = time.mktime(datetime.utcnow().timetuple())
-            if (sec_now - (sec_session_start + sec_last_event)) >= session_timeout:
-                # TODO: We need to close sockets in this case
-                logger.info('Session timed out: %s', session.id)
-                session.set_ended()
-                sessions.remove(session)
+        self.session_manager.expire_sessions(session_timeout)
+
+    def _log(self, event):
+        sinks = (('hpfriends', self.friends_feeder), ('sqlite', self.sqlite_logger), ('mysql', self.mysql_logger),
+                 ('syslog', self.syslog_client), ('taxii', self.taxii_logger), ('archive', self.archive_logger))
+        for name, sink in sinks:
+            if not sink:
+                continue
+            # a failing sink must neither keep the event from the others nor stop this greenlet
+            try:
+                if sink is self.friends_feeder:
+                    sink.log(json_dumps(event, default=self._json_default))
+                else:
+                    sink.log(event)
+            except Exception:
+                logger.exception('Failed to log event to %s', name)
 
     def start(self):
         self.enabled = True
@@ -121,24 +133,19 @@ class LogWorker(object):
                 event = self.log_queue.get(timeout=2)
             except Empty:
                 self._process_sessions()
+                if self.archive_logger:
+                    self.archive_logger.flush_expired()
             else:
                 if self.public_ip:
                     event["public_ip"] = self.public_ip
 
-                if self.friends_feeder:
-                    self.friends_feeder.log(json.dumps(event, default=self._json_default))
-
-                if self.sqlite_logger:
-                    self.sqlite_logger.log(event)
-
-                if self.mysql_logger:
-                    self.mysql_logger.log(event)
+                self._log(event)
 
-                if self.syslog_client:
-                    self.syslog_client.log(event)
+        if self.archive_logger:
+            self.archive_logger.close()
 
-                if self.taxii_logger:
-                    self.taxii_logger.log(event)
+        if self.syslog_client:
+            self.syslog_client.close()
 
     def stop(self):
         self.enabled = False
@@ -22,6 +22,31 @@ import os
 import platform
 import grp
 
+# indexes conpot_playback filters and orders by, the rowid is implicitly the last column of every index,
+# keeping (timestamp, id) order without sorting
+INDEXES = (('events_timestamp', 'timestamp'),
+           ('events_protocol', 'protocol, timestamp'),
+           ('events_session', 'session, timestamp'),
+           ('events_remote', 'remote, timestamp'))
+
+
+def create_db(conn):
+    """ Creates the events table and the indexes conpot_playback filters and orders by. """
+    cursor = conn.cursor()
+    cursor.execute("""CREATE TABLE IF NOT EXISTS events
+        (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            remote TEXT,
+            protocol TEXT,
+            request TEXT,
+            response TEXT
+        )""")
+    for name, columns in INDEXES:
+        cursor.execute("CREATE INDEX IF NOT EXISTS {0} ON events({1})".format(name, columns))
+    conn.commit()
+
 
 class SQLiteLogger(object):
 
@@ -44,17 +69,7 @@ class SQLiteLogger(object):
         self._create_db()
 
     def _create_db(self):
-        cursor = self.conn.cursor()
-        cursor.execute("""CREATE TABLE IF NOT EXISTS events
-            (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                remote TEXT,
-                protocol TEXT,
-                request TEXT,
-                response TEXT
-            )""")
+        create_db(self.conn)
 
     def log(self, event):
         cursor = self.conn.cursor()
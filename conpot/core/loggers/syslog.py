@@ -15,22 +15,165 @@
 # Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
-from logging.handlers import SysLogHandler
+# Sends the honeypot events as RFC 5424 messages, with the session and remote address as structured data and the
+# event data as JSON message. Events are buffered and sent by a greenlet, over UDP, over TCP with octet counting
+# framing (RFC 6587) or to the local syslog socket. A full buffer drops events, the protocol servers never wait for
+# the syslog relay.
+
+import errno
 import logging
-import socket
+import os
+import uuid
+from collections import deque
+from datetime import datetime
+from logging.handlers import SysLogHandler
+
+import gevent
+import gevent.event
+from gevent import socket
+
+from conpot.core.loggers.helpers import json_dumps
+
+logger = logging.getLogger(__name__)
+
+# severity of the events
+INFORMATIONAL = 6
+# SD-ID of the event parameters, 32473 is the enterprise number reserved for documentation (RFC 5612)
+SD_ID = 'conpot@32473'
+NILVALUE = '-'
+
+
+def sd_escape(value):
+    return unicode(value).replace('\\', '\\\\').replace('"', '\\"').replace(']', '\\]').encode('utf-8')
+
+
+def _json_default(obj):
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    elif isinstance(obj, uuid.UUID):
+        return str(obj)
+    return repr(obj)
+
+
+def format_event(event, timestamp, facility, hostname, sensorid=None):
+    """ :return: The event as RFC 5424 message. """
+    remote = event.get('remote') or (None, None)
+    params = [('session', event.get('id')), ('protocol', event.get('data_type')), ('remote_ip', remote[0]),
+              ('remote_port', remote[1]), ('public_ip', event.get('public_ip')), ('sensor', sensorid)]
+    structured_data = '[{0} {1}]'.format(SD_ID, ' '.join('{0}="{1}"'.format(name, sd_escape(value))
+                                                         for name, value in params if value is not None))
+    msgid = str(event.get('data_type') or NILVALUE)[:32]
+    message = json_dumps(event.get('data'), default=_json_default)
+    return '<{0}>1 {1}Z {2} conpot {3} {4} {5} \xef\xbb\xbf{6}'.format(
+        facility * 8 + INFORMATIONAL, timestamp.isoformat(), hostname, os.getpid(), msgid, structured_data, message)
 
 
 class SysLogger(object):
-    def __init__(self, host, port, facility, logdevice, logsocket):
-        logger = logging.getLogger()
-
-        if str(logsocket).lower() == 'udp':
-            logger.addHandler(SysLogHandler(address=(host, port),
-                                            facility=getattr(SysLogHandler, 'LOG_' + str(facility).upper()),
-                                            socktype=socket.SOCK_DGRAM))
-        elif str(logsocket).lower() == 'dev':
-            logger.addHandler(SysLogHandler(logdevice))
-
-    def log(self, data):
-        # stub function since the additional handler has been added to the root loggers instance.
-        pass
+    def __init__(self, host, port, facility, logdevice, logsocket, sensorid=None, max_buffer=10000,
+                 batch_size=100, retry_interval=1, max_retry_interval=30):
+        """
+        :param logsocket: 'udp' or 'tcp' to send to host:port, 'dev' to send to the logdevice socket.
+        :param max_buffer: Number of events kept while they cannot be sent, further events are dropped.
+        """
+        self.address = (host, port)
+        self.facility = SysLogHandler.facility_names[str(facility).lower()]
+        self.logdevice = logdevice
+        self.logsocket = str(logsocket).lower()
+        if self.logsocket not in ('udp', 'tcp', 'dev'):
+            raise ValueError('Unknown syslog socket: {0}'.format(logsocket))
+        self.sensorid = sensorid
+        self.hostname = socket.gethostname()
+        self.max_buffer = max_buffer
+        self.batch_size = batch_size
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        # (timestamp, event) waiting to be sent
+        self.buffer = deque()
+        # events taken from the buffer and not sent yet
+        self.in_flight = 0
+        self.dropped = 0
+        # events which could not be formatted, they are dropped as well
+        self.invalid = 0
+        self.sock = None
+        self.has_events = gevent.event.Event()
+        self.sender = gevent.spawn(self._send_events)
+
+    def log(self, event, timestamp=None):
+        if len(self.buffer) >= self.max_buffer:
+            self.dropped += 1
+            return
+        self.buffer.append((timestamp or datetime.utcnow(), event))
+        self.has_events.set()
+
+    def _connect(self):
+        if self.logsocket == 'tcp':
+            self.sock = socket.create_connection(self.address)
+        elif self.logsocket == 'udp':
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.connect(self.address)
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.sock.connect(self.logdevice)
+
+    def _close_socket(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def _send(self, messages):
+        if self.sock is None:
+            self._connect()
+        if self.logsocket == 'tcp':
+            self.sock.sendall(''.join('{0} {1}'.format(len(message), message) for message in messages))
+        else:
+            for message in messages:
+                try:
+                    self.sock.send(message)
+                except socket.error, e:
+                    if e.errno != errno.EMSGSIZE:
+                        raise
+                    logger.warning('Syslog message of %d bytes too long for a datagram, dropped', len(message))
+
+    def _send_events(self):
+        retry_interval = self.retry_interval
+        while True:
+            self.has_events.wait()
+            if self.dropped:
+                logger.warning('Syslog buffer full, dropped %d events', self.dropped)
+                self.dropped = 0
+            batch = []
+            while self.buffer and len(batch) < self.batch_size:
+                batch.append(self.buffer.popleft())
+            if not self.buffer:
+                self.has_events.clear()
+            self.in_flight = len(batch)
+            messages = []
+            for timestamp, event in batch:
+                try:
+                    messages.append(format_event(event, timestamp, self.facility, self.hostname, self.sensorid))
+                except Exception:
+                    self.invalid += 1
+                    logger.exception('Could not format event for syslog, dropped')
+            try:
+                self._send(messages)
+                retry_interval = self.retry_interval
+            except (socket.error, IOError), e:
+                logger.warning('Could not send events to syslog: %s, retrying in %s seconds', e, retry_interval)
+                self._close_socket()
+                # put the batch back, unless newer events took its place in the buffer
+                for item in reversed(batch[:max(0, self.max_buffer - len(self.buffer))]):
+                    self.buffer.appendleft(item)
+                self.has_events.set()
+                self.in_flight = 0
+                gevent.sleep(retry_interval)
+                retry_interval = min(retry_interval * 2, self.max_retry_interval)
+            else:
+                self.in_flight = 0
+
+    def close(self, timeout=5):
+        """ Waits up to timeout seconds for the buffered events to be sent. """
+        with gevent.Timeout(timeout, False):
+            while self.buffer or self.in_flight:
+                gevent.sleep(0.1)
+        self.sender.kill()
+        self._close_socket()
@@ -0,0 +1,244 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# Counters, latency histograms and gauges per protocol, rendered in the Prometheus text format.
+#
+# Recording is meant to be left on: a counter is an integer in a dict and a latency is one bucket increment. Greenlets
+# only switch on I/O, so no lock is needed. Nothing is formatted until the metrics are scraped.
+
+import logging
+
+from gevent.pywsgi import WSGIServer
+
+
+logger = logging.getLogger(__name__)
+
+# name -> (type, help)
+COUNTERS = {
+    'connections': 'Connections accepted.',
+    'requests': 'Requests handled.',
+    'bytes_received': 'Bytes received from clients.',
+    'bytes_sent': 'Bytes sent to clients.',
+    'errors': 'Malformed or unsupported requests.',
+}
+
+# bounds of the exported histogram buckets, in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+class Histogram(object):
+    """
+    Latencies in microseconds, in log-linear buckets like a HDR histogram: values up to 2 * SUB_BUCKETS are exact,
+    above that every power of two is split in SUB_BUCKETS buckets, which bounds the relative error to 1 / SUB_BUCKETS.
+    """
+
+    SUB_BUCKET_BITS = 4
+    SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+    # about 68 seconds
+    MAX_VALUE = (1 << 26) - 1
+
+    def __init__(self, counts=None, total=0):
+        self.counts = counts or [0] * (self._index(self.MAX_VALUE) + 1)
+        # sum of the recorded values
+        self.total = total
+
+    @classmethod
+    def _index(cls, value):
+        exponent = value.bit_length() - cls.SUB_BUCKET_BITS - 1
+        if exponent <= 0:
+            return value
+        return exponent * cls.SUB_BUCKETS + (value >> exponent)
+
+    @classmethod
+    def _upper_bound(cls, index):
+        """ :return: The lowest value above the bucket. """
+        exponent = index // cls.SUB_BUCKETS - 1
+        if exponent <= 0:
+            return index + 1
+        return (index - exponent * cls.SUB_BUCKETS + 1) << exponent
+
+    def record(self, value):
+        value = min(int(value), self.MAX_VALUE)
+        self.counts[self._index(value)] += 1
+        self.total += value
+
+    def count(self):
+        return sum(self.counts)
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.total += other.total
+
+    def value_at_quantile(self, quantile):
+        """ :return: The upper bound of the bucket holding the quantile, 0 if nothing was recorded. """
+        target = quantile * self.count()
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return self._upper_bound(index) - 1
+        return 0
+
+    def cumulative_counts(self, bounds):
+        """ :return: The number of values in the buckets below each of the bounds. """
+        result = []
+        seen = 0
+        index = 0
+        for bound in bounds:
+            while index < len(self.counts) and self._upper_bound(index) <= bound:
+                seen += self.counts[index]
+                index += 1
+            result.append(seen)
+        return result
+
+
+class Metrics(object):
+    def __init__(self):
+        # (name, protocol) -> count
+        self.counters = {}
+        # protocol -> Histogram of request latencies
+        self.latencies = {}
+        # name -> (help, function returning a value or a dict of protocol -> value)
+        self.gauges = {}
+        # source -> snapshot of the metrics of another process
+        self.remote = {}
+
+    def count(self, name, protocol, value=1):
+        key = (name, protocol)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, protocol, seconds):
+        """ Records the time taken by a request. """
+        if protocol not in self.latencies:
+            self.latencies[protocol] = Histogram()
+        self.latencies[protocol].record(seconds * 1000000)
+
+    def gauge(self, name, help_text, function):
+        self.gauges[name] = (help_text, function)
+
+    def snapshot(self):
+        """ :return: The metrics of this process in plain types, to be sent to another process. """
+        gauges = {}
+        for name, (_, function) in self.gauges.items():
+            gauges[name] = function()
+        return {'counters': dict(self.counters),
+                'latencies': dict((protocol, (histogram.counts, histogram.total))
+                                  for protocol, histogram in self.latencies.items()),
+                'gauges': gauges}
+
+    def update_remote(self, source, snapshot):
+        self.remote[source] = snapshot
+
+    def _merged(self):
+        snapshots = [self.snapshot()] + self.remote.values()
+        counters = {}
+        latencies = {}
+        gauges = {}
+        for snapshot in snapshots:
+            for key, value in snapshot['counters'].items():
+                counters[key] = counters.get(key, 0) + value
+            for protocol, (counts, total) in snapshot['latencies'].items():
+                if protocol not in latencies:
+                    latencies[protocol] = Histogram()
+                latencies[protocol].merge(Histogram(counts, total))
+            for name, value in snapshot['gauges'].items():
+                if isinstance(value, dict):
+                    merged = gauges.setdefault(name, {})
+                    for protocol, count in value.items():
+                        merged[protocol] = merged.get(protocol, 0) + count
+                else:
+                    gauges[name] = gauges.get(name, 0) + value
+        return counters, latencies, gauges
+
+    def render(self):
+        """ :return: All metrics, including those of the other processes, in the Prometheus text format. """
+        counters, latencies, gauges = self._merged()
+        lines = []
+        for name in sorted(COUNTERS):
+            metric = 'conpot_{0}_total'.format(name)
+            lines.append('# HELP {0} {1}'.format(metric, COUNTERS[name]))
+            lines.append('# TYPE {0} counter'.format(metric))
+            for (counter, protocol), value in sorted(counters.items()):
+                if counter == name:
+                    lines.append('{0}{{protocol="{1}"}} {2}'.format(metric, protocol, value))
+
+        lines.append('# HELP conpot_request_duration_seconds Time taken to build the responses.')
+        lines.append('# TYPE conpot_request_duration_seconds histogram')
+        for protocol, histogram in sorted(latencies.items()):
+            cumulative = histogram.cumulative_counts([int(bound * 1000000) for bound in BUCKETS])
+            for bound, count in zip(BUCKETS, cumulative):
+                lines.append('conpot_request_duration_seconds_bucket{{protocol="{0}",le="{1}"}} {2}'
+                             .format(protocol, bound, count))
+            lines.append('conpot_request_duration_seconds_bucket{{protocol="{0}",le="+Inf"}} {1}'
+                         .format(protocol, histogram.count()))
+            lines.append('conpot_request_duration_seconds_sum{{protocol="{0}"}} {1}'
+                         .format(protocol, histogram.total / 1000000.0))
+            lines.append('conpot_request_duration_seconds_count{{protocol="{0}"}} {1}'
+                         .format(protocol, histogram.count()))
+        lines.append('# HELP conpot_request_duration_quantile_seconds Quantiles of the time taken to build the '
+                     'responses.')
+        lines.append('# TYPE conpot_request_duration_quantile_seconds gauge')
+        for protocol, histogram in sorted(latencies.items()):
+            for quantile in QUANTILES:
+                lines.append('conpot_request_duration_quantile_seconds{{protocol="{0}",quantile="{1}"}} {2}'
+                             .format(protocol, quantile, histogram.value_at_quantile(quantile) / 1000000.0))
+
+        for name, (help_text, _) in sorted(self.gauges.items()):
+            metric = 'conpot_{0}'.format(name)
+            lines.append('# HELP {0} {1}'.format(metric, help_text))
+            lines.append('# TYPE {0} gauge'.format(metric))
+            value = gauges.get(name, 0)
+            if isinstance(value, dict):
+                for protocol, count in sorted(value.items()):
+                    lines.append('{0}{{protocol="{1}"}} {2}'.format(metric, protocol, count))
+            else:
+                lines.append('{0} {1}'.format(metric, value))
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        self.counters.clear()
+        self.latencies.clear()
+        self.remote.clear()
+
+
+class MetricsServer(object):
+    """ Serves the metrics on /metrics for Prometheus to scrape. """
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.server = None
+
+    def application(self, environ, start_response):
+        if environ['PATH_INFO'] != '/metrics':
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return ['Not Found\n']
+        body = self.metrics.render()
+        start_response('200 OK', [('Content-Type', 'text/plain; version=0.0.4'),
+                                  ('Content-Length', str(len(body)))])
+        return [body]
+
+    def start(self, host, port):
+        connection = (host, port)
+        self.server = WSGIServer(connection, self.application, log=None)
+        logger.info('Metrics server started on: %s', connection)
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.stop()
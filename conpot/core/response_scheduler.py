@@ -0,0 +1,214 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import heapq
+import itertools
+import logging
+import random
+import time
+from collections import deque
+
+import gevent
+import gevent.event
+from gevent import socket
+
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseDelay(object):
+    """
+    Response latency of an emulated device.
+
+    Supported distributions and their parameters (seconds):
+        constant: value
+        uniform:  min, max
+        normal:   mean, stddev, optionally clipped to min and max
+    """
+
+    def __init__(self, distribution='constant', **params):
+        if distribution == 'constant':
+            self.sample = lambda: params['value']
+        elif distribution == 'uniform':
+            self.sample = lambda: random.uniform(params['min'], params['max'])
+        elif distribution == 'normal':
+            low, high = params.get('min', 0.0), params.get('max', float('inf'))
+            self.sample = lambda: min(max(random.gauss(params['mean'], params['stddev']), low), high)
+        else:
+            raise ValueError('Unknown response delay distribution: {0}'.format(distribution))
+        self.distribution = distribution
+        self.params = params
+
+    @classmethod
+    def from_xml(cls, element, default=None):
+        """
+        Builds the delay from a template element like <response_delay distribution="uniform" min="0.24" max="0.34"/>.
+        :param element: lxml element, or None to use the default.
+        :param default: ResponseDelay returned if element is None.
+        """
+        if element is None:
+            return default
+        params = dict((key, float(value)) for key, value in element.attrib.items() if key != 'distribution')
+        return cls(element.get('distribution', 'constant'), **params)
+
+    def __repr__(self):
+        return 'ResponseDelay({0!r}, {1!r})'.format(self.distribution, self.params)
+
+
+class ScheduledConnection(object):
+    """
+    The responses scheduled for a single connection. Responses are sent in the order they were scheduled,
+    a response is never sent before the ones scheduled ahead of it even if its own delay is shorter.
+
+    Due responses are written by a greenlet of the connection, which only runs while it has responses to send,
+    so a peer that stops reading only holds up its own responses.
+    """
+
+    def __init__(self, scheduler, sock, max_pending):
+        self.scheduler = scheduler
+        self.sock = sock
+        self.max_pending = max_pending
+        self.pending = 0
+        self.closed = False
+        self._last_due = 0
+        # due responses waiting for the sender
+        self._ready = deque()
+        self._sender = None
+        self._idle = gevent.event.Event()
+        self._idle.set()
+        self._writable = gevent.event.Event()
+        self._writable.set()
+
+    def send(self, data, delay):
+        """
+        Schedules data to be sent once delay seconds have passed. Blocks while max_pending responses are
+        outstanding, which bounds the memory a pipelining client can tie up.
+        :return: False if the connection was dropped by the scheduler.
+        """
+        self._writable.wait()
+        if self.closed:
+            return False
+        self._last_due = max(time.time() + delay, self._last_due)
+        self.pending += 1
+        self._idle.clear()
+        if self.pending >= self.max_pending:
+            self._writable.clear()
+        self.scheduler.push(self._last_due, self, data)
+        return True
+
+    def drain(self, delay=0, timeout=None):
+        """
+        Waits until every scheduled response has been sent and another delay seconds have passed. Responses not
+        sent within timeout seconds are dropped, by default the last response may take send_timeout seconds
+        after it was due.
+        """
+        if delay and not self.closed:
+            self.send('', delay)
+        if timeout is None:
+            timeout = max(self._last_due - time.time(), 0) + self.scheduler.send_timeout
+        if not self._idle.wait(timeout):
+            logger.debug('Dropping %s responses not sent within %s seconds', self.pending, timeout)
+            self._abort()
+
+    def _due(self, data):
+        self._ready.append(data)
+        if self._sender is None:
+            self._sender = gevent.spawn(self._send_ready)
+
+    def _send_ready(self):
+        try:
+            while self._ready and not self.closed:
+                data = self._ready.popleft()
+                try:
+                    with gevent.Timeout(self.scheduler.send_timeout):
+                        self.sock.sendall(data)
+                except (socket.error, gevent.Timeout), e:
+                    logger.debug('Dropping connection with unsent responses: %s', e or 'send timeout')
+                    self._abort()
+                    try:
+                        self.sock.shutdown(socket.SHUT_RDWR)
+                    except socket.error:
+                        pass
+                else:
+                    self._done()
+        finally:
+            self._sender = None
+
+    def _done(self):
+        self.pending -= 1
+        self._writable.set()
+        if not self.pending:
+            self._idle.set()
+
+    def _abort(self):
+        self.closed = True
+        self.pending = 0
+        self._ready.clear()
+        if self._sender is not None and self._sender is not gevent.getcurrent():
+            self._sender.kill(block=False)
+            self._sender = None
+        self._writable.set()
+        self._idle.set()
+
+
+class ResponseScheduler(object):
+    """
+    Timer queue sending prebuilt responses when they are due.
+
+    Emulated devices answer after a realistic delay. Instead of every request handler sleeping through that
+    delay, handlers schedule the response and go back to reading requests; a single greenlet hands the
+    responses to their connections in due order, without waiting for any socket. A connection whose peer stops
+    reading long enough to block a send for more than send_timeout seconds is shut down.
+    """
+
+    def __init__(self, send_timeout=1):
+        self.send_timeout = send_timeout
+        self._queue = []
+        self._counter = itertools.count()
+        self._wakeup = gevent.event.Event()
+        self._greenlet = None
+
+    def open(self, sock, max_pending=32):
+        """
+        :param sock: connected socket the responses are written to.
+        :param max_pending: maximum number of scheduled but unsent responses (int).
+        :return: ScheduledConnection
+        """
+        return ScheduledConnection(self, sock, max_pending)
+
+    def push(self, due, connection, data):
+        # the counter keeps responses with the same due time in scheduling order
+        heapq.heappush(self._queue, (due, next(self._counter), connection, data))
+        if self._queue[0][2] is connection:
+            self._wakeup.set()
+        if self._greenlet is None or self._greenlet.dead:
+            self._greenlet = gevent.spawn(self._run)
+
+    def _run(self):
+        while True:
+            self._wakeup.clear()
+            if not self._queue:
+                self._wakeup.wait()
+                continue
+            due = self._queue[0][0]
+            now = time.time()
+            if due > now:
+                self._wakeup.wait(due - now)
+                continue
+            _, _, connection, data = heapq.heappop(self._queue)
+            if not connection.closed:
+                connection._due(data)
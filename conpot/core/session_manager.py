@@ -15,10 +15,19 @@
 # Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
+import logging
+import time
+from collections import Counter
+from datetime import datetime
+
 from gevent.queue import Queue
 
 from conpot.core.attack_session import AttackSession
 from conpot.core.databus import Databus
+from conpot.core.shared_databus import SharedDatabus
+
+
+logger = logging.getLogger(__name__)
 
 
 # one instance only
@@ -27,6 +36,8 @@ class SessionManager(object):
         self._sessions = []
         self._databus = Databus()
         self.log_queue = Queue()
+        # called with every new session, conpot.core.workers forwards them to the supervisor
+        self.session_listener = None
 
     def _find_sessions(self, protocol, source_ip):
         for session in self._sessions:
@@ -41,6 +52,8 @@ class SessionManager(object):
         if not attack_session:
             attack_session = AttackSession(protocol, source_ip, source_port, self._databus, self.log_queue)
             self._sessions.append(attack_session)
+            if self.session_listener:
+                self.session_listener(attack_session)
         return attack_session
 
     def get_session_count(self, protocol=None):
@@ -53,9 +66,32 @@ class SessionManager(object):
             count = len(self._sessions)
         return count
 
+    def get_session_counts(self):
+        """ :return: Counter of the sessions per protocol. """
+        return Counter(session.protocol for session in self._sessions)
+
+    def expire_sessions(self, timeout):
+        for session in list(self._sessions):
+            if len(session.data) > 0:
+                sec_last_event = max(session.data) / 1000
+            else:
+                sec_last_event = 0
+            sec_session_start = time.mktime(session.timestamp.timetuple())
+            sec_now = time.mktime(datetime.utcnow().timetuple())
+            if (sec_now - (sec_session_start + sec_last_event)) >= timeout:
+                # TODO: We need to close sockets in this case
+                logger.info('Session timed out: %s', session.id)
+                session.set_ended()
+                self._sessions.remove(session)
+
     def purge_sessions(self):
+        # sessions keep a reference to the queue, they would log to the old one
+        self._sessions = []
         # there is no native purge/clear mechanism for gevent queues, so...
         self.log_queue = Queue()
 
-    def initialize_databus(self, config_file):
+    def initialize_databus(self, config_file, shared_memory=0):
+        """ :param shared_memory: Size of the shared memory segment holding the values, 0 keeps them in process. """
+        if shared_memory:
+            self._databus = SharedDatabus(shared_memory)
         self._databus.initialize(config_file)
@@ -0,0 +1,244 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# Databus keeping its values in a shared memory segment, inherited by the worker processes forked after it was
+# created. The segment holds a header, a table of key slots and a heap of marshalled values:
+#
+#   header:  magic, number of slots, number of keys, generation, bytes of the heap in use
+#   slot:    key, offset and capacity of its value in the heap, length of the value, version
+#
+# Writes are serialized by a lock on the backing file and bump the version of their slot twice, it is odd while the
+# value is being written. Readers take no lock, they read the version before and after the value and retry when the
+# value changed under them. Every write also bumps the generation, which the processes observing keys poll to notify
+# their observers of the writes of other processes.
+
+import fcntl
+import json
+import logging
+import marshal
+import mmap
+import os
+import struct
+import tempfile
+
+import gevent
+
+from conpot.core.databus import Databus
+from conpot.core.workers import shareable
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = 'CDBS'
+HEADER = struct.Struct('<4sIIQQ')
+SLOT = struct.Struct('<64sQIIQ')
+KEY_SIZE = 64
+# position of the version in a slot
+SLOT_VERSION = KEY_SIZE + 16
+VERSION = struct.Struct('<Q')
+
+
+class SharedDatabus(Databus):
+    def __init__(self, size=1024 * 1024, slots=1024, poll_interval=0.1):
+        super(SharedDatabus, self).__init__()
+        self.slots = slots
+        self.poll_interval = poll_interval
+        self.heap_start = HEADER.size + slots * SLOT.size
+        if size <= self.heap_start:
+            raise ValueError('Shared databus of {0} bytes cannot hold {1} key slots'.format(size, slots))
+        # the file is only needed for its lock, the memory is shared with the processes forked later on
+        self._file = tempfile.TemporaryFile(prefix='conpot_databus')
+        self._file.truncate(size)
+        self._mmap = mmap.mmap(self._file.fileno(), size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        HEADER.pack_into(self._mmap, 0, MAGIC, slots, 0, 0, 0)
+        # key -> slot number, a cache of the slot table
+        self._index = {}
+        # key -> last version the observers of this process were notified of
+        self._observed_versions = {}
+        self._watcher = None
+        self._watcher_pid = None
+
+    def _lock(self):
+        fcntl.lockf(self._file.fileno(), fcntl.LOCK_EX, 1, 0)
+
+    def _unlock(self):
+        fcntl.lockf(self._file.fileno(), fcntl.LOCK_UN, 1, 0)
+
+    def _header(self):
+        return HEADER.unpack_from(self._mmap, 0)
+
+    def _slot_position(self, slot):
+        return HEADER.size + slot * SLOT.size
+
+    def _refresh_index(self):
+        keys = self._header()[2]
+        if keys < len(self._index):
+            # reset by another process
+            self._index.clear()
+        # keys added by other processes
+        for slot in range(len(self._index), keys):
+            slot_key = SLOT.unpack_from(self._mmap, self._slot_position(slot))[0].rstrip('\x00')
+            self._index[slot_key] = slot
+
+    def _find_slot(self, key):
+        if key not in self._index:
+            self._refresh_index()
+        return self._index.get(key)
+
+    def _read(self, slot):
+        """ :return: The version and the marshalled value of a slot, consistent with each other. """
+        position = self._slot_position(slot)
+        while True:
+            _, offset, _, length, version = SLOT.unpack_from(self._mmap, position)
+            if version & 1:
+                # being written
+                gevent.sleep(0)
+                continue
+            data = self._mmap[offset:offset + length]
+            if VERSION.unpack_from(self._mmap, position + SLOT_VERSION)[0] == version:
+                return version, data
+
+    def _write(self, key, data, expected_version=None):
+        """ :return: The new version of the key, or None if its version was not the expected one. """
+        if len(key) > KEY_SIZE:
+            raise ValueError('Databus key longer than {0} bytes: {1}'.format(KEY_SIZE, key))
+        self._lock()
+        try:
+            _, slots, keys, generation, heap_used = self._header()
+            slot = self._find_slot(key)
+            if slot is None:
+                if expected_version:
+                    return None
+                if keys == slots:
+                    raise MemoryError('Shared databus has no free slot for key {0}'.format(key))
+                slot = keys
+                SLOT.pack_into(self._mmap, self._slot_position(slot), key, 0, 0, 0, 0)
+                keys += 1
+                self._index[key] = slot
+            position = self._slot_position(slot)
+            _, offset, capacity, _, version = SLOT.unpack_from(self._mmap, position)
+            if expected_version is not None and version != expected_version:
+                return None
+            if len(data) > capacity:
+                # the old space is not reused, values rarely outgrow twice the size they were allocated with
+                capacity = max(64, len(data) * 2)
+                offset = self.heap_start + heap_used
+                if offset + capacity > len(self._mmap):
+                    raise MemoryError('Shared databus of {0} bytes is full'.format(len(self._mmap)))
+                heap_used += capacity
+            VERSION.pack_into(self._mmap, position + SLOT_VERSION, version + 1)
+            self._mmap[offset:offset + len(data)] = data
+            SLOT.pack_into(self._mmap, position, key, offset, capacity, len(data), version + 2)
+            HEADER.pack_into(self._mmap, 0, MAGIC, slots, keys, generation + 1, heap_used)
+            return version + 2
+        finally:
+            self._unlock()
+
+    def get_value(self, key):
+        if key in self._data:
+            return super(SharedDatabus, self).get_value(key)
+        return self.get_versioned_value(key)[0]
+
+    def get_versioned_value(self, key):
+        """ :return: The value of a key and its version, which is increased by every write of the key. """
+        slot = self._find_slot(key)
+        assert slot is not None
+        version, data = self._read(slot)
+        return marshal.loads(data), version
+
+    def set_value(self, key, value):
+        if not shareable(value):
+            super(SharedDatabus, self).set_value(key, value)
+            return
+        logger.debug('DataBus: Storing key: [%s] value: [%s]', key, value)
+        self._data.pop(key, None)
+        self._stored(key, self._write(key, marshal.dumps(value)))
+
+    def compare_and_set(self, key, value, version):
+        """ Sets the value of a key only if it still has the version read before. :return: True if it was set. """
+        new_version = self._write(key, marshal.dumps(value), version)
+        if new_version is None:
+            return False
+        self._stored(key, new_version)
+        return True
+
+    def apply_value(self, key, value):
+        if shareable(value):
+            # written by another process, already in the segment
+            self._stored(key, self.get_versioned_value(key)[1])
+        else:
+            super(SharedDatabus, self).apply_value(key, value)
+
+    def _stored(self, key, version):
+        if key in self._observer_map:
+            self._observed_versions[key] = version
+            gevent.spawn(self.notify_observers, key)
+
+    def observe_value(self, key, callback):
+        super(SharedDatabus, self).observe_value(key, callback)
+        slot = self._find_slot(key)
+        if key not in self._observed_versions:
+            self._observed_versions[key] = self._read(slot)[0] if slot is not None else 0
+        if self._watcher_pid != os.getpid():
+            self._watcher = gevent.spawn(self._watch, os.getpid())
+            self._watcher_pid = os.getpid()
+
+    def _watch(self, pid):
+        # the first poll compares against the versions recorded by observe_value, writes made before
+        # this greenlet got to run are not missed.
+        generation = None
+        while True:
+            gevent.sleep(self.poll_interval)
+            if os.getpid() != pid:
+                # inherited by a forked process, which starts its own
+                return
+            current = self._header()[3]
+            if current == generation:
+                continue
+            generation = current
+            for key, seen in self._observed_versions.items():
+                slot = self._find_slot(key)
+                if slot is None:
+                    continue
+                version = self._read(slot)[0]
+                if version != seen:
+                    self._observed_versions[key] = version
+                    gevent.spawn(self.notify_observers, key)
+
+    def keys(self):
+        self._refresh_index()
+        return list(self._data) + [key for key in self._index if key not in self._data]
+
+    def get_shapshot(self):
+        snapshot = {}
+        for key in self.keys():
+            snapshot[key] = self.get_value(key)
+        return json.dumps(snapshot)
+
+    def reset(self):
+        super(SharedDatabus, self).reset()
+        if self._watcher:
+            self._watcher.kill()
+            self._watcher = self._watcher_pid = None
+        self._observed_versions.clear()
+        self._lock()
+        try:
+            generation = self._header()[3]
+            HEADER.pack_into(self._mmap, 0, MAGIC, self.slots, 0, generation + 1, 0)
+            self._index.clear()
+        finally:
+            self._unlock()
@@ -0,0 +1,172 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import errno
+import logging
+from collections import deque
+
+import gevent
+import gevent.event
+from gevent import socket
+from gevent.queue import Queue, Full
+
+
+logger = logging.getLogger(__name__)
+
+_WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK)
+
+
+class UDPServer(object):
+    """
+    Datagram server shared by the UDP based protocols.
+
+    A single receiver greenlet drains the socket in batches whenever it becomes readable and
+    hands the datagrams to a fixed set of worker greenlets through a bounded queue. Datagrams
+    arriving while the queue is full are dropped instead of spawning more work. Replies passed
+    to sendto are queued and flushed in batches by a sender greenlet, replies exceeding the bound
+    of that queue are dropped as well.
+    The interface (handle(data, address), start, serve_forever, stop, sendto) mirrors
+    gevent's DatagramServer.
+    """
+
+    def __init__(self, listener, handle, workers=8, queue_size=1024, batch_size=64, buffer_size=65535,
+                 send_queue_size=1024):
+        """
+        :param listener:    (host, port) tuple or an already bound datagram socket.
+        :param handle:      callable(data, address) invoked for every received datagram.
+        :param workers:     number of greenlets processing datagrams concurrently (int).
+        :param queue_size:  maximum number of received but unprocessed datagrams (int).
+        :param batch_size:  maximum number of datagrams read per readable event (int).
+        :param buffer_size: maximum datagram size (int).
+        :param send_queue_size: maximum number of replies waiting for the socket to become writable (int).
+        """
+        if hasattr(listener, 'recvfrom'):
+            self.socket = listener
+        else:
+            self.socket = None
+            self.address = listener
+        self.handle = handle
+        self.workers = workers
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self.stats = {'received': 0, 'dropped': 0, 'sent': 0, 'send_dropped': 0, 'send_errors': 0,
+                      'handler_errors': 0}
+        self._queue = Queue(queue_size)
+        self._outgoing = deque()
+        self.send_queue_size = send_queue_size
+        self._outgoing_ready = gevent.event.Event()
+        self._greenlets = []
+        self._stopped_event = gevent.event.Event()
+
+    @property
+    def server_port(self):
+        return self.socket.getsockname()[1]
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['queue_depth'] = self.queue_depth
+        stats['send_queue_depth'] = len(self._outgoing)
+        return stats
+
+    def init_socket(self):
+        if self.socket is None:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.socket.bind(self.address)
+        # all socket calls must fail with EWOULDBLOCK instead of waiting, waiting is done explicitly.
+        self.socket.setblocking(0)
+        self.address = self.socket.getsockname()
+
+    def start(self):
+        if self._greenlets:
+            return
+        self.init_socket()
+        self._stopped_event.clear()
+        self._greenlets.append(gevent.spawn(self._receive))
+        self._greenlets.append(gevent.spawn(self._send))
+        for _ in range(self.workers):
+            self._greenlets.append(gevent.spawn(self._work))
+
+    def serve_forever(self):
+        self.start()
+        self._stopped_event.wait()
+
+    def stop(self):
+        gevent.killall(self._greenlets)
+        self._greenlets = []
+        if self.socket:
+            self.socket.close()
+        self._stopped_event.set()
+
+    def sendto(self, data, address):
+        if len(self._outgoing) >= self.send_queue_size:
+            # the peer or the network does not keep up, e.g. under an amplification scan
+            self.stats['send_dropped'] += 1
+            return
+        self._outgoing.append((data, address))
+        self._outgoing_ready.set()
+
+    def _receive(self):
+        fileno = self.socket.fileno()
+        while True:
+            socket.wait_read(fileno)
+            for _ in xrange(self.batch_size):
+                try:
+                    data, address = self.socket.recvfrom(self.buffer_size)
+                except socket.error as e:
+                    if e.args[0] in _WOULD_BLOCK:
+                        break
+                    # e.g. ECONNREFUSED caused by an ICMP port unreachable for an earlier reply.
+                    logger.debug('UDP receive error on %s: %s', self.address, e)
+                    continue
+                self.stats['received'] += 1
+                try:
+                    self._queue.put_nowait((data, address))
+                except Full:
+                    self.stats['dropped'] += 1
+
+    def _work(self):
+        while True:
+            data, address = self._queue.get()
+            try:
+                self.handle(data, address)
+            except Exception:
+                self.stats['handler_errors'] += 1
+                logger.exception('Unhandled exception while processing datagram from %s', address)
+
+    def _send(self):
+        fileno = self.socket.fileno()
+        while True:
+            self._outgoing_ready.wait()
+            self._outgoing_ready.clear()
+            while self._outgoing:
+                data, address = self._outgoing[0]
+                try:
+                    self.socket.sendto(data, address)
+                except socket.error as e:
+                    if e.args[0] in _WOULD_BLOCK:
+                        socket.wait_write(fileno)
+                        continue
+                    self.stats['send_errors'] += 1
+                    logger.debug('UDP send error to %s: %s', address, e)
+                else:
+                    self.stats['sent'] += 1
+                self._outgoing.popleft()
@@ -0,0 +1,299 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# Multi-process mode.
+#
+# The supervisor forks N workers before it starts anything else. Every worker binds the TCP protocol ports with
+# SO_REUSEPORT, so the kernel spreads the incoming connections over the workers. Each worker is connected to the
+# supervisor by a socket pair carrying pickled messages:
+#
+#   worker -> supervisor:  ('event', event), ('session', protocol, ip, port, id), ('set', key, value),
+#                          ('metrics', snapshot)
+#   supervisor -> worker:  ('set', key, value), ('ack', key)
+#
+# The supervisor runs the log worker and is the only process writing logs. Databus writes of any process are
+# ordered by the supervisor and sent to every other worker, the worker the write came from gets an ack instead. Until
+# then the worker ignores the writes of the key sent by the supervisor, they were ordered before its own write. So all
+# processes end up with the last value in the order of the supervisor. A SharedDatabus keeps its values in memory
+# shared by all processes and its writes are not sent.
+
+import cPickle
+import logging
+import os
+import signal
+import struct
+import sys
+from collections import Counter
+
+import gevent
+from gevent import socket
+from gevent.queue import Queue
+
+
+logger = logging.getLogger(__name__)
+
+# not exported by the socket module of Python 2
+if hasattr(socket, 'SO_REUSEPORT'):
+    SO_REUSEPORT = socket.SO_REUSEPORT
+elif sys.platform.startswith('linux'):
+    SO_REUSEPORT = 15
+elif sys.platform == 'darwin' or sys.platform.startswith('freebsd'):
+    SO_REUSEPORT = 0x200
+else:
+    SO_REUSEPORT = None
+
+HEADER = struct.Struct('!I')
+
+_reuse_port = False
+
+
+def enable_reuse_port():
+    global _reuse_port
+    if SO_REUSEPORT is None:
+        raise RuntimeError('SO_REUSEPORT is not available on {0}'.format(sys.platform))
+    _reuse_port = True
+
+
+def get_listener(address, backlog=128):
+    """ :return: The address for the StreamServer to bind, or a listening socket sharing its port between workers. """
+    if not _reuse_port:
+        return address
+    family, socktype, proto, _, sockaddr = socket.getaddrinfo(address[0], address[1], 0, socket.SOCK_STREAM)[0]
+    sock = socket.socket(family, socktype, proto)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+    sock.bind(sockaddr)
+    sock.listen(backlog)
+    return sock
+
+
+def shareable(value):
+    """ Values computed by an object in each process are not replicated. """
+    return not hasattr(value, '__call__') and not hasattr(value, 'get_value')
+
+
+class WorkerExited(Exception):
+    pass
+
+
+class Channel(object):
+    """ Message stream over a socket. Messages are sent by one greenlet, batching what was queued meanwhile. """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.outgoing = Queue()
+        self.sender = gevent.spawn(self._send)
+
+    def send(self, message):
+        try:
+            data = cPickle.dumps(message, cPickle.HIGHEST_PROTOCOL)
+        except (cPickle.PicklingError, TypeError), e:
+            logger.warning('Dropped message that cannot be sent to another process: %s', e)
+            return
+        self.outgoing.put(HEADER.pack(len(data)) + data)
+
+    def _send(self):
+        while True:
+            frames = [self.outgoing.get()]
+            while not self.outgoing.empty() and len(frames) < 256:
+                frames.append(self.outgoing.get())
+            try:
+                self.sock.sendall(''.join(frames))
+            except socket.error:
+                # the receiving process is gone, the reading side of the channel reports it
+                return
+
+    def _read(self, size):
+        data = ''
+        while len(data) < size:
+            try:
+                chunk = self.sock.recv(size - len(data))
+            except socket.error:
+                chunk = ''
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def __iter__(self):
+        """ Yields the received messages until the other process closes the channel. """
+        while True:
+            header = self._read(HEADER.size)
+            if header is None:
+                return
+            data = self._read(HEADER.unpack(header)[0])
+            if data is None:
+                return
+            yield cPickle.loads(data)
+
+    def close(self):
+        self.sender.kill()
+        self.sock.close()
+
+
+class Worker(object):
+    """ Connects the session manager and databus of a worker process to the supervisor. """
+
+    def __init__(self, channel, session_manager, session_timeout=30, metrics=None, metrics_interval=5):
+        """ :param metrics: Metrics sent to the supervisor every metrics_interval seconds. """
+        self.channel = channel
+        self.session_manager = session_manager
+        self.databus = session_manager._databus
+        self.session_timeout = session_timeout
+        self.metrics = metrics
+        self.metrics_interval = metrics_interval
+        # key -> writes sent to the supervisor and not acknowledged yet
+        self.pending = Counter()
+        self.greenlets = []
+
+    def start(self):
+        self.session_manager.session_listener = self._new_session
+        self.databus.replicate = self._replicate
+        self.greenlets = [gevent.spawn(self._forward_events), gevent.spawn(self._expire_sessions)]
+        if self.metrics:
+            self.greenlets.append(gevent.spawn(self._send_metrics))
+        self.receiver = gevent.spawn(self._receive)
+
+    def join(self):
+        """ Returns once the supervisor has gone away. """
+        self.receiver.join()
+        gevent.killall(self.greenlets)
+
+    def _new_session(self, session):
+        self.channel.send(('session', session.protocol, session.source_ip, session.source_port, str(session.id)))
+
+    def _replicate(self, key, value):
+        if shareable(value):
+            self.pending[key] += 1
+            self.channel.send(('set', key, value))
+
+    def _forward_events(self):
+        while True:
+            self.channel.send(('event', self.session_manager.log_queue.get()))
+
+    def _expire_sessions(self):
+        # the supervisor's log worker only sees the sessions of the supervisor process
+        while True:
+            gevent.sleep(2)
+            self.session_manager.expire_sessions(self.session_timeout)
+
+    def _send_metrics(self):
+        while True:
+            gevent.sleep(self.metrics_interval)
+            self.channel.send(('metrics', self.metrics.snapshot()))
+
+    def _receive(self):
+        for message in self.channel:
+            kind, key = message[:2]
+            if kind == 'ack':
+                self.pending[key] -= 1
+                if not self.pending[key]:
+                    del self.pending[key]
+            elif key not in self.pending:
+                self.databus.apply_value(key, message[2])
+        logger.info('Supervisor closed the channel, worker %s stopping', os.getpid())
+
+
+class Supervisor(object):
+    """ Forks the worker processes and aggregates their sessions, log events and databus writes. """
+
+    def __init__(self, workers, run_worker, session_manager, metrics=None):
+        """
+        :param run_worker: Called with the Channel to the supervisor in every worker process, the process exits
+                           when it returns.
+        :param metrics: Metrics including those sent by the workers.
+        """
+        self.workers = workers
+        self.run_worker = run_worker
+        self.session_manager = session_manager
+        self.metrics = metrics
+        self.databus = session_manager._databus
+        # pid -> socket to the worker
+        self.sockets = {}
+        # pid -> Channel over that socket, once started
+        self.channels = {}
+        self.session_counts = Counter()
+
+    def fork(self):
+        """ Must be called before any server or greenlet is started, the workers would inherit them. """
+        for _ in range(self.workers):
+            supervisor_end, worker_end = socket.socketpair()
+            pid = gevent.fork()
+            if pid == 0:
+                supervisor_end.close()
+                for sock in self.sockets.values():
+                    sock.close()
+                status = 0
+                try:
+                    self.run_worker(Channel(worker_end))
+                except SystemExit, e:
+                    status = e.code
+                except Exception:
+                    logger.exception('Worker %s failed', os.getpid())
+                    status = 1
+                finally:
+                    # write what the log handlers still hold
+                    logging.shutdown()
+                    os._exit(status)
+            worker_end.close()
+            self.sockets[pid] = supervisor_end
+            logger.info('Started worker %s', pid)
+
+    def start(self):
+        """ :return: The greenlets receiving from the workers, they raise WorkerExited when a worker is gone. """
+        self.databus.replicate = self._broadcast
+        greenlets = []
+        for pid, sock in self.sockets.items():
+            self.channels[pid] = Channel(sock)
+            greenlets.append(gevent.spawn(self._receive, pid, self.channels[pid]))
+        return greenlets
+
+    def _receive(self, pid, channel):
+        for message in channel:
+            kind = message[0]
+            if kind == 'event':
+                self.session_manager.log_queue.put(message[1])
+            elif kind == 'session':
+                _, protocol, source_ip, source_port, session_id = message
+                self.session_counts[protocol] += 1
+                logger.debug('Worker %s: new %s session from %s:%s (%s)', pid, protocol, source_ip, source_port,
+                             session_id)
+            elif kind == 'set':
+                _, key, value = message
+                self.databus.apply_value(key, value)
+                self._broadcast(key, value, pid)
+            elif kind == 'metrics' and self.metrics:
+                self.metrics.update_remote(pid, message[1])
+        raise WorkerExited('Worker {0} exited'.format(pid))
+
+    def _broadcast(self, key, value, source=None):
+        """ :param source: Worker the write came from, it already applied the write. """
+        if shareable(value):
+            for pid, channel in self.channels.items():
+                if pid == source:
+                    channel.send(('ack', key))
+                else:
+                    channel.send(('set', key, value))
+
+    def stop(self):
+        for channel in self.channels.values():
+            channel.close()
+        for pid in self.sockets:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
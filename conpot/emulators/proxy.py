@@ -15,8 +15,8 @@
 # Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
+import binascii
 import logging
-import select
 import socket as _socket
 
 import gevent
@@ -30,6 +30,53 @@ import conpot.core as conpot_core
 logger = logging.getLogger(__name__)
 
 
+class RelayLog(object):
+    """
+    Aggregates the traffic of one direction of a proxied connection. Data is logged as a single session event
+    and decoded once buffer_size bytes have been relayed or flush_interval seconds after the first byte of the
+    pending data, whichever comes first.
+    """
+
+    def __init__(self, session, inbound, decode=None, buffer_size=65536, flush_interval=1):
+        self.session = session
+        self.inbound = inbound
+        self.decode = decode
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.buffer = bytearray()
+        self._timer = None
+
+    def add(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = gevent.spawn_later(self.flush_interval, self.flush)
+
+    def flush(self):
+        timer, self._timer = self._timer, None
+        if timer is not None and timer is not gevent.getcurrent():
+            timer.kill(block=False)
+        if not self.buffer:
+            return
+        data, self.buffer = str(self.buffer), bytearray()
+        hex_data = binascii.hexlify(data)
+        if self.inbound:
+            logger.debug('Received %s bytes from outside to proxied service: %s', len(data), hex_data)
+            self.session.add_event({'raw_request': hex_data, 'raw_response': ''})
+        else:
+            logger.debug('Received %s bytes from proxied service: %s', len(data), hex_data)
+            self.session.add_event({'raw_request': '', 'raw_response': hex_data})
+        if self.decode:
+            decoded = self.decode(data)
+            if self.inbound:
+                logger.debug('Decoded request: %s', decoded)
+                self.session.add_event({'request': decoded, 'raw_response': ''})
+            else:
+                logger.debug('Decoded response: %s', decoded)
+                self.session.add_event({'request': '', 'raw_response': decoded})
+
+
 class Proxy(object):
     def __init__(self, name, proxy_host, proxy_port, decoder=None, keyfile=None, certfile=None):
         self.proxy_host = proxy_host
@@ -40,11 +87,15 @@ class Proxy(object):
         self.port = None
         self.keyfile = keyfile
         self.certfile = certfile
+        # bytes relayed per recv, and aggregated per logged event
+        self.buffer_size = 65536
+        # seconds before pending traffic is logged
+        self.flush_interval = 1
         if decoder:
             namespace, _classname = decoder.rsplit('.', 1)
             module = __import__(namespace, fromlist=[_classname])
-            _class = getattr(module, _classname)
-            self.decoder = _class()
+            # decoders keep parsing state, every connection gets its own instance
+            self.decoder = getattr(module, _classname)
         else:
             self.decoder = None
 
@@ -78,80 +129,38 @@ class Proxy(object):
             self._close([proxy_socket, sock])
             return
 
-        sockets = [proxy_socket, sock]
-        while len(sockets) == 2:
-            gevent.sleep()
-            sockets_read, _, sockets_err = select.select(sockets, [], sockets, 10)
-
-            if len(sockets_err) > 0:
-                self._close([proxy_socket, sock])
-                break
-
-            for s in sockets_read:
-                socket_close_reason = 'socket closed'
-                try:
-                    data = s.recv(1024)
-                except _socket.error as socket_err:
-                    data = []
-                    socket_close_reason = str(socket_err)
-                if len(data) is 0:
-                    self._close([proxy_socket, sock])
-                    if s is proxy_socket:
-                        logging.warning(
-                            'Closing proxied socket while receiving (%s, %s): %s.', 
-                            self.proxy_host, self.proxy_port, socket_close_reason)
-                        sockets = []
-                        break
-                    elif s is sock:
-                        logging.warning(
-                            'Closing connection to remote while receiving from remote (%s, %s): %s',
-                            socket_close_reason, address[0], address[1])
-                        sockets = []
-                        break
-                    else:
-                        assert False
-
-                try:
-                    if s is proxy_socket:
-                        self.handle_out_data(data, sock, session)
-                    elif s is sock:
-                        self.handle_in_data(data, proxy_socket, session)
-                    else:
-                        assert False
-                except _socket.error as socket_err:
-                    if s is proxy_socket:
-                        destination = 'proxied socket'
-                    else:
-                        destination = 'remote connection'
-                    logger.warning('Error while sending data to %s: %s.', destination, str(socket_err))
-                    sockets = []
-                    break
+        decoder = self.decoder() if self.decoder else None
+        in_log = RelayLog(session, True, decoder and decoder.decode_in, self.buffer_size, self.flush_interval)
+        out_log = RelayLog(session, False, decoder and decoder.decode_out, self.buffer_size, self.flush_interval)
+        relays = [gevent.spawn(self.relay, sock, proxy_socket, in_log, 'remote connection', 'proxied socket'),
+                  gevent.spawn(self.relay, proxy_socket, sock, out_log, 'proxied socket', 'remote connection')]
+        # the connection ends as soon as either side closes
+        gevent.joinall(relays, count=1)
+        gevent.killall(relays)
+        in_log.flush()
+        out_log.flush()
 
         session.set_ended()
-        proxy_socket.close()
-        sock.close()
-
-    def handle_in_data(self, data, sock, session):
-        hex_data = data.encode('hex_codec')
-        session.add_event({'raw_request': hex_data, 'raw_response': ''})
-        logger.debug('Received %s bytes from outside to proxied service: %s', len(data), hex_data)
-        if self.decoder:
-            # TODO: data could be chunked, proxy needs to handle this
-            decoded = self.decoder.decode_in(data)
-            logger.debug('Decoded request: %s', decoded)
-            session.add_event({'request': decoded, 'raw_response': ''})
-        sock.send(data)
-
-    def handle_out_data(self, data, sock, session):
-        hex_data = data.encode('hex_codec')
-        session.add_event({'raw_request': '', 'raw_response': hex_data})
-        logger.debug('Received %s bytes from proxied service: %s', len(data), hex_data)
-        if self.decoder:
-            # TODO: data could be chunked, proxy needs to handle this
-            decoded = self.decoder.decode_out(data)
-            logger.debug('Decoded response: %s', decoded)
-            session.add_event({'request': '', 'raw_response': decoded})
-        sock.send(data)
+        self._close([proxy_socket, sock])
+
+    def relay(self, source, destination, log, source_name, destination_name):
+        buf = bytearray(self.buffer_size)
+        view = memoryview(buf)
+        while True:
+            try:
+                length = source.recv_into(buf)
+            except _socket.error as socket_err:
+                logger.warning('Closing connection while receiving from %s: %s.', source_name, socket_err)
+                return
+            if not length:
+                logger.info('Closing connection, %s closed.', source_name)
+                return
+            try:
+                destination.sendall(view[:length])
+            except _socket.error as socket_err:
+                logger.warning('Error while sending data to %s: %s.', destination_name, socket_err)
+                return
+            log.add(view[:length])
 
     def _close(self, sockets):
         for s in sockets:
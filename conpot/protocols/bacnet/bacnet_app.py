@@ -33,17 +33,45 @@ from bacpypes.apdu import APDU, apdu_types, confirmed_request_types, unconfirmed
     ErrorPDU, RejectPDU, IAmRequest, IHaveRequest, ReadPropertyACK, ConfirmedServiceChoice, UnconfirmedServiceChoice
 from bacpypes.pdu import PDU
 import ast
+import copy
+
+
+class EncodedResponse(object):
+    """
+    A response APDU encoded once into ready to send bytes.
+    """
+    def __init__(self, response_apdu):
+        apdu = APDU()
+        response_apdu.encode(apdu)
+        pdu = PDU()
+        apdu.encode(pdu)
+        self.data = pdu.pduData
+        self.destination = response_apdu.pduDestination
+        self.name = response_apdu.__class__.__name__
+        self.apdu_type = apdu_types.get(response_apdu.apduType).__name__
+        self.error = isinstance(response_apdu, RejectPDU) or isinstance(response_apdu, ErrorPDU)
+        self.broadcast = not self.error and pdu.pduDestination == '*:*'
+
+    def with_invoke_id(self, invoke_id):
+        # the invoke id of a (non segmented) complex ack is the second octet of the APDU.
+        response = copy.copy(self)
+        response.data = self.data[:1] + chr(invoke_id) + self.data[2:]
+        return response
 
 
 class BACnetApp(BIPSimpleApplication):
+    # service choice -> name of the handling method, the handlers return the response APDU (or None)
+    # so that requests can be processed concurrently.
+    confirmed_services = dict((value, key) for key, value in ConfirmedServiceChoice.enumerations.items())
+    unconfirmed_services = dict((value, key) for key, value in UnconfirmedServiceChoice.enumerations.items())
+
     def __init__(self, device, datagram_server):
-        self._request = None
-        self._response = None
-        self._response_service = None
         self.localDevice = device
         self.objectName = {device.objectName: device}
         self.objectIdentifier = {device.objectIdentifier: device}
         self.datagram_server = datagram_server
+        # encoded I-Am, I-Have and ReadProperty responses, see invalidate_cache
+        self.response_cache = {}
 
     def get_objects_and_properties(self, dom):
         # parse the bacnet template for objects and their properties
@@ -103,6 +131,7 @@ class BACnetApp(BIPSimpleApplication):
         self.objectName[object_name] = obj
         self.objectIdentifier[object_identifier] = obj
         self.localDevice.objectList.append(object_identifier)
+        self.invalidate_cache()
 
     def add_property(self, prop_name, prop_value):
         if not prop_name:
@@ -112,14 +141,31 @@ class BACnetApp(BIPSimpleApplication):
 
         setattr(self.localDevice, prop_name, prop_value)
         self.localDevice.propertyList.append(prop_name)
+        self.invalidate_cache()
+
+    def update_device_property(self, prop_name, prop_value):
+        # the device is looked up by name and identifier, both mappings have to follow a change.
+        device = self.localDevice
+        if prop_name == 'objectName':
+            del self.objectName[device.objectName]
+        elif prop_name == 'objectIdentifier':
+            del self.objectIdentifier[device.objectIdentifier]
+        setattr(device, prop_name, prop_value)
+        if prop_name == 'objectName':
+            self.objectName[device.objectName] = device
+        elif prop_name == 'objectIdentifier':
+            self.objectIdentifier[device.objectIdentifier] = device
+        self.invalidate_cache()
+
+    def invalidate_cache(self, *args):
+        # must be called whenever an object or property served from the cache changes.
+        self.response_cache.clear()
 
     def iAm(self, *args):
-        self._response = None
-        return
+        return None
 
     def iHave(self, *args):
-        self._response = None
-        return
+        return None
 
     def whoIs(self, request, address, invoke_key, device):
         # Limits are optional (but if used, must be paired)
@@ -127,7 +173,7 @@ class BACnetApp(BIPSimpleApplication):
         try:
             if (request.deviceInstanceRangeLowLimit is not None) and \
                     (request.deviceInstanceRangeHighLimit is not None):
-                if (request.deviceInstanceRangeLowLimit > self.objectIdentifier.keys()[0][1]
+                if (request.deviceInstanceRangeLowLimit > self.localDevice.objectIdentifier[1]
                         > request.deviceInstanceRangeHighLimit):
                     logger.info('Bacnet WhoHasRequest out of range')
                 else:
@@ -138,20 +184,25 @@ class BACnetApp(BIPSimpleApplication):
             execute = True
 
         if execute:
-            self._response_service = 'IAmRequest'
-            self._response = IAmRequest()
-            self._response.pduDestination = GlobalBroadcast()
-            self._response.iAmDeviceIdentifier = self.objectIdentifier.keys()[0][1]
-            self._response.maxAPDULengthAccepted = int(getattr(self.localDevice, 'maxApduLengthAccepted'))
-            self._response.segmentationSupported = getattr(self.localDevice, 'segmentationSupported')
-            self._response.vendorID = int(getattr(self.localDevice, 'vendorIdentifier'))
+            cached = self.response_cache.get(('iAm',))
+            if cached:
+                return cached
+            response = IAmRequest()
+            response.pduDestination = GlobalBroadcast()
+            response.iAmDeviceIdentifier = self.localDevice.objectIdentifier[1]
+            response.maxAPDULengthAccepted = int(getattr(self.localDevice, 'maxApduLengthAccepted'))
+            response.segmentationSupported = getattr(self.localDevice, 'segmentationSupported')
+            response.vendorID = int(getattr(self.localDevice, 'vendorIdentifier'))
+            response = EncodedResponse(response)
+            self.response_cache[('iAm',)] = response
+            return response
 
     def whoHas(self, request, address, invoke_key, device):
         execute = False
         try:
             if (request.deviceInstanceRangeLowLimit is not None) and \
                     (request.deviceInstanceRangeHighLimit is not None):
-                if (request.deviceInstanceRangeLowLimit > self.objectIdentifier.keys()[0][1]
+                if (request.deviceInstanceRangeLowLimit > self.localDevice.objectIdentifier[1]
                         > request.deviceInstanceRangeHighLimit):
                     logger.info('Bacnet WhoHasRequest out of range')
                 else:
@@ -162,23 +213,33 @@ class BACnetApp(BIPSimpleApplication):
             execute = True
 
         if execute:
+            cache_key = ('iHave', request.object.objectIdentifier[0], int(request.object.objectIdentifier[1]))
+            cached = self.response_cache.get(cache_key)
+            if cached:
+                return cached
             for obj in device.objectList.value[2:]:
                 if int(request.object.objectIdentifier[1]) == obj[1] and \
                                 request.object.objectIdentifier[0] == obj[0]:
                     objName = self.objectIdentifier[obj].objectName
-                    self._response_service = 'IHaveRequest'
-                    self._response = IHaveRequest()
-                    self._response.pduDestination = GlobalBroadcast()
-                    self._response.deviceIdentifier = self.objectIdentifier.keys()[0][1]
-                    self._response.objectIdentifier = obj[1]
-                    self._response.objectName = objName
-                    break
+                    response = IHaveRequest()
+                    response.pduDestination = GlobalBroadcast()
+                    response.deviceIdentifier = self.localDevice.objectIdentifier[1]
+                    response.objectIdentifier = obj[1]
+                    response.objectName = objName
+                    response = EncodedResponse(response)
+                    self.response_cache[cache_key] = response
+                    return response
             else:
                 logger.info('Bacnet WhoHasRequest: no object found')
 
     def readProperty(self, request, address, invoke_key, device):
         # Read Property
         # TODO: add support for PropertyArrayIndex handling;
+        cache_key = ('readProperty', request.objectIdentifier[0], int(request.objectIdentifier[1]),
+                     request.propertyIdentifier)
+        cached = self.response_cache.get(cache_key)
+        if cached:
+            return cached.with_invoke_id(invoke_key)
         for obj in device.objectList.value[2:]:
             if int(request.objectIdentifier[1]) == obj[1] and \
                             request.objectIdentifier[0] == obj[0]:
@@ -189,13 +250,12 @@ class BACnetApp(BIPSimpleApplication):
                         propValue = prop.ReadProperty(
                             self.objectIdentifier[obj])
                         propType = prop.datatype()
-                        self._response_service = 'ComplexAckPDU'
-                        self._response = ReadPropertyACK()
-                        self._response.pduDestination = address
-                        self._response.apduInvokeID = invoke_key
-                        self._response.objectIdentifier = obj[1]
-                        self._response.objectName = objName
-                        self._response.propertyIdentifier = propName
+                        response = ReadPropertyACK()
+                        response.pduDestination = address
+                        response.apduInvokeID = invoke_key
+                        response.objectIdentifier = obj[1]
+                        response.objectName = objName
+                        response.propertyIdentifier = propName
 
                         # get the property type
                         for p in dir(sys.modules[propType.__module__]):
@@ -206,20 +266,27 @@ class BACnetApp(BIPSimpleApplication):
                             except TypeError:
                                 pass
                         value = ast.literal_eval(propValue)
-                        self._response.propertyValue = Any(_obj(value))
-                        # self._response.propertyValue.cast_in(objPropVal)
-                        # self._response.debug_contents()
-                        break
+                        response.propertyValue = Any(_obj(value))
+                        # response.propertyValue.cast_in(objPropVal)
+                        # response.debug_contents()
+                        response = EncodedResponse(response)
+                        self.response_cache[cache_key] = response
+                        return response
                 else:
                     logger.info('Bacnet ReadProperty: object has no property %s', request.propertyIdentifier)
-                    self._response = ErrorPDU()
-                    self._response.pduDestination = address
-                    self._response.apduInvokeID = invoke_key
-                    self._response.apduService = 0x0c
-                    # self._response.errorClass
-                    # self._response.errorCode
+                    response = ErrorPDU()
+                    response.pduDestination = address
+                    response.apduInvokeID = invoke_key
+                    response.apduService = 0x0c
+                    # response.errorClass
+                    # response.errorCode
+                    return response
 
     def indication(self, apdu, address, device):
+        """
+        Processes a request APDU.
+        :return: The response APDU or None if the request is not answered.
+        """
         # logging the received PDU type and Service request
         request = None
         apdu_type = apdu_types.get(apdu.apduType)
@@ -234,24 +301,19 @@ class BACnetApp(BIPSimpleApplication):
                 request.decode(apdu)
             except (AttributeError, RuntimeError) as e:
                 logger.warning('Bacnet indication: Invalid service. Error: %s' % e)
-                return
+                return None
             except bacpypes.errors.DecodingError:
                 pass
 
-            for key, value in ConfirmedServiceChoice.enumerations.items():
-                if apdu_service.serviceChoice == value:
-                    try:
-                        getattr(self, key)(
-                            request, address, invoke_key, device)
-                        break
-                    except AttributeError:
-                        logger.error('Not implemented Bacnet command')
-                        self._response = None
-                        return
-            else:
+            service_name = self.confirmed_services.get(apdu_service.serviceChoice)
+            if service_name is None:
                 logger.info('Bacnet indication: Invalid confirmed service choice (%s)', apdu_service.__name__)
-                self._response = None
-                return
+                return None
+            service = getattr(self, service_name, None)
+            if service is None:
+                logger.error('Not implemented Bacnet command')
+                return None
+            return service(request, address, invoke_key, device)
 
         # Unconfirmed request handling
         elif apdu_type.pduType == 0x1:
@@ -262,82 +324,44 @@ class BACnetApp(BIPSimpleApplication):
                 request.decode(apdu)
             except (AttributeError, RuntimeError) as e:
                 logger.warning('Bacnet indication: Invalid service. Error: %s' % e)
-                self._response = None
-                return
+                return None
             except bacpypes.errors.DecodingError:
                 pass
 
-            for key, value in UnconfirmedServiceChoice.enumerations.items():
-                if apdu_service.serviceChoice == value:
-                    try:
-                        getattr(self, key)(
-                            request, address, invoke_key, device)
-                        break
-                    except AttributeError:
-                        logger.error('Not implemented Bacnet command')
-                        self._response = None
-                        return
-            else:
+            service_name = self.unconfirmed_services.get(apdu_service.serviceChoice)
+            if service_name is None:
                 # Unrecognized services
                 logger.info(
                     'Bacnet indication: Invalid unconfirmed service choice (%s)', apdu_service)
-                self._response_service = 'ErrorPDU'
-                self._response = ErrorPDU()
-                self._response.pduDestination = address
-                return
+                response = ErrorPDU()
+                response.pduDestination = address
+                return response
+            service = getattr(self, service_name, None)
+            if service is None:
+                logger.error('Not implemented Bacnet command')
+                return None
+            return service(request, address, invoke_key, device)
+
         # ignore the following
-        elif apdu_type.pduType == 0x2:
-            # simple ack pdu
-            self._response = None
-            return
-        elif apdu_type.pduType == 0x3:
-            # complex ack pdu
-            self._response = None
-            return
-        elif apdu_type.pduType == 0x4:
-            # segment ack
-            self._response = None
-            return
-        elif apdu_type.pduType == 0x5:
-            # error pdu
-            self._response = None
-            return
-        elif apdu_type.pduType == 0x6:
-            # reject pdu
-            self._response = None
-            return
-        elif apdu_type.pduType == 0x7:
-            # abort pdu
-            self._response = None
-            return
-        elif 0x8 <= apdu_type.pduType <= 0xf:
-            # reserved
-            self._response = None
-            return
+        # simple ack (0x2), complex ack (0x3), segment ack (0x4), error (0x5), reject (0x6), abort (0x7)
+        # and reserved (0x8 - 0xf) pdus.
+        elif 0x2 <= apdu_type.pduType <= 0xf:
+            return None
         else:
             # non-BACnet PDU types
             logger.info('Bacnet Unrecognized service')
-            self._response = None
-            return
+            return None
 
     # socket not actually socket, but DatagramServer with sendto method
     def response(self, response_apdu, address):
         if response_apdu is None:
             return
-        apdu = APDU()
-        response_apdu.encode(apdu)
-        pdu = PDU()
-        apdu.encode(pdu)
-        if isinstance(response_apdu, RejectPDU) or isinstance(response_apdu, ErrorPDU):
-            self.datagram_server.sendto(pdu.pduData, address)
+        if not isinstance(response_apdu, EncodedResponse):
+            response_apdu = EncodedResponse(response_apdu)
+        if response_apdu.broadcast:
+            self.datagram_server.sendto(response_apdu.data, ('', address[1]))
         else:
-            apdu_type = apdu_types.get(response_apdu.apduType)
-            if pdu.pduDestination == '*:*':
-                # broadcast
-                # sendto operates under lock
-                self.datagram_server.sendto(pdu.pduData, ('', address[1]))
-            else:
-                # sendto operates under lock
-                self.datagram_server.sendto(pdu.pduData, address)
+            self.datagram_server.sendto(response_apdu.data, address)
+        if not response_apdu.error:
             logger.info('Bacnet response sent to %s (%s:%s)',
-                        response_apdu.pduDestination, apdu_type.__name__, self._response_service)
+                        response_apdu.destination, response_apdu.apdu_type, response_apdu.name)
@@ -19,20 +19,34 @@
 # Brno University of Technology, Faculty of Information Technology
 
 import logging
+import re
 import socket
+import time
 from lxml import etree
 
-from gevent.server import DatagramServer
 from bacpypes.app import LocalDeviceObject
 from bacpypes.apdu import APDU
 from bacpypes.pdu import PDU
 from bacpypes.errors import DecodingError
 
 import conpot.core as conpot_core
+from conpot.core.udp_server import UDPServer
 from conpot.protocols.bacnet.bacnet_app import BACnetApp
 
 logger = logging.getLogger(__name__)
 
+# device_info elements which are not named after their LocalDeviceObject property
+DEVICE_PROPERTIES = {'device_name': 'objectName', 'device_identifier': 'objectIdentifier'}
+INTEGER_PROPERTIES = ('objectIdentifier', 'maxApduLengthAccepted', 'vendorIdentifier')
+
+
+def device_property(tag):
+    if tag in DEVICE_PROPERTIES:
+        return DEVICE_PROPERTIES[tag]
+    # same naming as BACnetApp.get_objects_and_properties, e.g. vendor_name -> vendorName
+    name = re.sub("['_','-']", "", tag.lower().title())
+    return name[0].lower() + name[1:]
+
 
 class BacnetServer(object):
     def __init__(self, template, template_directory, args):
@@ -40,53 +54,64 @@ class BacnetServer(object):
         databus = conpot_core.get_databus()
         device_info_root = self.dom.xpath('//bacnet/device_info')[0]
 
-        name_key = databus.get_value(device_info_root.xpath('./device_name/text()')[0])
-        id_key = device_info_root.xpath('./device_identifier/text()')[0]
-        vendor_name_key = device_info_root.xpath('./vendor_name/text()')[0]
-        vendor_identifier_key = device_info_root.xpath(
-            './vendor_identifier/text()')[0]
-        apdu_length_key = device_info_root.xpath(
-            './max_apdu_length_accepted/text()')[0]
-        segmentation_key = device_info_root.xpath(
-            './segmentation_supported/text()')[0]
+        self.device_name_key = device_info_root.xpath('./device_name/text()')[0]
+        # device_info values naming a databus key are read from the databus, the device properties
+        # (and the cached responses built from them) follow changes of these keys, see device_info_changed.
+        self.device_info_keys = {}
+        databus_keys = set(databus.keys())
+        device_info = {}
+        for element in device_info_root.xpath('./*'):
+            prop_name = device_property(element.tag)
+            value = element.text
+            if value in databus_keys:
+                self.device_info_keys.setdefault(value, []).append(prop_name)
+                value = databus.get_value(value)
+            device_info[prop_name] = self.device_info_value(prop_name, value)
 
         # self.local_device_address = dom.xpath('./@*[name()="host" or name()="port"]')
 
         self.thisDevice = LocalDeviceObject(
-            objectName=name_key,
-            objectIdentifier=int(id_key),
-            maxApduLengthAccepted=int(apdu_length_key),
-            segmentationSupported=segmentation_key,
-            vendorName=vendor_name_key,
-            vendorIdentifier=int(vendor_identifier_key)
+            objectName=device_info['objectName'],
+            objectIdentifier=device_info['objectIdentifier'],
+            maxApduLengthAccepted=device_info['maxApduLengthAccepted'],
+            segmentationSupported=device_info['segmentationSupported'],
+            vendorName=device_info['vendorName'],
+            vendorIdentifier=device_info['vendorIdentifier']
         )
         self.bacnet_app = None
+        self.metrics = conpot_core.get_metrics()
 
         logger.info('Conpot Bacnet initialized using the %s template.', template)
 
     def handle(self, data, address):
         session = conpot_core.get_session('bacnet', address[0], address[1])
-        logger.info('New Bacnet connection from %s:%d. (%s)', address[0], address[1], session.id)
+        logger.info('New Bacnet connection from %s:%d. (%s)', address[0], address[1], session.id,
+                    extra={'source': address[0]})
         session.add_event({'type': 'NEW_CONNECTION'})
-        # I'm not sure if gevent DatagramServer handles issues where the
-        # received data is over the MTU -> fragmentation
+        # fragmented datagrams are reassembled by the kernel, the UDP server reads up to 64k per datagram.
         if data:
+            self.metrics.count('requests', 'bacnet')
+            self.metrics.count('bytes_received', 'bacnet', len(data))
             pdu = PDU()
             pdu.pduData = data
             apdu = APDU()
             try:
                 apdu.decode(pdu)
             except DecodingError as e:
+                self.metrics.count('errors', 'bacnet')
                 logger.error("DecodingError: %s", e)
                 logger.error("PDU: " + format(pdu))
                 return
-            self.bacnet_app.indication(apdu, address, self.thisDevice)
-            self.bacnet_app.response(self.bacnet_app._response, address)
-        logger.info('Bacnet client disconnected %s:%d. (%s)', address[0], address[1], session.id)
+            started = time.time()
+            response = self.bacnet_app.indication(apdu, address, self.thisDevice)
+            self.metrics.observe('bacnet', time.time() - started)
+            self.bacnet_app.response(response, address)
+        logger.info('Bacnet client disconnected %s:%d. (%s)', address[0], address[1], session.id,
+                    extra={'source': address[0]})
 
     def start(self, host, port):
         connection = (host, port)
-        self.server = DatagramServer(connection, self.handle)
+        self.server = UDPServer(connection, self.handle)
         # start to init the socket
         self.server.start()
         self.server.socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
@@ -99,9 +124,26 @@ class BacnetServer(object):
         self.bacnet_app = BACnetApp(self.thisDevice, self.server)
         # get object_list and properties
         self.bacnet_app.get_objects_and_properties(self.dom)
+        # cached responses have to follow changes of databus backed properties
+        databus = conpot_core.get_databus()
+        for key in self.device_info_keys:
+            # get_objects_and_properties sets the remaining device properties from the template text
+            self.device_info_changed(key)
+            databus.observe_value(key, self.device_info_changed)
 
         logger.info('Bacnet server started on: %s', connection)
         self.server.serve_forever()
 
+    @staticmethod
+    def device_info_value(prop_name, value):
+        if prop_name in INTEGER_PROPERTIES:
+            return int(value)
+        return value
+
+    def device_info_changed(self, key):
+        value = conpot_core.get_databus().get_value(key)
+        for prop_name in self.device_info_keys[key]:
+            self.bacnet_app.update_device_property(prop_name, self.device_info_value(prop_name, value))
+
     def stop(self):
         self.server.stop()
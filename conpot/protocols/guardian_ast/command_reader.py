@@ -0,0 +1,85 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+SOH = 0x01
+INQUIRY = ord('I')
+# ^A, 'I', 3 digit function code and 2 digit tank number
+INQUIRY_LENGTH = 7
+
+
+class InvalidCommand(Exception):
+    pass
+
+
+class CommandReader(object):
+    """
+    Splits the byte stream of a Guardian AST connection into commands.
+    Commands start with ^A, inquiry commands (^AIfffTT) have a fixed length and all other commands end with a
+    newline. Every complete command in the buffer is returned before the socket is read again, so pipelined
+    commands are served in order. A partial command longer than max_length raises InvalidCommand, which keeps
+    the buffer bounded.
+    """
+
+    def __init__(self, sock, max_length=256, buffer_size=4096):
+        self.sock = sock
+        self.max_length = max_length
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+
+    def read_command(self):
+        """
+        :return: The next command without the leading ^A and the line ending (string), None if the connection
+                 was closed by the client.
+        """
+        while True:
+            command = self._next_command()
+            if command is not None:
+                return command
+            if len(self.buffer) > self.max_length:
+                raise InvalidCommand('Command too long')
+            data = self.sock.recv(self.buffer_size)
+            if not data:
+                return None
+            self.buffer += data
+
+    def _next_command(self):
+        # line endings between commands are ignored
+        start = 0
+        while start < len(self.buffer) and self.buffer[start] in (0x0a, 0x0d):
+            start += 1
+        if start:
+            del self.buffer[:start]
+        if not self.buffer:
+            return None
+        # if first value is not ^A then do nothing
+        # thanks John(achillean) for the help
+        if self.buffer[0] != SOH:
+            raise InvalidCommand('Non ^A command')
+        end = self.buffer.find('\n', 0, INQUIRY_LENGTH)
+        if len(self.buffer) > 1 and self.buffer[1] == INQUIRY and end == -1:
+            if len(self.buffer) < INQUIRY_LENGTH:
+                return None
+            command = str(self.buffer[1:INQUIRY_LENGTH])
+            del self.buffer[:INQUIRY_LENGTH]
+            return command
+        if end == -1:
+            end = self.buffer.find('\n')
+        if end == -1:
+            return None
+        command = str(self.buffer[1:end]).rstrip('\r')
+        del self.buffer[:end + 1]
+        return command
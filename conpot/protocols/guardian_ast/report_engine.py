@@ -0,0 +1,168 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import datetime
+import random
+import logging
+
+logger = logging.getLogger(__name__)
+
+TANKS = (1, 2, 3, 4)
+TIME_FORMAT = '%m/%d/%Y %H:%M'
+PRODUCT_NAME_LENGTH = 22
+
+# databus keys backing the reports
+DATABUS_KEYS = ['station_name'] + ['{0}{1}'.format(name, tank) for tank in TANKS
+                                   for name in ('product', 'vol', 'ullage', 'height', 'h2o', 'temp')]
+
+# Fixed-width report layouts, the fields are filled from the rendering context built by ReportEngine.
+LAYOUTS = {
+    'I20100': ('\nI20100\n{time}\n\n{station}\n\n\n\nIN-TANK INVENTORY\n\n'
+               'TANK PRODUCT             VOLUME TC VOLUME   ULLAGE   HEIGHT    WATER     TEMP' +
+               ''.join('\n  {0}  {{product{0}}}{{vol{0}}}      {{voltc{0}}}     {{ullage{0}}}    {{height{0}}}'
+                       '     {{h2o{0}}}    {{temp{0}}}'.format(tank) for tank in TANKS) +
+               '\n'),
+    # Only one Tank is listed currently in the I20200 command
+    'I20200': ('\nI20200\n{time}\n\n{station}\n\n\n\nDELIVERY REPORT\n\n'
+               'T 1:{product1}\nINCREASE   DATE / TIME             GALLONS TC GALLONS WATER  TEMP DEG F  HEIGHT\n\n'
+               '      END: {fill_stop}         {delivery_end_vol1}       {delivery_end_voltc1}   {h2o1}      '
+               '{temp1}    {height1}\n'
+               '    START: {fill_start}         {delivery_start_vol1}       {delivery_start_voltc1}   {h2o1}      '
+               '{temp1}    {delivery_start_height1}\n'
+               '   AMOUNT:                          {vol1}       {voltc1}\n\n'),
+    # In-Tank Leak Detect Report
+    'I20300': ('\nI20300\n{time}\n\n{station}\n\n\n' +
+               ''.join('TANK {0}    {{product{0}}}\n    TEST STATUS: OFF\nLEAK DATA NOT AVAILABLE ON THIS TANK\n\n'
+                       .format(tank) for tank in TANKS)),
+    # Shift report, only one item in report at this time
+    'I20400': ('\nI20400\n{time}\n\n{station}\n\n\n\nSHIFT REPORT\n\n'
+               'SHIFT 1 TIME: 12:00 AM\n\nTANK PRODUCT\n\n'
+               '  1  {product1} VOLUME TC VOLUME  ULLAGE  HEIGHT  WATER   TEMP\n'
+               'SHIFT  1 STARTING VALUES      {vol1}     {voltc1}    {ullage1}   {height1}   {h2o1}    {temp1}\n'
+               '         ENDING VALUES        {shift_end_vol1}     {shift_end_voltc1}    {shift_end_ullage1}   '
+               '{shift_end_height1}  {h2o1}    {temp1}\n'
+               '         DELIVERY VALUE          0\n'
+               '         TOTALS                940\n\n'),
+    # In-Tank Status Report
+    'I20500': ('\nI20500\n{time}\n\n\n{station}\n\n\n'
+               'TANK   PRODUCT                 STATUS\n\n'
+               '  1    {product1}  NORMAL\n\n'
+               '  2    {product2}  HIGH WATER ALARM\n'
+               '                               HIGH WATER WARNING\n\n'
+               '  3    {product3}  NORMAL\n\n'
+               '  4    {product4}  NORMAL\n\n'),
+}
+
+
+def format_product_name(name):
+    """ Pads or truncates a product name to the fixed report column width. """
+    if len(name) > PRODUCT_NAME_LENGTH:
+        return name[:PRODUCT_NAME_LENGTH - 2] + '  '
+    return name.ljust(PRODUCT_NAME_LENGTH)
+
+
+class ReportEngine(object):
+    """
+    Renders the Guardian AST reports from a single snapshot of the databus.
+    Rendered reports are cached until a backing databus value is set or the minute in the report header changes,
+    values backed by databus functions are sampled again once per minute.
+    """
+
+    def __init__(self, databus, fill_offset_time):
+        self.databus = databus
+        self.fill_start = (fill_offset_time - datetime.timedelta(minutes=313)).strftime(TIME_FORMAT)
+        self.fill_stop = (fill_offset_time - datetime.timedelta(minutes=303)).strftime(TIME_FORMAT)
+        self._context = None
+        self._minute = None
+        self._cache = {}
+        for key in DATABUS_KEYS:
+            self.databus.observe_value(key, self.invalidate)
+
+    def __contains__(self, name):
+        return name in LAYOUTS
+
+    def invalidate(self, key=None):
+        self._context = None
+        self._cache.clear()
+
+    def get_products(self):
+        """ Returns the product names as shown in the reports (list of strings). """
+        context = self._get_context()
+        return [context['product{0}'.format(tank)] for tank in TANKS]
+
+    def render(self, name, products=None):
+        """
+        Renders a report.
+        :param name: Report command, e.g. I20100 (string).
+        :param products: Optional list of product names overriding the databus values, already formatted
+                         to the column width. Reports rendered with overrides are not cached.
+        :return: The rendered report (string).
+        """
+        minute = datetime.datetime.utcnow().strftime(TIME_FORMAT)
+        if minute != self._minute:
+            self._minute = minute
+            self.invalidate()
+        if products is None and name in self._cache:
+            return self._cache[name]
+        context = self._get_context()
+        if products is not None:
+            context = dict(context)
+            for tank, product in zip(TANKS, products):
+                context['product{0}'.format(tank)] = product
+        report = LAYOUTS[name].format(time=minute, **context)
+        if products is None:
+            self._cache[name] = report
+        return report
+
+    def _get_context(self):
+        if self._context is None:
+            self._context = self._snapshot()
+        return self._context
+
+    def _snapshot(self):
+        # no context switch can happen while reading plain values, so the snapshot is consistent.
+        values = dict((key, self.databus.get_value(key)) for key in DATABUS_KEYS)
+        context = {'station': values['station_name'], 'fill_start': self.fill_start, 'fill_stop': self.fill_stop}
+        for tank in TANKS:
+            vol = values['vol{0}'.format(tank)]
+            # temperature compensated volume, drawn once per snapshot
+            voltc = random.randint(vol, vol + 200)
+            context['product{0}'.format(tank)] = values['product{0}'.format(tank)].ljust(PRODUCT_NAME_LENGTH)
+            context['vol{0}'.format(tank)] = str(vol)
+            context['voltc{0}'.format(tank)] = str(voltc)
+            # unfilled space
+            context['ullage{0}'.format(tank)] = str(values['ullage{0}'.format(tank)])
+            context['height{0}'.format(tank)] = str(values['height{0}'.format(tank)]).ljust(5, '0')
+            # water in tank, this is a variable that needs to be low
+            context['h2o{0}'.format(tank)] = str(values['h2o{0}'.format(tank)]).ljust(4, '0')
+            # temperature of the tank, this will need to be between 50 - 60
+            context['temp{0}'.format(tank)] = str(values['temp{0}'.format(tank)]).ljust(5, '0')
+        # derived values of the delivery and shift reports
+        vol1, voltc1, height1 = int(context['vol1']), int(context['voltc1']), float(context['height1'])
+        context.update({
+            'delivery_end_vol1': str(vol1 + 300),
+            'delivery_end_voltc1': str(voltc1 + 300),
+            'delivery_start_vol1': str(vol1 - 300),
+            'delivery_start_voltc1': str(voltc1 - 300),
+            'delivery_start_height1': str(height1 - 23),
+            'shift_end_vol1': str(vol1 + 940),
+            'shift_end_voltc1': str(voltc1 + 886),
+            'shift_end_ullage1': str(int(context['ullage1']) + 345),
+            'shift_end_height1': str(height1 + 53),
+        })
+        logger.debug('Guardian AST report snapshot taken.')
+        return context
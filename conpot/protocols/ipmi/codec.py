@@ -0,0 +1,88 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+Wire layouts of the RMCP/RMCP+ messages handled by the IPMI server.
+All layouts work directly on str, bytearray and memoryview objects (IPMI v2.0 specification, chapter 13).
+"""
+
+import struct
+
+RMCP_HEADER = '\x06\x00\xff\x07'
+
+# rmcp header, auth type, payload type, session id, session sequence number, payload length
+IPMI20_HEADER = struct.Struct('<4sBBIIH')
+# rmcp header, auth type, session sequence number, session id; followed by the optional
+# auth code and a single payload length byte
+IPMI15_HEADER = struct.Struct('<4sBII')
+
+# message tag, requested maximum privilege, remote console session id
+OPEN_SESSION_REQUEST = struct.Struct('<BBxxI')
+# message tag, status, maximum privilege, remote console session id, managed system session id
+OPEN_SESSION_RESPONSE = struct.Struct('<BBBxII')
+# the only cipher suite offered: HMAC-SHA1, HMAC-SHA1-96 and AES-CBC-128
+CIPHER_SUITE_3 = ('\x00\x00\x00\x08\x01\x00\x00\x00'
+                  '\x01\x00\x00\x08\x01\x00\x00\x00'
+                  '\x02\x00\x00\x08\x01\x00\x00\x00')
+
+# message tag, managed system session id, remote console random number, requested role, user name length
+RAKP1 = struct.Struct('<BxxxI16sBxxB')
+# message tag, status, remote console session id, managed system random number, managed system guid
+RAKP2 = struct.Struct('<BBxxI16s16s')
+# message tag, status, managed system session id
+RAKP3 = struct.Struct('<BBxxI')
+# message tag, status, remote console session id
+RAKP4 = struct.Struct('<BBxxI')
+
+# IPMI LAN message: responder address, netfn/lun, header checksum, requester address, sequence/lun, command;
+# followed by the command data and the body checksum
+MESSAGE_HEADER = struct.Struct('6B')
+# the shortest message carries no command data, only the body checksum
+MESSAGE_MIN_SIZE = MESSAGE_HEADER.size + 1
+
+# HMAC inputs, each one is followed by the user name
+# remote console session id, managed system session id, Rm, Rc, guid, role, user name length
+RAKP2_AUTHCODE = struct.Struct('<II16s16s16sBB')
+# Rc, remote console session id, role, user name length
+RAKP3_AUTHCODE = struct.Struct('<16sIBB')
+# Rm, Rc, role, user name length
+SESSION_INTEGRITY_KEY = struct.Struct('<16s16sBB')
+# Rm, managed system session id, guid
+RAKP4_INTEGRITY_CHECK = struct.Struct('<16sI16s')
+
+# HMAC-SHA1-96
+AUTHCODE_SIZE = 12
+AES_BLOCK_SIZE = 16
+
+
+def checksum(data):
+    """
+    Two's complement checksum used by the IPMI message header and body.
+    :param data: bytearray, or sequence of ints.
+    """
+    return -sum(data) & 0xff
+
+
+def aes_pad(payload):
+    """
+    Appends the confidentiality trailer (pad bytes 1, 2, ... followed by the pad length).
+    :param payload: bytearray, padded in place.
+    """
+    pad = -(len(payload) + 1) % AES_BLOCK_SIZE
+    payload.extend(xrange(1, pad + 1))
+    payload.append(pad)
+    return payload
@@ -16,7 +16,6 @@
 # Brno University of Technology, Faculty of Information Technology
 
 
-import struct
 import os
 import socket
 import logging
@@ -30,6 +29,8 @@ import hmac
 import hashlib
 from Crypto.Cipher import AES
 
+import codec
+
 logger = logging.getLogger()
 
 def _monotonic_time():
@@ -61,78 +62,100 @@ class FakeSession(Session):
         self.server = None
         self.sol_handler = None
         self.ipmicallback = self._generic_callback
+        self.integrity = None
         logger.info('New IPMI session initialized for client (%s)', self.sockaddr)
 
     def _generic_callback(self, response):
         self.lastresponse = response
 
+    def _init_crypto(self, sik):
+        # keys are fixed for the lifetime of the session, the integrity hmac is copied for every packet
+        self.sik = sik
+        self.k1 = hmac.new(sik, '\x01' * 20, hashlib.sha1).digest()
+        self.k2 = hmac.new(sik, '\x02' * 20, hashlib.sha1).digest()
+        self.aeskey = self.k2[0:16]
+        self.integrity = hmac.new(self.k1, digestmod=hashlib.sha1)
+
+    def _authcode(self, data):
+        integrity = self.integrity.copy()
+        integrity.update(data)
+        # SHA1-96 per RFC2404 truncates to 96 bits
+        return integrity.digest()[:codec.AUTHCODE_SIZE]
+
     def _ipmi20(self, rawdata):
-        data = list(struct.unpack("%dB" % len(rawdata), rawdata))
+        _, _, payload_type, sid, remseqnumber, psize = codec.IPMI20_HEADER.unpack_from(rawdata)
+        data = memoryview(rawdata)
         # payload type numbers in IPMI specification Table 13-16; 6 bits
-        payload_type = data[5] & 0b00111111
+        bare_type = payload_type & 0b00111111
         # header = data[:15]; message = data[16:]
-        if payload_type == 0x10:
+        if bare_type == 0x10:
             # rmcp+ open session request
-            return self.server._got_rmcp_openrequest(data[16:])
-        elif payload_type == 0x11:
+            return self.server._got_rmcp_openrequest(self, data[16:])
+        elif bare_type == 0x11:
             # ignore: rmcp+ open session response
             return
-        elif payload_type == 0x12:
+        elif bare_type == 0x12:
             # rakp message 1
-            return self.server._got_rakp1(data[16:])
-        elif payload_type == 0x13:
+            return self.server._got_rakp1(self, data[16:])
+        elif bare_type == 0x13:
             # ignore: rakp message 2
             return
-        elif payload_type == 0x14:
+        elif bare_type == 0x14:
             # rakp message 3
-            return self.server._got_rakp3(data[16:])
-        elif payload_type == 0x15:
+            return self.server._got_rakp3(self, data[16:])
+        elif bare_type == 0x15:
             # ignore: rakp message 4
             return
-        elif payload_type == 0 or payload_type == 1:
+        elif bare_type == 0 or bare_type == 1:
             # payload_type == 0; IPMI message
             # payload_type == 1; SOL(Serial Over Lan)
-            if not (data[5] & 0b01000000):
+            if not (payload_type & 0b01000000):
                 # non-authenticated payload
-                self.server.close_server_session()
+                self.server.close_server_session(self)
                 return
-            encryption_bit = 0
-            if data[5] & 0b10000000:
-                # using AES-CBC-128
-                encryption_bit = 1
-            authcode = rawdata[-12:]
-            if self.k1 is None:
+            if self.integrity is None:
                 # we are in no shape to process a packet now
-                self.server.close_server_session()
+                self.server.close_server_session(self)
                 return
-            expectedauthcode = hmac.new(self.k1, rawdata[4:-12], hashlib.sha1).digest()[:12]
-            if authcode != expectedauthcode:
+            authcode = rawdata[-codec.AUTHCODE_SIZE:]
+            if not hmac.compare_digest(self._authcode(data[4:-codec.AUTHCODE_SIZE]), authcode):
                 # BMC failed to assure integrity to us, drop it
-                self.server.close_server_session()
+                self.server.close_server_session(self)
                 return
-            sid = struct.unpack("<I", rawdata[6:10])[0]
             if sid != self.localsid:
                 # session id mismatch, drop it
-                self.server.close_server_session()
+                self.server.close_server_session(self)
                 return
-            remseqnumber = struct.unpack("<I", rawdata[10:14])[0]
             if hasattr(self, 'remseqnumber'):
                 if remseqnumber < self.remseqnumber and self.remseqnumber != 0xffffffff:
-                    self.server.close_server_session()
+                    self.server.close_server_session(self)
                     return
             self.remseqnumber = remseqnumber
-            psize = data[14] + (data[15] << 8)
             payload = data[16:16 + psize]
-            if encryption_bit:
-                iv = rawdata[16:32]
+            if payload_type & 0b10000000:
+                # using AES-CBC-128, the iv is followed by at least one encrypted block
+                if len(payload) < 2 * codec.AES_BLOCK_SIZE or len(payload) % codec.AES_BLOCK_SIZE:
+                    logger.info('Invalid IPMI packet from %s', self.sockaddr)
+                    self.server.close_server_session(self)
+                    return
+                iv = payload[:codec.AES_BLOCK_SIZE].tobytes()
                 decrypter = AES.new(self.aeskey, AES.MODE_CBC, iv)
-                decrypted = decrypter.decrypt(struct.pack("%dB" % len(payload[16:]), *payload[16:]))
-                payload = struct.unpack("%dB" % len(decrypted), decrypted)
+                payload = bytearray(decrypter.decrypt(payload[codec.AES_BLOCK_SIZE:].tobytes()))
                 padsize = payload[-1] + 1
-                payload = list(payload[:-padsize])
-            if payload_type == 0:
+                if padsize > len(payload):
+                    logger.info('Invalid IPMI packet from %s', self.sockaddr)
+                    self.server.close_server_session(self)
+                    return
+                del payload[-padsize:]
+            else:
+                payload = bytearray(payload)
+            if bare_type == 0 and len(payload) < codec.MESSAGE_MIN_SIZE:
+                logger.info('Invalid IPMI packet from %s', self.sockaddr)
+                self.server.close_server_session(self)
+                return
+            if bare_type == 0:
                 self._ipmi15(payload)
-            elif payload_type == 1: 
+            elif bare_type == 1:
                 if self.last_payload_type == 1:
                     self.lastpayload = None
                     self.last_payload_type = None
@@ -144,7 +167,7 @@ class FakeSession(Session):
                     self.sol_handler(payload)
         else:
             logger.error('IPMI Unrecognized payload type.')
-            self.server.close_server_session()
+            self.server.close_server_session(self)
             return
 
     def _ipmi15(self, payload):
@@ -154,25 +177,22 @@ class FakeSession(Session):
         self.clientcommand = payload[5]
         self._parse_payload(payload)
         return
-        
+
     def _parse_payload(self, payload):
         if hasattr(self, 'hasretried'):
             if self.hasretried:
                 self.hasretried = 0
                 self.tabooseq[(self.expectednetfn, self.expectedcmd, self.seqlun)] = 16
-        self.expectednetfn = 0x1ff 
+        self.expectednetfn = 0x1ff
         self.expectedcmd = 0x1ff
         self.waiting_sessions.pop(self, None)
         self.lastpayload = None
         self.last_payload_type = None
         response = {}
+        # rsaddr, netfn/lun, checksum, rqaddr, rqseq/lun, command, data.., checksum
         response['netfn'] = payload[1] >> 2
-        del payload[0:5]
-        # remove the trailing checksum
-        del payload[-1]
-        response['command'] = payload[0]
-        del payload[0:1]
-        response['data'] = payload
+        response['command'] = payload[5]
+        response['data'] = payload[6:-1]
         self.timeout = 0.5 + (0.5 * random.random())
         self.ipmicallback(response)
 
@@ -188,55 +208,40 @@ class FakeSession(Session):
         if command is None:
             command = self.clientcommand
         if data[0] is None and len(data) == 1:
-            self.server.close_server_session()
+            self.server.close_server_session(self)
             return
         ipmipayload = self._make_ipmi_payload(netfn, command, bridge_request, data)
         payload_type = constants.payload_types['ipmi']
         self.send_payload(payload=ipmipayload, payload_type=payload_type, retry=retry, delay_xmit=delay_xmit)
 
     def _make_ipmi_payload(self, netfn, command, bridge_request=None, data=()):
-        bridge_msg = []
+        bridge_msg = bytearray()
         self.expectedcmd = command
         self.expectednetfn = netfn + 1
         # IPMI spec forbids gaps bigger then 7 in seq number.
         seqincrement = 7
-        
+
         if bridge_request:
             addr = bridge_request.get('addr', 0x0)
             channel = bridge_request.get('channel', 0x0)
-            bridge_msg = self._make_bridge_request_msg(channel, netfn, command)
+            bridge_msg = bytearray(self._make_bridge_request_msg(channel, netfn, command))
             rqaddr = constants.IPMI_BMC_ADDRESS
             rsaddr = addr
         else:
             rqaddr = self.rqaddr
             rsaddr = constants.IPMI_BMC_ADDRESS
         rsaddr = self.clientaddr
-        header = [rsaddr, netfn << 2]
-
-        reqbody = [rqaddr, self.seqlun, command] + list(data)
-        headsum = self.server._checksum(*header)
-        bodysum = self.server._checksum(*reqbody)
-        payload = header + [headsum] + reqbody + [bodysum]
+        header = (rsaddr, netfn << 2)
+        payload = bytearray(codec.MESSAGE_HEADER.pack(rsaddr, netfn << 2, codec.checksum(header),
+                                                      rqaddr, self.seqlun, command))
+        payload.extend(data)
+        # the body checksum covers everything after the header checksum
+        payload.append(codec.checksum(payload[3:]))
         if bridge_request:
             payload = bridge_msg + payload
-            tail_csum = self.server._checksum(*payload[3:])
-            payload.append(tail_csum)
+            payload.append(codec.checksum(payload[3:]))
         return payload
 
-
-    def _aespad(self, data):
-        newdata = list(data)
-        currlen = len(data) + 1
-        neededpad = currlen % 16
-        if neededpad:
-            neededpad = 16 - neededpad
-        padval = 1
-        while padval <= neededpad:
-            newdata.append(padval)
-            padval += 1
-        newdata.append(neededpad)
-        return newdata
-
     def send_payload(self, payload=(), payload_type=None, retry=True, delay_xmit=None, needskeepalive=False):
         if payload and self.lastpayload:
             self.pendingpayloads.append((payload, payload_type, retry))
@@ -245,12 +250,10 @@ class FakeSession(Session):
             payload_type = self.last_payload_type
         if not payload:
             payload = self.lastpayload
-        # constant RMCP header for IPMI
-        message = [0x6, 0x00, 0xff, 0x07] 
         if retry:
             self.lastpayload = payload
             self.last_payload_type = payload_type
-        message.append(self.authtype)
+        payload = bytearray(payload)
         baretype = payload_type
         if self.integrityalgo:
             payload_type |= 0b01000000
@@ -258,58 +261,35 @@ class FakeSession(Session):
             payload_type |= 0b10000000
 
         if self.ipmiversion == 2.0:
-            message.append(payload_type)
             if baretype == 2:
                 raise NotImplementedError("OEM Payloads")
             elif baretype not in constants.payload_types.values():
                 raise NotImplementedError("Unrecognized payload type %d" % baretype)
-            message += struct.unpack("!4B", struct.pack("<I", self.sessionid))
-        message += struct.unpack("!4B", struct.pack("<I", self.sequencenumber))
-        if self.ipmiversion == 1.5:
-            message += struct.unpack("!4B", struct.pack("<I", self.sessionid))
+            if self.confalgo:
+                iv = os.urandom(codec.AES_BLOCK_SIZE)
+                crypter = AES.new(self.aeskey, AES.MODE_CBC, iv)
+                payload = iv + crypter.encrypt(str(codec.aes_pad(payload)))
+            message = bytearray(codec.IPMI20_HEADER.pack(codec.RMCP_HEADER, self.authtype, payload_type,
+                                                         self.sessionid, self.sequencenumber, len(payload)))
+            message += payload
+            if self.integrityalgo:
+                neededpad = -(len(message) - 2) % 4
+                message += '\xff' * neededpad
+                message.append(neededpad)
+                message.append(7)
+                message += self._authcode(memoryview(message)[4:])
+        else:
+            message = bytearray(codec.IPMI15_HEADER.pack(codec.RMCP_HEADER, self.authtype,
+                                                         self.sequencenumber, self.sessionid))
             if not self.authtype == 0:
-                message += self._ipmi15authcode(payload)
+                message.extend(self._ipmi15authcode(payload))
             message.append(len(payload))
             message += payload
             totlen = 34 + len(message)
             if totlen in (56, 84, 112, 128, 156):
                 # Legacy pad as mandated by ipmi spec
-                message.append(0) 
-        elif self.ipmiversion == 2.0:
-            psize = len(payload)
-            if self.confalgo:
-                pad = (psize + 1) % 16
-                if pad:  
-                    # if no pad needed, then we take no more action
-                    pad = 16 - pad
-                newpsize = psize + pad + 17
-                message.append(newpsize & 0xff)
-                message.append(newpsize >> 8)
-                iv = os.urandom(16)
-                message += list(struct.unpack("16B", iv))
-                payloadtocrypt = self._aespad(payload)
-                crypter = AES.new(self.aeskey, AES.MODE_CBC, iv)
-                crypted = crypter.encrypt(struct.pack("%dB" % len(payloadtocrypt), *payloadtocrypt))
-                crypted = list(struct.unpack("%dB" % len(crypted), crypted))
-                message += crypted
-            else:  
-                # no confidetiality algorithm
-                message.append(psize & 0xff)
-                message.append(psize >> 8)
-                message += list(payload)
-            if self.integrityalgo:
-                neededpad = (len(message) - 2) % 4
-                if neededpad:
-                    neededpad = 4 - neededpad
-                message += [0xff] * neededpad
-                message.append(neededpad)
-                message.append(7)
-                integdata = message[4:]
-                authcode = hmac.new(self.k1, struct.pack("%dB" % len(integdata), *integdata),
-                                    hashlib.sha1).digest()[:12]  # SHA1-96
-                                    # per RFC2404 truncates to 96 bits
-                message += struct.unpack("12B", authcode)
-        self.netpacket = struct.pack("!%dB" % len(message), *message)
+                message.append(0)
+        self.netpacket = str(message)
         self.stage += 1
         self._xmit_packet(retry, delay_xmit=delay_xmit)
 
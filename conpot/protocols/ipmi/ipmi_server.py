@@ -15,16 +15,14 @@
 # Author: Peter Sooky <xsooky00@stud.fit.vubtr.cz>
 # Brno University of Technology, Faculty of Information Technology
 
-from gevent import socket
-from gevent.server import DatagramServer
-
 import struct
 import os
+import time
+import functools
 
 import logging
 
 import pyghmi.ipmi.private.constants as constants
-import pyghmi.ipmi.private.serversession as serversession
 
 import uuid
 import hmac
@@ -35,8 +33,10 @@ from lxml import etree
 
 from fakebmc import FakeBmc
 from fakesession import FakeSession
+import codec
 
 import conpot.core as conpot_core
+from conpot.core.udp_server import UDPServer
 
 logger = logging.getLogger()
 
@@ -51,7 +51,11 @@ class IpmiServer(object):
         self.port = 623
         if hasattr(args, 'port'):
             self.port = args.port
-        self.sessions = dict()
+        # (ip, port, managed session id) -> FakeSession, ordered by last activity
+        self.sessions = collections.OrderedDict()
+        self.max_sessions = 4096
+        # idle seconds before a session is dropped
+        self.session_timeout = 60
 
         self.uuid = uuid.uuid4()
         self.kg = None
@@ -65,11 +69,8 @@ class IpmiServer(object):
         oemdata = (0, 0, 0, 0)
         self.authcap = struct.pack('BBBBBBBBB', 0, lanchannel, authtype, authstatus, chancap, *oemdata)
 
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.sock.setblocking(1)
-        self.sock.bind(('', self.port))
+        # replies are sent through the UDP server, see start()
+        self.sock = None
         self.bmc = self._configure_users(dom)
         logger.info('Conpot IPMI initialized using %s template', template)
 
@@ -103,48 +104,80 @@ class IpmiServer(object):
         return csum
 
     def handle(self, data, address):
-        if not address[0] in self.sessions.keys():
-            # new session for new source
-            logger.info('New IPMI traffic from %s', address)
-            self.session = FakeSession(address[0], "", "", address[1])
-            self.session.server = self
-
-            self.uuid = uuid.uuid4()
-            self.kg = None
-
-            self.session.socket = self.sock
-            self.sessions[address[0]] = self.session
-            self.initiate_session(data, address, self.session)
-        else:
-            # session already exists
-            logger.info('Incoming IPMI traffic from %s', address)
-            if self.session.stage == 0:
-                self.close_server_session()
-            else:
-                self._got_request(data, address, self.session)
-
-    def initiate_session(self, data, address, session):
-        if len(data) < 22:
-            self.close_server_session()
-            return
-        if not (data[0] == '\x06' and data[2:4] == '\xff\x07'):
+        self._expire_sessions()
+        if len(data) < 14 or not (data[0] == '\x06' and data[2:4] == '\xff\x07'):
             # check rmcp version, sequencenumber and class;
-            self.close_server_session()
+            logger.info('Invalid IPMI packet from %s', address)
             return
+        payload_type = None
         if data[4] == '\x06':
             # ipmi v2
-            session.ipmiversion = 2.0
-            session.authtype = 6
-            payload_type = data[5]
-            if payload_type not in ('\x00', '\x10'):
-                self.close_server_session()
+            if len(data) < codec.IPMI20_HEADER.size or \
+                    len(data) < codec.IPMI20_HEADER.size + codec.IPMI20_HEADER.unpack_from(data)[5]:
+                logger.info('Invalid IPMI packet from %s', address)
                 return
-            if payload_type == '\x10':
-                # new session to handle conversation
-                serversession.ServerSession(self.authdata, self.kg, session.sockaddr,
-                                            self.sock, data[16:], self.uuid, bmc=self)
+            payload_type = ord(data[5]) & 0b00111111
+            if payload_type in (0x12, 0x14):
+                # rakp messages are sent outside of the session, the payload carries the managed session id
+                if len(data) < codec.IPMI20_HEADER.size + codec.RAKP3.size:
+                    logger.info('Invalid IPMI packet from %s', address)
+                    return
+                sid = codec.RAKP3.unpack_from(data, codec.IPMI20_HEADER.size)[2]
+            else:
+                sid = codec.IPMI20_HEADER.unpack_from(data)[3]
+        else:
+            sid = codec.IPMI15_HEADER.unpack_from(data)[3]
+
+        session = self.sessions.pop((address[0], address[1], sid), None)
+        if session is not None:
+            logger.info('Incoming IPMI traffic from %s', address)
+            # re-insert to keep the table ordered by last activity
+            session.last_activity = time.time()
+            self.sessions[self._session_key(session)] = session
+            self._got_request(data, address, session)
+        elif payload_type == 0x10:
+            # rmcp+ open session request, the session is registered once it has a managed session id
+            logger.info('New IPMI traffic from %s', address)
+            session = FakeSession(address[0], "", "", address[1])
+            session.server = self
+            session.socket = self.sock
+            self._got_request(data, address, session)
+        elif sid == 0:
+            # out of session request
+            self.initiate_session(data, address)
+        else:
+            logger.info('IPMI traffic for unknown session %s from %s', sid, address)
+
+    def _session_key(self, session):
+        return session.sockaddr[0], session.sockaddr[1], session.localsid
+
+    def _register_session(self, session):
+        while len(self.sessions) >= self.max_sessions:
+            key, _ = self.sessions.popitem(last=False)
+            logger.info('IPMI session table full, dropping session %s', key)
+        session.last_activity = time.time()
+        self.sessions[self._session_key(session)] = session
+
+    def _expire_sessions(self):
+        # the table is ordered by last activity, so only the head needs to be checked.
+        deadline = time.time() - self.session_timeout
+        while self.sessions:
+            key, session = next(self.sessions.iteritems())
+            if session.last_activity > deadline:
+                break
+            del self.sessions[key]
+            logger.info('IPMI session %s expired', key)
+
+    def initiate_session(self, data, address):
+        if data[4] == '\x06':
+            # ipmi v2
+            payload_type = data[5]
+            if payload_type != '\x00':
                 return
             data = data[13:]
+        if len(data) < 22:
+            logger.info('Invalid IPMI packet from %s', address)
+            return
         myaddr, netfnlun = struct.unpack('2B', data[14:16])
         netfn = (netfnlun & 0b11111100) >> 2
         mylun = netfnlun & 0b11
@@ -155,15 +188,13 @@ class IpmiServer(object):
                 verchannel, level = struct.unpack('2B', data[20:22])
                 version = verchannel & 0b10000000
                 if version != 0b10000000:
-                    self.close_server_session()
                     return
                 channel = verchannel & 0b1111
                 if channel != 0xe:
-                    self.close_server_session()
                     return
                 (clientaddr, clientlun) = struct.unpack('BB', data[17:19])
                 level &= 0b1111
-                self.send_auth_cap(myaddr, mylun, clientaddr, clientlun, session.sockaddr)
+                self.send_auth_cap(myaddr, mylun, clientaddr, clientlun, address)
 
     def send_auth_cap(self, myaddr, mylun, clientaddr, clientlun, sockaddr):
         header = '\x06\x00\xff\x07\x00\x00\x00\x00\x00\x00\x00\x00\x00\x10'
@@ -174,46 +205,44 @@ class IpmiServer(object):
         header += self.authcap
         bodydata = struct.unpack('B' * len(header[17:]), header[17:])
         header += chr(self._checksum(*bodydata))
-        self.session.stage += 1
-        logger.info('Connection established with %s', sockaddr)
-        self.session.send_data(header, sockaddr)
+        logger.info('Connection established with %s', sockaddr, extra={'source': sockaddr[0]})
+        self.sock.sendto(header, sockaddr)
 
-    def close_server_session(self):
-        logger.info('IPMI Session closed %s', self.session.sessionid)
+    def close_server_session(self, session):
+        logger.info('IPMI Session closed %s', session.sessionid)
         # cleanup session
-        del self.sessions[self.session.sockaddr[0]]
-        del self.session
-
-        pass
+        self.sessions.pop(self._session_key(session), None)
 
     def _got_request(self, data, address, session):
         if data[4] in ('\x00', '\x02'):
             # ipmi 1.5 payload
             session.ipmiversion = 1.5
-            remsequencenumber = struct.unpack('<I', data[5:9])[0]
+            _, authtype, remsequencenumber, remsessid = codec.IPMI15_HEADER.unpack_from(data)
             if hasattr(session, 'remsequencenumber') and remsequencenumber < session.remsequencenumber:
-                self.close_server_session()
+                self.close_server_session(session)
                 return
             session.remsequencenumber = remsequencenumber
-            if ord(data[4]) != session.authtype:
-                self.close_server_session()
+            if authtype != session.authtype:
+                self.close_server_session(session)
                 return
-            remsessid = struct.unpack("<I", data[9:13])[0]
             if remsessid != session.sessionid:
-                self.close_server_session()
+                self.close_server_session(session)
                 return
-            rsp = list(struct.unpack("!%dB" % len(data), data))
+            offset = codec.IPMI15_HEADER.size
             authcode = False
-            if data[4] == '\x02':
+            if authtype == 2:
                 # authcode in ipmi 1.5 packet
-                authcode = data[13:29]
-                del rsp[13:29]
-            payload = list(rsp[14:14 + rsp[13]])
+                authcode = data[offset:offset + 16]
+                offset += 16
+            if len(data) <= offset or not codec.MESSAGE_MIN_SIZE <= ord(data[offset]) < len(data) - offset:
+                logger.info('Invalid IPMI packet from %s', address)
+                self.close_server_session(session)
+                return
+            payload = bytearray(data[offset + 1:offset + 1 + ord(data[offset])])
             if authcode:
                 expectedauthcode = session._ipmi15authcode(payload, checkremotecode=True)
-                expectedauthcode = struct.pack("%dB" % len(expectedauthcode), *expectedauthcode)
-                if expectedauthcode != authcode:
-                    self.close_server_session()
+                if str(bytearray(expectedauthcode)) != authcode:
+                    self.close_server_session(session)
                     return
             session._ipmi15(payload)
         elif data[4] == '\x06':
@@ -223,117 +252,111 @@ class IpmiServer(object):
             session._ipmi20(data)
         else:
             # unrecognized data
-            self.close_server_session()
+            self.close_server_session(session)
             return
 
-    def _got_rmcp_openrequest(self, data):
-        request = struct.pack('B' * len(data), *data)
-        clienttag = ord(request[0])
-        self.clientsessionid = list(struct.unpack('4B', request[4:8]))
-        self.managedsessionid = list(struct.unpack('4B', os.urandom(4)))
-        self.session.privlevel = 4
-        response = ([clienttag, 0, self.session.privlevel, 0] +
-                    self.clientsessionid + self.managedsessionid +
-                    [
-                        0, 0, 0, 8, 1, 0, 0, 0,  # auth
-                        1, 0, 0, 8, 1, 0, 0, 0,  # integrity
-                        2, 0, 0, 8, 1, 0, 0, 0,  # privacy
-        ])
+    def _got_rmcp_openrequest(self, session, data):
+        if len(data) < codec.OPEN_SESSION_REQUEST.size:
+            # the session is not registered yet, there is nothing to close
+            logger.info('Invalid IPMI packet from %s', session.sockaddr)
+            return
+        clienttag, _, session.clientsessionid = codec.OPEN_SESSION_REQUEST.unpack_from(data)
+        # pick a managed session id which is unique for this peer, 0 is reserved for out of session traffic
+        session.localsid = 0
+        while session.localsid == 0 or self._session_key(session) in self.sessions:
+            session.localsid = struct.unpack('<I', os.urandom(4))[0]
+        session.privlevel = 4
+        response = codec.OPEN_SESSION_RESPONSE.pack(clienttag, 0, session.privlevel,
+                                                    session.clientsessionid, session.localsid)
+        self._register_session(session)
         logger.info('IPMI open session request')
-        self.session.send_payload(response, constants.payload_types['rmcpplusopenresponse'], retry=False)
-
-    def _got_rakp1(self, data):
-        clienttag = data[0]
-        self.Rm = data[8:24]
-        self.rolem = data[24]
-        self.maxpriv = self.rolem & 0b111
-        namepresent = data[27]
-        if namepresent == 0:
-            self.close_server_session()
+        session.send_payload(response + codec.CIPHER_SUITE_3, constants.payload_types['rmcpplusopenresponse'],
+                             retry=False)
+
+    def _got_rakp1(self, session, data):
+        if len(data) < codec.RAKP1.size:
+            logger.info('Invalid IPMI packet from %s', session.sockaddr)
+            self.close_server_session(session)
+            return
+        clienttag, _, session.Rm, session.rolem, namelength = codec.RAKP1.unpack_from(data)
+        session.maxpriv = session.rolem & 0b111
+        if namelength == 0:
+            self.close_server_session(session)
             return
-        usernamebytes = data[28:]
-        self.username = struct.pack('%dB' % len(usernamebytes), *usernamebytes)
-        if self.username not in self.authdata:
-            self.close_server_session()
+        session.username = data[codec.RAKP1.size:codec.RAKP1.size + namelength].tobytes()
+        if session.username not in self.authdata:
+            self.close_server_session(session)
             return
-        uuidbytes = self.uuid.bytes
-        uuidbytes = list(struct.unpack('%dB' % len(uuidbytes), uuidbytes))
-        self.uuiddata = uuidbytes
-        self.Rc = list(struct.unpack('16B', os.urandom(16)))
-        hmacdata = (self.clientsessionid + self.managedsessionid + self.Rm + self.Rc + uuidbytes +
-                    [self.rolem, len(self.username)])
-        hmacdata = struct.pack('%dB' % len(hmacdata), *hmacdata)
-        hmacdata += self.username
-        self.kuid = self.authdata[self.username]
-        if self.kg is None:
-            self.kg = self.kuid
-        authcode = hmac.new(self.kuid, hmacdata, hashlib.sha1).digest()
-        authcode = list(struct.unpack('%dB' % len(authcode), authcode))
-        newmessage = ([clienttag, 0, 0, 0] + self.clientsessionid + self.Rc + uuidbytes + authcode)
+        session.Rc = os.urandom(16)
+        hmacdata = codec.RAKP2_AUTHCODE.pack(session.clientsessionid, session.localsid, session.Rm, session.Rc,
+                                             self.uuid.bytes, session.rolem, len(session.username))
+        session.kuid = self.authdata[session.username]
+        session.kg = self.kg if self.kg is not None else session.kuid
+        authcode = hmac.new(session.kuid, hmacdata + session.username, hashlib.sha1).digest()
+        response = codec.RAKP2.pack(clienttag, 0, session.clientsessionid, session.Rc, self.uuid.bytes)
         logger.info('IPMI rakp1 request')
-        self.session.send_payload(newmessage, constants.payload_types['rakp2'], retry=False)
-
-    def _got_rakp3(self, data):
-        RmRc = struct.pack('B' * len(self.Rm + self.Rc), *(self.Rm + self.Rc))
-        self.sik = hmac.new(self.kg, RmRc + struct.pack("2B", self.rolem, len(self.username)) +
-                            self.username, hashlib.sha1).digest()
-        self.session.k1 = hmac.new(self.sik, '\x01' * 20, hashlib.sha1).digest()
-        self.session.k2 = hmac.new(self.sik, '\x02' * 20, hashlib.sha1).digest()
-        self.session.aeskey = self.session.k2[0:16]
-
-        hmacdata = struct.pack('B' * len(self.Rc), *self.Rc) + struct.pack("4B", *self.clientsessionid) +\
-            struct.pack("2B", self.rolem, len(self.username)) + self.username
-        expectedauthcode = hmac.new(self.kuid, hmacdata, hashlib.sha1).digest()
-        authcode = struct.pack("%dB" % len(data[8:]), *data[8:])
-        if expectedauthcode != authcode:
-            self.close_server_session()
+        session.send_payload(response + authcode, constants.payload_types['rakp2'], retry=False)
+
+    def _got_rakp3(self, session, data):
+        if not hasattr(session, 'Rc'):
+            # rakp3 without a preceding rakp1
+            self.close_server_session(session)
+            return
+        if len(data) < codec.RAKP3.size:
+            logger.info('Invalid IPMI packet from %s', session.sockaddr)
+            self.close_server_session(session)
             return
-        clienttag = data[0]
-        if data[1] != 0:
-            self.close_server_session()
+        clienttag, status, _ = codec.RAKP3.unpack_from(data)
+        hmacdata = codec.RAKP3_AUTHCODE.pack(session.Rc, session.clientsessionid, session.rolem,
+                                             len(session.username))
+        expectedauthcode = hmac.new(session.kuid, hmacdata + session.username, hashlib.sha1).digest()
+        if not hmac.compare_digest(expectedauthcode, data[codec.RAKP3.size:].tobytes()):
+            self.close_server_session(session)
             return
-        self.session.localsid = struct.unpack('<I', struct.pack('4B', *self.managedsessionid))[0]
+        if status != 0:
+            self.close_server_session(session)
+            return
+        hmacdata = codec.SESSION_INTEGRITY_KEY.pack(session.Rm, session.Rc, session.rolem, len(session.username))
+        session._init_crypto(hmac.new(session.kg, hmacdata + session.username, hashlib.sha1).digest())
 
         logger.info('IPMI rakp3 request')
-        self.session.ipmicallback = self.handle_client_request
-        self._send_rakp4(clienttag, 0)
-
-    def _send_rakp4(self, tagvalue, statuscode):
-        payload = [tagvalue, statuscode, 0, 0] + self.clientsessionid
-        hmacdata = self.Rm + self.managedsessionid + self.uuiddata
-        hmacdata = struct.pack('%dB' % len(hmacdata), *hmacdata)
-        authdata = hmac.new(self.sik, hmacdata, hashlib.sha1).digest()[:12]
-        payload += struct.unpack('%dB' % len(authdata), authdata)
+        session.ipmicallback = functools.partial(self.handle_client_request, session)
+        self._send_rakp4(session, clienttag, 0)
+
+    def _send_rakp4(self, session, tagvalue, statuscode):
+        hmacdata = codec.RAKP4_INTEGRITY_CHECK.pack(session.Rm, session.localsid, self.uuid.bytes)
+        authdata = hmac.new(session.sik, hmacdata, hashlib.sha1).digest()[:codec.AUTHCODE_SIZE]
+        payload = codec.RAKP4.pack(tagvalue, statuscode, session.clientsessionid) + authdata
         logger.info('IPMI rakp4 sent')
-        self.session.send_payload(payload, constants.payload_types['rakp4'], retry=False)
-        self.session.confalgo = 'aes'
-        self.session.integrityalgo = 'sha1'
-        self.session.sessionid = struct.unpack('<I', struct.pack('4B', *self.clientsessionid))[0]
+        session.send_payload(payload, constants.payload_types['rakp4'], retry=False)
+        session.confalgo = 'aes'
+        session.integrityalgo = 'sha1'
+        session.sessionid = session.clientsessionid
 
-    def handle_client_request(self, request):
+    def handle_client_request(self, session, request):
         if request['netfn'] == 6 and request['command'] == 0x3b:
             # set session privilage level
             pendingpriv = request['data'][0]
             returncode = 0
             if pendingpriv > 1:
-                if pendingpriv > self.maxpriv:
+                if pendingpriv > session.maxpriv:
                     returncode = 0x81
                 else:
-                    self.clientpriv = request['data'][0]
-            self.session._send_ipmi_net_payload(code=returncode, data=[self.clientpriv])
-            logger.info('IPMI response sent (Set Session Privilege) to %s', self.session.sockaddr)
+                    session.clientpriv = request['data'][0]
+            session._send_ipmi_net_payload(code=returncode, data=[session.clientpriv])
+            logger.info('IPMI response sent (Set Session Privilege) to %s', session.sockaddr)
         elif request['netfn'] == 6 and request['command'] == 0x3c:
             # close session
-            self.session.send_ipmi_response()
-            logger.info('IPMI response sent (Close Session) to %s', self.session.sockaddr)
-            self.close_server_session()
+            session.send_ipmi_response()
+            logger.info('IPMI response sent (Close Session) to %s', session.sockaddr)
+            self.close_server_session(session)
         elif request['netfn'] == 6 and request['command'] == 0x44:
             # get user access
             reschan = request['data'][0]
             channel = reschan & 0b00001111
             resuid = request['data'][1]
             usid = resuid & 0b00011111
-            if self.clientpriv > self.maxpriv:
+            if session.clientpriv > session.maxpriv:
                 returncode = 0xd4
             else:
                 returncode = 0
@@ -348,8 +371,8 @@ class IpmiServer(object):
             data.append(sum(self.activeusers))
             data.append(sum(self.fixedusers))
             data.append(self.channelaccess)
-            self.session._send_ipmi_net_payload(code=returncode, data=data)
-            logger.info('IPMI response sent (Get User Access) to %s', self.session.sockaddr)
+            session._send_ipmi_net_payload(code=returncode, data=data)
+            logger.info('IPMI response sent (Get User Access) to %s', session.sockaddr)
         elif request['netfn'] == 6 and request['command'] == 0x46:
             # get user name
             userid = request['data'][0]
@@ -359,8 +382,8 @@ class IpmiServer(object):
             while len(data) < 16:
                 # filler
                 data.append(0)
-            self.session._send_ipmi_net_payload(code=returncode, data=data)
-            logger.info('IPMI response sent (Get User Name) to %s', self.session.sockaddr)
+            session._send_ipmi_net_payload(code=returncode, data=data)
+            logger.info('IPMI response sent (Get User Name) to %s', session.sockaddr)
         elif request['netfn'] == 6 and request['command'] == 0x45:
             # set user name
             # TODO: fix issue where users can be overwritten
@@ -388,8 +411,8 @@ class IpmiServer(object):
             self.channelaccessdata = self.copychannel
 
             returncode = 0
-            self.session._send_ipmi_net_payload(code=returncode)
-            logger.info('IPMI response sent (Set User Name) to %s', self.session.sockaddr)
+            session._send_ipmi_net_payload(code=returncode)
+            logger.info('IPMI response sent (Set User Name) to %s', session.sockaddr)
         elif request['netfn'] == 6 and request['command'] == 0x47:
             # set user passwd
             passwd_length = request['data'][0] & 0b10000000
@@ -424,19 +447,20 @@ class IpmiServer(object):
                 if self.authdata[username] != passwd.strip('\x00'):
                     returncode = 0x80
 
-            self.session._send_ipmi_net_payload(code=returncode)
-            logger.info('IPMI response sent (Set User Password) to %s', self.session.sockaddr)
+            session._send_ipmi_net_payload(code=returncode)
+            logger.info('IPMI response sent (Set User Password) to %s', session.sockaddr)
         elif request['netfn'] in [0, 6] and request['command'] in [1, 2, 8, 9]:
-            self.bmc.handle_raw_request(request, self.session)
+            self.bmc.handle_raw_request(request, session)
         else:
             returncode = 0xc1
-            self.session._send_ipmi_net_payload(code=returncode)
-            logger.info('IPMI unrecognized command from %s', self.session.sockaddr)
-            logger.info('IPMI response sent (Invalid Command) to %s', self.session.sockaddr)
+            session._send_ipmi_net_payload(code=returncode)
+            logger.info('IPMI unrecognized command from %s', session.sockaddr)
+            logger.info('IPMI response sent (Invalid Command) to %s', session.sockaddr)
 
     def start(self, host, port):
         connection = (host, port)
-        self.server = DatagramServer(connection, self.handle)
+        self.server = UDPServer(connection, self.handle)
+        self.sock = self.server
         logger.info('IPMI server started on: %s', connection)
         self.server.serve_forever()
 
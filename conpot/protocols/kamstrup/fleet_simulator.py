@@ -0,0 +1,197 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import logging
+import time
+
+import gevent
+import gevent.event
+import numpy
+
+import conpot.core as conpot_core
+
+
+logger = logging.getLogger(__name__)
+
+# exposed registers, in column order of FleetSimulator.values
+ENERGY_IN, ENERGY_IN_LOWRES, ENERGY_OUT, ENERGY_OUT_LOWRES = 13, 1, 14, 2
+VOLTAGE = (1054, 1055, 1056)
+CURRENT = (1076, 1077, 1078)
+POWER = (1080, 1081, 1082)
+REGISTERS = (ENERGY_IN, ENERGY_IN_LOWRES, ENERGY_OUT, ENERGY_OUT_LOWRES) + VOLTAGE + CURRENT + POWER
+COLUMNS = dict((register, column) for column, register in enumerate(REGISTERS))
+# meter number and serial numbers, meter n of the fleet reports the template value plus n
+IDENTITY = (51, 1001, 1010)
+
+
+def meter_key(key, index):
+    """ :return: The databus key holding the value of key for meter index of the fleet. """
+    return key if index == 0 else '{0}_meter_{1}'.format(key, index)
+
+
+def load_profile(hour):
+    """
+    Relative household load over the day with a morning and an evening peak, averaging roughly 1.
+    :param hour: Hour of the day, scalar or array.
+    """
+    hour = numpy.mod(hour, 24)
+    return 0.45 + 0.55 * numpy.exp(-((hour - 7.5) / 1.5) ** 2) + 1.1 * numpy.exp(-((hour - 19.0) / 2.5) ** 2)
+
+
+class MeterRegister(object):
+    """ Databus accessor for a single register of a single meter in the fleet. """
+    __slots__ = ('values', 'index', 'column')
+
+    def __init__(self, values, index, column):
+        self.values = values
+        self.index = index
+        self.column = column
+
+    def get_value(self):
+        return int(self.values[self.index, self.column])
+
+
+# Simulates power usage for a fleet of Kamstrup 382 meters
+class FleetSimulator(object):
+    """
+    Keeps the energy, voltage, current and power of every meter in arrays with one row per meter and advances
+    all of them in a single vectorized step per tick. The registers of meter 0 are published on the databus in
+    place of the UsageSimulator ones, those of meter n under meter_key(key, n), where the meter server answers for
+    them. The values in the template are used as the fleet average, individual meters differ in size, phase
+    balance and daily rhythm. Meter n reports the meter and serial numbers of the template plus n.
+    """
+
+    def __init__(self, meters=100, seed=None, interval=1, published=None):
+        """ :param published: Number of meters published on the databus, all by default. """
+        self.meters = meters
+        self.published = meters if published is None else min(published, meters)
+        self.interval = interval
+        self.random = numpy.random.RandomState(seed)
+        # integer register values, one row per meter
+        self.values = numpy.zeros((meters, len(REGISTERS)), dtype=numpy.int64)
+        self.energy_in = numpy.zeros(meters)
+        self.energy_out = numpy.zeros(meters)
+        shape = (meters, 3)
+        self.voltage = numpy.zeros(shape)
+        self.current = numpy.zeros(shape)
+        self.power = numpy.zeros(shape)
+        # per meter characteristics
+        self._nominal_voltage = numpy.zeros(shape)
+        self._peak_power = numpy.zeros(shape)
+        self._amps_per_watt = numpy.zeros(shape)
+        self._hour_offset = numpy.zeros((meters, 1))
+        # key: identity register, value: template value
+        self.identity = {}
+        self._stop = gevent.event.Event()
+        self.stopped = gevent.event.Event()
+        gevent.spawn(self.initialize)
+
+    def initialize(self):
+        # we need the databus initialized before we can probe values
+        databus = conpot_core.get_databus()
+        databus.initialized.wait()
+
+        def template_value(register):
+            return float(databus.get_value('register_{0}'.format(register)))
+
+        voltage = numpy.array([template_value(r) for r in VOLTAGE])
+        current = numpy.array([template_value(r) for r in CURRENT])
+        power = numpy.array([template_value(r) for r in POWER])
+        self.populate(template_value(ENERGY_IN), template_value(ENERGY_OUT), voltage, current, power)
+        keys = set(databus.keys())
+        self.identity = dict((register, int(databus.get_value('register_{0}'.format(register))))
+                             for register in IDENTITY if 'register_{0}'.format(register) in keys)
+        for index in range(self.published):
+            self.bind(databus, index)
+        gevent.spawn(self.usage_counter)
+
+    def populate(self, energy_in, energy_out, voltage, current, power, hour=None):
+        """
+        Draws the individual meters around the given fleet averages.
+        :param voltage, current, power: Per phase averages (arrays of 3).
+        """
+        shape = (self.meters, 3)
+        self.energy_in[:] = energy_in * self.random.lognormal(0, 0.3, self.meters)
+        self.energy_out[:] = energy_out
+        self._nominal_voltage[:] = voltage + self.random.normal(0, 2, shape)
+        # household size and phase balance
+        self._peak_power[:] = (power * self.random.lognormal(0, 0.4, (self.meters, 1)) *
+                               self.random.uniform(0.7, 1.3, shape))
+        self._amps_per_watt[:] = current / numpy.maximum(power, 1)
+        self._hour_offset[:] = self.random.normal(0, 1, (self.meters, 1))
+        self.step(0, hour)
+
+    def step(self, elapsed, hour=None):
+        """
+        Advances every meter by elapsed seconds.
+        :param hour: Hour of the day driving the load curve, defaults to the local time.
+        """
+        if hour is None:
+            now = time.localtime()
+            hour = now.tm_hour + now.tm_min / 60.0 + now.tm_sec / 3600.0
+        # energy is accumulated with the power of the previous interval
+        self.energy_in += self.power.sum(axis=1) * (0.0036 * elapsed)
+        load = load_profile(hour + self._hour_offset)
+        self.power[:] = self._peak_power * load * (1 + self.random.normal(0, 0.05, self.power.shape))
+        numpy.maximum(self.power, 0, out=self.power)
+        # voltage sags with the load of the meter
+        self.voltage[:] = (self._nominal_voltage - 3 * (load - 1) +
+                           self.random.normal(0, 0.5, self.voltage.shape))
+        self.current[:] = self.power * self._amps_per_watt * (self._nominal_voltage / self.voltage)
+        self._publish()
+
+    def _publish(self):
+        values = self.values
+        values[:, COLUMNS[ENERGY_IN]] = self.energy_in
+        values[:, COLUMNS[ENERGY_IN_LOWRES]] = values[:, COLUMNS[ENERGY_IN]] // 1000
+        values[:, COLUMNS[ENERGY_OUT]] = self.energy_out
+        values[:, COLUMNS[ENERGY_OUT_LOWRES]] = values[:, COLUMNS[ENERGY_OUT]] // 1000
+        values[:, COLUMNS[VOLTAGE[0]]:COLUMNS[VOLTAGE[2]] + 1] = numpy.rint(self.voltage)
+        values[:, COLUMNS[CURRENT[0]]:COLUMNS[CURRENT[2]] + 1] = numpy.rint(self.current)
+        values[:, COLUMNS[POWER[0]]:COLUMNS[POWER[2]] + 1] = numpy.rint(self.power)
+
+    def accessors(self, index):
+        """ :return: Dictionary of register id and databus accessor of a single meter. """
+        return dict((register, MeterRegister(self.values, index, column)) for register, column in COLUMNS.items())
+
+    def bind(self, databus, index, key_format=None):
+        """
+        Publishes the simulated and identity registers of meter index on the databus, the keys are
+        key_format.format(register), by default the meter_key of the template keys.
+        """
+        def key(register):
+            if key_format:
+                return key_format.format(register)
+            return meter_key('register_{0}'.format(register), index)
+
+        for register, accessor in self.accessors(index).items():
+            databus.set_value(key(register), accessor)
+        for register, value in self.identity.items():
+            databus.set_value(key(register), value + index)
+
+    def usage_counter(self):
+        last = time.time()
+        while not self._stop.wait(self.interval):
+            now = time.time()
+            self.step(now - last)
+            last = now
+        # ready for shutdown!
+        self.stopped.set()
+
+    def stop(self):
+        self._stop.set()
+        self.stopped.wait()
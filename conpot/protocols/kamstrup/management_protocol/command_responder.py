@@ -22,6 +22,36 @@ import commands
 
 logger = logging.getLogger(__name__)
 
+# trie node keys of the handlers, characters are strings so these never collide
+_EXACT, _PREFIX = 0, 1
+
+
+class CommandTrie(object):
+    """
+    Prefix tree mapping command names to handlers. A handler added with prefix=True also handles every longer
+    name starting with its own name.
+    """
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, name, handler, prefix=False):
+        node = self.root
+        for c in name:
+            node = node.setdefault(c, {})
+        node[_PREFIX if prefix else _EXACT] = handler
+
+    def find(self, name):
+        """ :return: The handler of name, None if there is no handler. """
+        node = self.root
+        for c in name:
+            if _PREFIX in node:
+                return node[_PREFIX]
+            node = node.get(c)
+            if node is None:
+                return None
+        return node.get(_EXACT, node.get(_PREFIX))
+
 
 class CommandResponder(object):
     COMMAND_NOT_FOUND = (
@@ -53,6 +83,13 @@ class CommandResponder(object):
 
         self.help_command = commands.HelpCommand(self.commands)
 
+        # only the first character of the Q and H commands is significant
+        self.dispatch = CommandTrie()
+        self.dispatch.add("Q", lambda params: None, prefix=True)  # quit
+        self.dispatch.add("H", self.help_command.run, prefix=True)
+        for name, command in self.commands.items():
+            self.dispatch.add(name, command.run)
+
     def respond(self, request):
         stripped_request = request.strip()
 
@@ -64,17 +101,12 @@ class CommandResponder(object):
 
         if len(command) > 3:
             return self.COMMAND_NOT_FOUND
-        elif command.startswith("Q"):
-            return  # quit
 
         params = None
         if len(split_request) > 1:
             params = split_request[1]
 
-        if command.startswith("H"):
-            return self.help_command.run(params)
-        if command.startswith("!"):
-            if command in self.commands.keys():
-                return self.commands[command].run(params)
-
-        return self.COMMAND_NOT_FOUND
+        handler = self.dispatch.find(command)
+        if handler is None:
+            return self.COMMAND_NOT_FOUND
+        return handler(params)
@@ -15,12 +15,16 @@
 
 import logging
 import socket
+import time
+from collections import deque
 
-import gevent
 from gevent.server import StreamServer
+from lxml import etree
 
 import conpot.core as conpot_core
+from conpot.core.response_scheduler import ResponseDelay
 from command_responder import CommandResponder
+from line_reader import LineReader, LineTooLong
 
 logger = logging.getLogger(__name__)
 
@@ -30,47 +34,77 @@ class KamstrupManagementServer(object):
         self.template = template
         self.timeout = timeout
         self.command_responder = CommandResponder()
+        # TODO measure delay and/or RTT
+        self.response_delay = ResponseDelay.from_xml(etree.parse(template).find('response_delay'),
+                                                     default=ResponseDelay('constant', value=0.25))
+        self.max_pending = 32
+        self.max_line_length = 1024
+        # number of commands remembered per connection
+        self.history_length = 32
         self.banner = "\r\nWelcome...\r\nConnected to [{0}]\r\n"
         logger.info('Kamstrup management protocol server initialized.')
         self.server = None
+        self.metrics = conpot_core.get_metrics()
 
     def handle(self, sock, address):
         session = conpot_core.get_session('kamstrup_management_protocol', address[0], address[1])
-        logger.info('New Kamstrup connection from %s:%s. (%s)', address[0], address[1], session.id)
+        logger.info('New Kamstrup connection from %s:%s. (%s)', address[0], address[1], session.id,
+                    extra={'source': address[0]})
         session.add_event({'type': 'NEW_CONNECTION'})
+        self.metrics.count('connections', 'kamstrup_management')
 
+        connection = conpot_core.get_response_scheduler().open(sock, self.max_pending)
+        reader = LineReader(sock, self.max_line_length)
+        history = deque(maxlen=self.history_length)
         try:
             sock.send(self.banner.format(
                 conpot_core.get_databus().get_value("mac_address")))
 
             while True:
-                request = sock.recv(1024)
-                if not request:
+                request = reader.read_line()
+                if request is None:
                     logger.info('Kamstrup client disconnected. (%s)', session.id)
                     session.add_event({'type': 'CONNECTION_LOST'})
                     break
+                if request.strip():
+                    history.append(request)
 
                 logdata = {'request': request}
+                started = time.time()
                 response = self.command_responder.respond(request)
+                self.metrics.observe('kamstrup_management', time.time() - started)
+                self.metrics.count('requests', 'kamstrup_management')
+                self.metrics.count('bytes_received', 'kamstrup_management', len(request))
                 logdata['response'] = response
-                logger.info('Kamstrup management traffic from %s: %s (%s)', address[0], logdata, session.id)
+                logger.info('Kamstrup management traffic from %s: %s (%s)', address[0], logdata, session.id,
+                            extra={'source': address[0]})
                 session.add_event(logdata)
-                gevent.sleep(0.25)  # TODO measure delay and/or RTT
 
                 if response is None:
                     session.add_event({'type': 'CONNECTION_LOST'})
+                    connection.drain(self.response_delay.sample())
                     break
-                sock.send(response)
+                # idle lines are not answered
+                if response:
+                    self.metrics.count('bytes_sent', 'kamstrup_management', len(response))
+                    if not connection.send(response, self.response_delay.sample()):
+                        break
 
         except socket.timeout:
             logger.debug('Socket timeout, remote: %s. (%s)', address[0], session.id)
             session.add_event({'type': 'CONNECTION_LOST'})
+        except LineTooLong:
+            self.metrics.count('errors', 'kamstrup_management')
+            logger.info('Kamstrup management command line too long from %s. (%s)', address[0], session.id)
+            session.add_event({'type': 'CONNECTION_LOST'})
 
+        logger.debug('Kamstrup management commands from %s: %s (%s)', address[0], list(history), session.id)
+        connection.drain()
         sock.close()
 
     def start(self, host, port):
         connection = (host, port)
-        self.server = StreamServer(connection, self.handle)
+        self.server = StreamServer(conpot_core.get_listener(connection), self.handle)
         logger.info('Kamstrup management protocol server started on: %s', connection)
         self.server.start()
 
@@ -0,0 +1,80 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+CR = 0x0d
+LF = 0x0a
+NUL = 0x00
+
+
+class LineTooLong(Exception):
+    pass
+
+
+class LineReader(object):
+    """
+    Splits the byte stream of a management connection into command lines.
+    Lines end with CR LF, CR NUL, a lone CR or a lone LF, so both line mode and character mode telnet clients
+    work, whether they send one byte per segment or paste several commands at once. Every complete line in the
+    buffer is returned before the socket is read again. A partial line longer than max_length raises
+    LineTooLong, which keeps the buffer bounded.
+    """
+
+    def __init__(self, sock, max_length=1024, buffer_size=1024):
+        self.sock = sock
+        self.max_length = max_length
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+        # the previous line ended with CR at the end of the buffer, a following LF or NUL belongs to it
+        self._after_cr = False
+
+    def read_line(self):
+        """
+        :return: The next line without the line ending (string), None if the connection was closed by the client.
+        """
+        while True:
+            line = self._next_line()
+            if line is not None:
+                return line
+            if len(self.buffer) > self.max_length:
+                raise LineTooLong('Line too long')
+            data = self.sock.recv(self.buffer_size)
+            if not data:
+                return None
+            self.buffer += data
+
+    def _next_line(self):
+        if self._after_cr and self.buffer:
+            if self.buffer[0] in (LF, NUL):
+                del self.buffer[:1]
+            self._after_cr = False
+        cr = self.buffer.find('\r')
+        lf = self.buffer.find('\n')
+        if cr == -1 and lf == -1:
+            return None
+        if cr == -1 or -1 < lf < cr:
+            line = str(self.buffer[:lf])
+            del self.buffer[:lf + 1]
+            return line
+        line = str(self.buffer[:cr])
+        if cr + 1 == len(self.buffer):
+            self._after_cr = True
+            del self.buffer[:cr + 1]
+        elif self.buffer[cr + 1] in (LF, NUL):
+            del self.buffer[:cr + 2]
+        else:
+            del self.buffer[:cr + 1]
+        return line
@@ -17,9 +17,9 @@
 
 import logging
 import messages
-import copy
 from lxml import etree
 
+from conpot.protocols.kamstrup import fleet_simulator
 from register import KamstrupRegister
 
 
@@ -27,13 +27,18 @@ logger = logging.getLogger(__name__)
 
 
 class CommandResponder(object):
-    def __init__(self, template):
-        # key: kamstrup_meter register, value: databus key
+    def __init__(self, template, cache_values=True):
+        # key: kamstrup_meter register, value: KamstrupRegister
         self.registers = {}
+        # key: kamstrup_meter register, value: (databus value, encoded register)
+        self.value_cache = {} if cache_values else None
 
         dom = etree.parse(template)
         registers = dom.xpath('//kamstrup_meter/registers/*')
         self.communication_address = int(dom.xpath('//kamstrup_meter/config/communication_address/text()')[0])
+        # meters of a FleetSimulator answering on the addresses following communication_address
+        meters = dom.xpath('//kamstrup_meter/config/meters/text()')
+        self.meters = int(meters[0]) if meters else 1
         for register in registers:
             name = int(register.attrib['name'])
             length = int(register.attrib['length'])
@@ -44,17 +49,29 @@ class CommandResponder(object):
             assert name not in self.registers
             self.registers[name] = kamstrup_register
 
+        # key: communication address, value: (registers, value cache) of the meter
+        self.meter_registers = {self.communication_address: (self.registers, self.value_cache)}
+        for index in range(1, self.meters):
+            # the simulated and identity registers of the other meters are published under their own databus keys
+            registers = {}
+            for name, register in self.registers.items():
+                if name in fleet_simulator.COLUMNS or name in fleet_simulator.IDENTITY:
+                    register = register._replace(databus_key=fleet_simulator.meter_key(register.databus_key, index))
+                registers[name] = register
+            self.meter_registers[self.communication_address + index] = (registers, {} if cache_values else None)
+
     def respond(self, request):
-        if request.communication_address != self.communication_address:
+        if request.communication_address not in self.meter_registers:
             logger.warning(
                 'Kamstrup request received with wrong communication address, got %s but expected %s.',
                 request.communication_address, self.communication_address)
             return None
         elif isinstance(request, messages.KamstrupRequestGetRegisters):
-            response = messages.KamstrupResponseRegister(self.communication_address)
+            registers, value_cache = self.meter_registers[request.communication_address]
+            response = messages.KamstrupResponseRegister(request.communication_address, value_cache)
             for register in request.registers:
-                if register in self.registers:
-                    response.add_register(copy.deepcopy(self.registers[register]))
+                if register in registers:
+                    response.add_register(registers[register])
             return response
         else:
             assert False
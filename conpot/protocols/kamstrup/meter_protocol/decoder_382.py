@@ -70,11 +70,13 @@ class Decoder382(object):
 
         self.response_map = {0x10: self._decode_cmd_return_register}
 
+    # decode_in and decode_out return every message completed by data, one per line
     def decode_in(self, data):
+        results = []
         for d in data:
             d = ord(d)
             if not self.in_parsing and d != kamstrup_constants.REQUEST_MAGIC:
-                logger.info('No kamstrup_meter request magic received, got: %s', d.encode('hex-codec'))
+                logger.info('No kamstrup_meter request magic received, got: %s', hex(d))
             else:
                 self.in_parsing = True
 
@@ -95,7 +97,8 @@ class Decoder382(object):
                         self.in_parsing = False
                         self.in_data = []
                         # TODO: Log discarded bytes?
-                        return 'Request discarded due to invalid CRC.'
+                        results.append('Request discarded due to invalid CRC.')
+                        continue
                     # now we expect (0x80, 0x3f, 0x10) =>
                     # (request magic, communication address, command byte)
                     comm_address = self.in_data[1]
@@ -104,15 +107,17 @@ class Decoder382(object):
                     else:
                         result = 'Unknown request command: {0}'.format(self.in_data[2])
                     self.in_data = []
-                    return result
+                    results.append(result)
                 else:
                     self.in_data.append(d)
+        return '\n'.join(results) if results else None
 
     def decode_out(self, data):
+        results = []
         for d in data:
             d = ord(d)
             if not self.out_parsing and d != kamstrup_constants.RESPONSE_MAGIC:
-                logger.info('Kamstrup: Expected response magic but got got: %s', d.encode('hex-codec'))
+                logger.info('Kamstrup: Expected response magic but got got: %s', hex(d))
             else:
                 self.out_parsing = True
 
@@ -133,7 +138,8 @@ class Decoder382(object):
                         self.out_parsing = False
                         self.out_data = []
                         # TODO: Log discarded bytes?
-                        return 'Response discarded due to invalid CRC.'
+                        results.append('Response discarded due to invalid CRC.')
+                        continue
                     comm_address = self.out_data[1]
                     if self.out_data[2] in self.response_map:
                         result = self.response_map[self.out_data[2]]() + ' [{0}]'.format(hex(comm_address))
@@ -141,9 +147,10 @@ class Decoder382(object):
                         result = 'Unknown response command: {0}'.format(self.out_data[2])
 
                     self.out_data = []
-                    return result
+                    results.append(result)
                 else:
                     self.out_data.append(d)
+        return '\n'.join(results) if results else None
 
     def _decode_cmd_get_register(self):
         assert (self.in_data[2] == 0x10)
@@ -18,12 +18,14 @@
 import logging
 import socket
 import binascii
-import random
+import time
 
 from gevent.server import StreamServer
 import gevent
+from lxml import etree
 
 import conpot.core as conpot_core
+from conpot.core.response_scheduler import ResponseDelay
 from conpot.protocols.kamstrup.meter_protocol import request_parser
 from command_responder import CommandResponder
 
@@ -34,8 +36,15 @@ class KamstrupServer(object):
     def __init__(self, template, template_directory, args, timeout=0):
         self.timeout = timeout
         self.command_responder = CommandResponder(template)
+        # real Kamstrup meters has delay in this interval
+        self.response_delay = ResponseDelay.from_xml(
+            etree.parse(template).find('config/response_delay'),
+            default=ResponseDelay('uniform', min=0.24, max=0.34))
+        # maximum number of pipelined requests waiting for their response
+        self.max_pending = 32
         self.server_active = True
         self.server = None
+        self.metrics = conpot_core.get_metrics()
         conpot_core.get_databus().observe_value('reboot_signal', self.reboot)
         logger.info('Kamstrup protocol server initialized.')
 
@@ -52,12 +61,15 @@ class KamstrupServer(object):
 
     def handle(self, sock, address):
         session = conpot_core.get_session('kamstrup_protocol', address[0], address[1])
-        logger.info('New Kamstrup connection from %s:%s. (%s)', address[0], address[1], session.id)
+        logger.info('New Kamstrup connection from %s:%s. (%s)', address[0], address[1], session.id,
+                    extra={'source': address[0]})
         session.add_event({'type': 'NEW_CONNECTION'})
+        self.metrics.count('connections', 'kamstrup_meter')
 
         self.server_active = True
 
         parser = request_parser.KamstrupRequestParser()
+        connection = conpot_core.get_response_scheduler().open(sock, self.max_pending)
         try:
             while self.server_active:
                 raw_request = sock.recv(1024)
@@ -67,8 +79,8 @@ class KamstrupServer(object):
                     session.add_event({'type': 'CONNECTION_LOST'})
                     break
 
-                for x in raw_request:
-                    parser.add_byte(x)
+                parser.add_bytes(raw_request)
+                self.metrics.count('bytes_received', 'kamstrup_meter', len(raw_request))
 
                 while True:
                     request = parser.get_request()
@@ -77,14 +89,17 @@ class KamstrupServer(object):
                         break
                     else:
                         logdata = {'request': binascii.hexlify(bytearray(request.message_bytes))}
+                        started = time.time()
                         response = self.command_responder.respond(request)
-                        # real Kamstrup meters has delay in this interval
-                        gevent.sleep(random.uniform(0.24, 0.34))
+                        self.metrics.observe('kamstrup_meter', time.time() - started)
+                        self.metrics.count('requests', 'kamstrup_meter')
                         if response:
                             serialized_response = response.serialize()
+                            self.metrics.count('bytes_sent', 'kamstrup_meter', len(serialized_response))
                             logdata['response'] = binascii.hexlify(serialized_response)
-                            logger.info('Kamstrup traffic from %s: %s (%s)', address[0], logdata, session.id)
-                            sock.send(serialized_response)
+                            logger.info('Kamstrup traffic from %s: %s (%s)', address[0], logdata, session.id,
+                                        extra={'source': address[0]})
+                            connection.send(str(serialized_response), self.response_delay.sample())
                             session.add_event(logdata)
                         else:
                             session.add_event(logdata)
@@ -94,11 +109,13 @@ class KamstrupServer(object):
             logger.debug('Socket timeout, remote: %s. (%s)', address[0], session.id)
             session.add_event({'type': 'CONNECTION_LOST'})
 
+        # responses to the last requests may still be waiting for their delay
+        connection.drain()
         sock.close()
 
     def start(self, host, port):
         connection = (host, port)
-        self.server = StreamServer(connection, self.handle)
+        self.server = StreamServer(conpot_core.get_listener(connection), self.handle)
         logger.info('Kamstrup protocol server started on: %s', connection)
         self.server.start()
 
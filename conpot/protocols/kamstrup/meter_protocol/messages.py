@@ -116,9 +116,14 @@ class KamstrupResponseBase(KamstrupProtocolBase):
 
 
 class KamstrupResponseRegister(KamstrupResponseBase):
-    def __init__(self, communication_address):
+    def __init__(self, communication_address, value_cache=None):
+        """
+        :param value_cache: Optional dict shared between responses, holding the last encoded value of every
+                            register keyed on register id.
+        """
         super(KamstrupResponseRegister, self).__init__(communication_address)
         self.registers = []
+        self.value_cache = value_cache
 
     def add_register(self, register):
         self.registers.append(register)
@@ -126,28 +131,22 @@ class KamstrupResponseRegister(KamstrupResponseBase):
     def serialize(self, message=None):
         if not message:
             message = []
+        message = bytearray(message)
         message.append(0x10)
 
+        databus = conpot_core.get_databus()
         for register in self.registers:
             # each register must be packed: (ushort registerId, byte units, byte length, byte unknown)
             # and the following $length payload with the register value
-            message.append(register.name >> 8)
-            message.append(register.name & 0xff)
-            message.append(register.units)
-            message.append(register.length)
-            # mystery byte
-            message.append(register.unknown)
-
-            low_endian_value_packed = []
-            register_value = conpot_core.get_databus().get_value(register.databus_key)
-            for _ in range(register.length):
-                # get least significant
-                low_endian_value_packed.append(register_value & 0xff)
-                register_value >>= 8
-
-            # reverse to get pack high endian
-            for b in reversed(low_endian_value_packed):
-                message.append(b)
+            register_value = databus.get_value(register.databus_key)
+            if self.value_cache is None:
+                message += register.encode(register_value)
+                continue
+            cached = self.value_cache.get(register.name)
+            if cached is None or cached[0] != register_value:
+                cached = (register_value, register.encode(register_value))
+                self.value_cache[register.name] = cached
+            message += cached[1]
 
         # add leading/trailing magic and escape as appropriate
         serialized_message = super(KamstrupResponseRegister, self).serialize(message)
@@ -15,11 +15,25 @@
 # Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
+import struct
+from collections import namedtuple
 
-class KamstrupRegister(object):
-    def __init__(self, name, units, length, unknown, databus_key):
-        self.name = name
-        self.units = units
-        self.length = length
-        self.unknown = unknown
-        self.databus_key = databus_key
+# register id, units, value length, mystery byte
+REGISTER_HEADER = struct.Struct('>HBBB')
+
+
+class KamstrupRegister(namedtuple('KamstrupRegister', 'name units length unknown databus_key header')):
+    """
+    Immutable description of a meter register. The packed register header is computed once, only the value
+    has to be encoded for each response.
+    """
+    __slots__ = ()
+
+    def __new__(cls, name, units, length, unknown, databus_key):
+        header = REGISTER_HEADER.pack(name, units, length, unknown)
+        return super(KamstrupRegister, cls).__new__(cls, name, units, length, unknown, databus_key, header)
+
+    def encode(self, value):
+        """ Packs the header and the value as a big endian, two's complement number of length bytes (str). """
+        value &= (1 << 8 * self.length) - 1
+        return self.header + '{0:0{1}x}'.format(value, 2 * self.length).decode('hex')
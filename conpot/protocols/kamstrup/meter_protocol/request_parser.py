@@ -16,6 +16,7 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 import logging
+import binascii
 
 import crc16
 
@@ -25,65 +26,100 @@ from messages import KamstrupRequestGetRegisters, KamstrupRequestUnknown
 logger = logging.getLogger(__name__)
 
 
+_REQUEST_MAGIC = chr(kamstrup_constants.REQUEST_MAGIC)
+_EOT_MAGIC = chr(kamstrup_constants.EOT_MAGIC)
+_ESCAPE = chr(kamstrup_constants.ESCAPE)
+
+
 class KamstrupRequestParser(object):
+    """
+    Incremental request decoder. Received data is appended to a single buffer, every frame is located, unescaped
+    and CRC checked in one pass and the scan resumes where the previous call stopped if a frame is incomplete.
+    """
+
     def __init__(self):
-        self.bytes = []
-        self.parsing = False
-        self.data_escaped = False
-        self.done = False
+        # received bytes not yet consumed by a complete request
+        self.bytes = bytearray()
+        # no unescaped EOT magic exists in self.bytes before this position
+        self.scan_position = 1
         self.request_map = {KamstrupRequestGetRegisters.command_byte: KamstrupRequestGetRegisters}
 
     def add_byte(self, byte):
-        self.bytes.append(ord(byte))
+        self.bytes += byte
+
+    def add_bytes(self, data):
+        self.bytes += data
 
     def get_request(self):
-        bytes_len = len(self.bytes)
-        position = 0
-        while position < bytes_len:
-            d = self.bytes[position]
-            if not self.parsing and d != kamstrup_constants.REQUEST_MAGIC:
-                logger.info('Kamstrup skipping byte, expected kamstrup_meter request magic but got: {0}'
-                            .format(hex(d)))
-                del self.bytes[position]
-                bytes_len -= 1
+        while True:
+            frame = self._next_frame()
+            if frame is None:
+                return None
+            # (communication address, command byte, crc high, crc low)
+            if len(frame) < 4:
+                logger.warning('Kamstrup request too short: {0}'.format(binascii.hexlify(frame)))
+                continue
+            if not self.valid_crc(frame):
+                logger.warning('Kamstrup CRC check failed for request.')
                 continue
+            # now we expect (0x3f, 0x10) => (communication address, command byte)
+            comm_address = frame[0]
+            command_byte = frame[1]
+            if command_byte in self.request_map:
+                return self.request_map[command_byte](comm_address, command_byte, frame[2:-2])
             else:
-                self.parsing = True
-
-                escape_escape_byte = False
-                if self.data_escaped:
-                    self.bytes[position] ^= 0xff
-                    if d is kamstrup_constants.EOT_MAGIC:
-                        escape_escape_byte = True
-                    self.data_escaped = False
-                elif d is kamstrup_constants.ESCAPE:
-                    self.data_escaped = True
-                    del self.bytes[position]
-                    bytes_len -= 1
-                    continue
-
-                assert self.data_escaped is False
-
-                if d is kamstrup_constants.EOT_MAGIC and not escape_escape_byte:
-                    if not self.valid_crc(self.bytes[1:position]):
-                        self.parsing = False
-                        del self.bytes[0:position]
-                        logger.warning('Kamstrup CRC check failed for request.')
-                    # now we expect (0x80, 0x3f, 0x10) =>
-                    # (request magic, communication address, command byte)
-                    comm_address = self.bytes[1]
-                    command_byte = self.bytes[2]
-                    if self.bytes[2] in self.request_map:
-                        result = self.request_map[command_byte](comm_address, command_byte, self.bytes[3:-3])
-                        del self.bytes[:position + 1]
-                    else:
-                        result = KamstrupRequestUnknown(comm_address, command_byte, self.bytes[3:-3])
-                        del self.bytes[:position + 1]
-                    return result
-                position += 1
+                return KamstrupRequestUnknown(comm_address, command_byte, frame[2:-2])
+
+    def _next_frame(self):
+        start = self.bytes.find(_REQUEST_MAGIC)
+        if start != 0:
+            skipped = len(self.bytes) if start == -1 else start
+            if skipped:
+                logger.info('Kamstrup skipping {0} bytes, expected kamstrup_meter request magic'.format(skipped))
+                del self.bytes[:skipped]
+                self.scan_position = 1
+            if start == -1:
+                return None
+
+        end = self._find_end()
+        if end == -1:
+            return None
+        frame = self._unescape(1, end)
+        del self.bytes[:end + 1]
+        self.scan_position = 1
+        return frame
+
+    def _find_end(self):
+        position = self.scan_position
+        while True:
+            end = self.bytes.find(_EOT_MAGIC, position)
+            if end == -1:
+                self.scan_position = len(self.bytes)
+                return -1
+            # EOT magic preceded by an odd number of escape bytes is escaped data
+            escapes = 0
+            while end - escapes > 1 and self.bytes[end - escapes - 1] == kamstrup_constants.ESCAPE:
+                escapes += 1
+            if escapes % 2 == 0:
+                return end
+            position = end + 1
+
+    def _unescape(self, start, end):
+        frame = bytearray()
+        position = start
+        while True:
+            escape = self.bytes.find(_ESCAPE, position, end)
+            if escape == -1:
+                frame += self.bytes[position:end]
+                return frame
+            frame += self.bytes[position:escape]
+            frame.append(self.bytes[escape + 1] ^ 0xff)
+            position = escape + 2
 
     @classmethod
     def valid_crc(cls, message):
+        if not isinstance(message, bytearray):
+            message = bytearray(message)
         supplied_crc = message[-2] * 256 + message[-1]
-        calculated_crc = crc16.crc16xmodem(''.join([chr(item) for item in message[:-2]]))
+        calculated_crc = crc16.crc16xmodem(buffer(message, 0, len(message) - 2))
         return supplied_crc == calculated_crc
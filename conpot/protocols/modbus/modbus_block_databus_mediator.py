@@ -33,5 +33,17 @@ class ModbusBlockDatabusMediator(object):
     def __setitem__(self, r, v):
         """"""
         call_hooks("modbus.ModbusBlock.setitem", (self, r, v))
-        obj = conpot_core.get_databus().get_value(self.databus_key)
-        return obj.__setitem__(r, v)
+        databus = conpot_core.get_databus()
+        # the block is written back with set_value: a shared databus returns a copy of it, and only values set
+        # through the databus are replicated to the other worker processes
+        if hasattr(databus, 'compare_and_set'):
+            # other processes may write the block meanwhile
+            while True:
+                obj, version = databus.get_versioned_value(self.databus_key)
+                obj.__setitem__(r, v)
+                if databus.compare_and_set(self.databus_key, obj, version):
+                    return
+        else:
+            obj = databus.get_value(self.databus_key)
+            obj.__setitem__(r, v)
+            databus.set_value(self.databus_key, obj)
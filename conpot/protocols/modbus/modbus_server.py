@@ -25,6 +25,7 @@ class ModbusServer(modbus.Server):
     def __init__(self, template, template_directory, args, timeout=5):
 
         self.timeout = timeout
+        self.metrics = conpot_core.get_metrics()
         self.delay = None
         self.mode = None
         databank = slave_db.SlaveBase(template)
@@ -87,8 +88,9 @@ class ModbusServer(modbus.Server):
         self.start_time = time.time()
         logger.info(
             'New Modbus connection from %s:%s. (%s)',
-            address[0], address[1], session.id)
+            address[0], address[1], session.id, extra={'source': address[0]})
         session.add_event({'type': 'NEW_CONNECTION'})
+        self.metrics.count('connections', 'modbus')
 
         try:
             while True:
@@ -109,18 +111,23 @@ class ModbusServer(modbus.Server):
 
                 # logdata is a dictionary containing request, slave_id,
                 # function_code and response
+                started = time.time()
                 response, logdata = self._databank.handle_request(
                     query, request, self.mode)
+                self.metrics.observe('modbus', time.time() - started)
+                self.metrics.count('requests', 'modbus')
+                self.metrics.count('bytes_received', 'modbus', len(request))
                 logdata['request'] = request.encode('hex')
                 session.add_event(logdata)
 
                 logger.info(
                     'Modbus traffic from %s: %s (%s)',
-                    address[0], logdata, session.id)
+                    address[0], logdata, session.id, extra={'source': address[0]})
 
                 if response:
                     sock.sendall(response)
-                    logger.info('Modbus response sent to %s', address[0])
+                    self.metrics.count('bytes_sent', 'modbus', len(response))
+                    logger.info('Modbus response sent to %s', address[0], extra={'source': address[0]})
                 else:
                     # MB serial connection addressing UID=0
                     if (self.mode == 'serial' and logdata['slave_id'] == 0):
@@ -136,6 +143,7 @@ class ModbusServer(modbus.Server):
                         break
                     # Invalid addressing
                     else:
+                        self.metrics.count('errors', 'modbus')
                         logger.info('Modbus client ignored due to invalid addressing.'
                                     ' (%s)', session.id)
                         session.add_event({'type': 'CONNECTION_TERMINATED'})
@@ -149,7 +157,7 @@ class ModbusServer(modbus.Server):
 
     def start(self, host, port):
         connection = (host, port)
-        server = StreamServer(connection, self.handle)
+        server = StreamServer(conpot_core.get_listener(connection), self.handle)
         logger.info('Modbus server started on: %s', connection)
         server.start()
 
@@ -40,6 +40,7 @@ class S7Server(object):
         self.timeout = 5
         self.ssl_lists = {}
         self.server = None
+        self.metrics = conpot_core.get_metrics()
         S7.ssl_lists = self.ssl_lists
 
         dom = etree.parse(template)
@@ -55,7 +56,7 @@ class S7Server(object):
                 databus_key = item.xpath('./text()')[0] if len(item.xpath('./text()')) else ''
                 ssl_dict[item_id] = databus_key
 
-        logger.debug('Conpot debug info: S7 SSL/SZL: {0}'.format(self.ssl_lists))
+        logger.debug('Conpot debug info: S7 SSL/SZL: %s', self.ssl_lists)
         logger.info('Conpot S7Comm initialized')
 
     def handle(self, sock, address):
@@ -63,8 +64,12 @@ class S7Server(object):
         session = conpot_core.get_session('s7comm', address[0], address[1])
 
         self.start_time = time.time()
-        logger.info('New S7 connection from {0}:{1}. ({2})'.format(address[0], address[1], session.id))
+        logger.info('New S7 connection from %s:%s. (%s)', address[0], address[1], session.id,
+                    extra={'source': address[0]})
+        # per-packet messages are rate limited per source
+        source = {'source': address[0]}
         session.add_event({'type': 'NEW_CONNECTION'})
+        self.metrics.count('connections', 's7comm')
 
         try:
             while True:
@@ -83,10 +88,10 @@ class S7Server(object):
 
                     # connection request
                     cotp_cr_request = COTP_ConnectionRequest().dissect(cotp_base_packet.payload)
-                    logger.info('Received COTP Connection Request: dst-ref:{0} src-ref:{1} dst-tsap:{2} src-tsap:{3} '
-                                 'tpdu-size:{4}. ({5})'.format(cotp_cr_request.dst_ref, cotp_cr_request.src_ref,
-                                                               cotp_cr_request.dst_tsap, cotp_cr_request.src_tsap,
-                                                               cotp_cr_request.tpdu_size, session.id))
+                    logger.info('Received COTP Connection Request: dst-ref:%s src-ref:%s dst-tsap:%s src-tsap:%s '
+                                'tpdu-size:%s. (%s)', cotp_cr_request.dst_ref, cotp_cr_request.src_ref,
+                                cotp_cr_request.dst_tsap, cotp_cr_request.src_tsap, cotp_cr_request.tpdu_size,
+                                session.id, extra=source)
 
                     # confirm connection response
                     cotp_cc_response = COTP_ConnectionConfirm(cotp_cr_request.src_ref, cotp_cr_request.dst_ref, 0,
@@ -97,6 +102,7 @@ class S7Server(object):
                     cotp_resp_base_packet = COTP_BASE_packet(0xd0, 0, cotp_cc_response).pack()
                     tpkt_resp_packet = TPKT(3, cotp_resp_base_packet).pack()
                     sock.send(tpkt_resp_packet)
+                    self._count_request(data, tpkt_resp_packet)
 
                     session.add_event({'request': data.encode('hex'), 'response': tpkt_resp_packet.encode('hex')})
 
@@ -107,8 +113,8 @@ class S7Server(object):
                     cotp_base_packet = COTP_BASE_packet().parse(tpkt_packet.payload)
 
                     if cotp_base_packet.tpdu_type == 0xf0:
-                        logger.info('Received known COTP TPDU: {0}. ({1})'.format(cotp_base_packet.tpdu_type,
-                                                                                   session.id))
+                        logger.info('Received known COTP TPDU: %s. (%s)', cotp_base_packet.tpdu_type, session.id,
+                                    extra=source)
 
                         # will throw exception if the packet does not contain the S7 magic number (0x32)
                         S7_packet = S7().parse(cotp_base_packet.trailer)
@@ -118,7 +124,7 @@ class S7Server(object):
                             S7_packet.magic, S7_packet.pdu_type,
                             S7_packet.reserved, S7_packet.request_id,
                             S7_packet.param_length, S7_packet.data_length,
-                            S7_packet.result_info, session.id)
+                            S7_packet.result_info, session.id, extra=source)
 
                         # request pdu
                         if S7_packet.pdu_type == 1:
@@ -135,6 +141,7 @@ class S7Server(object):
                                 # wrap the cotp packet
                                 tpkt_resp_packet = TPKT(3, cotp_resp_negotiate_packet).pack()
                                 sock.send(tpkt_resp_packet)
+                                self._count_request(data, tpkt_resp_packet)
 
                                 session.add_event({'request': data.encode('hex'), 'response': tpkt_resp_packet.encode('hex')})
 
@@ -153,34 +160,45 @@ class S7Server(object):
                                             S7_packet.magic, S7_packet.pdu_type,
                                             S7_packet.reserved, S7_packet.request_id,
                                             S7_packet.param_length, S7_packet.data_length,
-                                            S7_packet.result_info, session.id)
+                                            S7_packet.result_info, session.id, extra=source)
 
+                                        started = time.time()
                                         response_param, response_data = S7_packet.handle()
+                                        self.metrics.observe('s7comm', time.time() - started)
                                         s7_resp_ssl_packet = S7(7, 0, S7_packet.request_id, 0, response_param,
                                                                 response_data).pack()
                                         cotp_resp_ssl_packet = COTP_BASE_packet(0xf0, 0x80, s7_resp_ssl_packet).pack()
                                         tpkt_resp_packet = TPKT(3, cotp_resp_ssl_packet).pack()
                                         sock.send(tpkt_resp_packet)
+                                        self._count_request(data, tpkt_resp_packet)
 
                                         session.add_event({'request': data.encode('hex'), 'response': tpkt_resp_packet.encode('hex')})
 
                                     data = sock.recv(1024)
                     else:
-                        logger.info(
-                            'Received unknown COTP TPDU after handshake: {0}'.format(cotp_base_packet.tpdu_type))
+                        self.metrics.count('errors', 's7comm')
+                        logger.info('Received unknown COTP TPDU after handshake: %s', cotp_base_packet.tpdu_type,
+                                    extra=source)
                         session.add_event({'error': 'Received unknown COTP TPDU after handshake: {0}'.format(cotp_base_packet.tpdu_type)})
                 else:
-                    logger.info('Received unknown COTP TPDU before handshake: {0}'.format(cotp_base_packet.tpdu_type))
+                    self.metrics.count('errors', 's7comm')
+                    logger.info('Received unknown COTP TPDU before handshake: %s', cotp_base_packet.tpdu_type,
+                                extra=source)
                     session.add_event({'error': 'Received unknown COTP TPDU before handshake: {0}'.format(cotp_base_packet.tpdu_type)})
 
         except socket.timeout:
             session.add_event({'type': 'CONNECTION_LOST'})
-            logger.debug('Socket timeout, remote: {0}. ({1})'.format(address[0], session.id))
+            logger.debug('Socket timeout, remote: %s. (%s)', address[0], session.id)
+
+    def _count_request(self, request, response):
+        self.metrics.count('requests', 's7comm')
+        self.metrics.count('bytes_received', 's7comm', len(request))
+        self.metrics.count('bytes_sent', 's7comm', len(response))
 
     def start(self, host, port):
         connection = (host, port)
-        self.server = StreamServer(connection, self.handle)
-        logger.info('S7Comm server started on: {0}'.format(connection))
+        self.server = StreamServer(conpot_core.get_listener(connection), self.handle)
+        logger.info('S7Comm server started on: %s', connection)
         self.server.start()
 
     def stop(self):
@@ -16,6 +16,10 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 from gevent import subprocess
+from gevent.pool import Pool
+import multiprocessing
+import hashlib
+import json
 import logging
 import os
 import re
@@ -24,12 +28,16 @@ import re
 logger = logging.getLogger(__name__)
 
 BUILD_SCRIPT = 'build-pysnmp-mib'
+# name of the index file kept in the compiled MIB cache directory
+INDEX_FILE = 'mib_index.json'
 
 # dict of lists, where the list contain the dependency names for the given dict key
 mib_dependency_map = {}
 compiled_mibs = []
 # key = mib name, value = full path to the file
 file_map = {}
+# key = mib name, value = sha1 hex digest of the raw MIB file
+digest_map = {}
 
 
 def mib2pysnmp(mib_file):
@@ -68,68 +76,168 @@ def _get_files(raw_mibs_dir, recursive):
             break
 
 
+def _load_index(cache_dir):
+    index = {'files': {}, 'compiled': {}}
+    if cache_dir:
+        try:
+            with open(os.path.join(cache_dir, INDEX_FILE)) as index_file:
+                index.update(json.load(index_file))
+        except (IOError, ValueError):
+            # missing or corrupt index, everything gets rescanned/recompiled.
+            pass
+    return index
+
+
+def _save_index(cache_dir, index):
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    # write to a temporary file first so a crash never leaves a truncated index behind.
+    tmp_path = os.path.join(cache_dir, INDEX_FILE + '.tmp')
+    with open(tmp_path, 'w') as index_file:
+        json.dump(index, index_file)
+    os.rename(tmp_path, os.path.join(cache_dir, INDEX_FILE))
+
+
+def parse_dependencies(data):
+    """
+    Parses the IMPORTS section of a MIB.
+    :param data: A string representing an entire MIB file (string).
+    :return: Names of the MIBs imported by this MIB (list of strings).
+    """
+    dependencies = []
+    imports_section_search = re.search('IMPORTS(?P<imports_section>.*?);', data, re.DOTALL)
+    if imports_section_search:
+        imports_section = imports_section_search.group('imports_section')
+        for dependency in re.finditer('FROM (?P<mib_name>[\w-]+)', imports_section):
+            dependencies.append(dependency.group('mib_name'))
+    return dependencies
+
+
 def generate_dependencies(data, mib_name):
     """
     Parses a MIB for dependencies and populates an internal dependency map.
     :param data: A string representing an entire MIB file (string).
     :param mib_name: Name of the MIB (string).
     """
+    _add_dependencies(mib_name, parse_dependencies(data))
+
+
+def _add_dependencies(mib_name, dependencies):
     if mib_name not in mib_dependency_map:
         mib_dependency_map[mib_name] = []
-    imports_section_search = re.search('IMPORTS(?P<imports_section>.*?);', data, re.DOTALL)
-    if imports_section_search:
-        imports_section = imports_section_search.group('imports_section')
-        for dependency in re.finditer('FROM (?P<mib_name>[\w-]+)', imports_section):
-            dependency_name = dependency.group('mib_name')
-            if dependency_name not in mib_dependency_map:
-                mib_dependency_map[dependency_name] = []
-            mib_dependency_map[mib_name].append(dependency_name)
+    for dependency_name in dependencies:
+        if dependency_name not in mib_dependency_map:
+            mib_dependency_map[dependency_name] = []
+        mib_dependency_map[mib_name].append(dependency_name)
 
 
-def find_mibs(raw_mibs_dirs, recursive=True):
+def find_mibs(raw_mibs_dirs, recursive=True, cache_dir=None):
     """
     Scans for MIB files and populates an internal MIB->path mapping.
     :param raw_mibs_dirs: Directories to search for MIB files (list of strings).
     :param recursive:  If True raw_mibs_dirs will be scanned recursively.
+    :param cache_dir: Optional directory holding the scan index. Files which have not changed since the last
+                      scan (same size and mtime) are not read again.
     :return: A list of found MIB names (list of strings).
     """
+    index = _load_index(cache_dir)
+    scanned = {}
     files_scanned = 0
+    files_read = 0
     for raw_mibs_dir in raw_mibs_dirs:
         for _file in _get_files(raw_mibs_dir, recursive):
             files_scanned += 1
+            stat = os.stat(_file)
             # making sure we don't start parsing some epic file
-            if os.path.getsize(_file) > '1048576':
+            if stat.st_size > 1048576:
                 continue
-            data = open(_file).read()
-            # 2048 - just like a rock star.
-            mib_search = re.search('(?P<mib_name>[\w-]+) DEFINITIONS ::= BEGIN', data[0:2048], re.IGNORECASE)
-            if mib_search:
-                mib_name = mib_search.group('mib_name')
+            entry = index['files'].get(_file)
+            if not entry or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime:
+                files_read += 1
+                data = open(_file).read()
+                entry = {'size': stat.st_size, 'mtime': stat.st_mtime, 'name': None,
+                         'digest': None, 'dependencies': []}
+                # 2048 - just like a rock star.
+                mib_search = re.search('(?P<mib_name>[\w-]+) DEFINITIONS ::= BEGIN', data[0:2048], re.IGNORECASE)
+                if mib_search:
+                    entry['name'] = mib_search.group('mib_name')
+                    entry['digest'] = hashlib.sha1(data).hexdigest()
+                    entry['dependencies'] = parse_dependencies(data)
+            scanned[_file] = entry
+            if entry['name']:
+                mib_name = entry['name']
                 file_map[mib_name] = _file
-                generate_dependencies(data, mib_name)
-    logging.debug('Done scanning for mib files, recursive scan was initiated from {0} directories and found {1} '
-                  'MIB files of {2} scanned files.'
-                  .format(len(raw_mibs_dirs), len(file_map), files_scanned))
+                digest_map[mib_name] = entry['digest']
+                _add_dependencies(mib_name, entry['dependencies'])
+    if cache_dir:
+        index['files'] = scanned
+        _save_index(cache_dir, index)
+    logger.debug('Done scanning for mib files, recursive scan was initiated from {0} directories and found {1} '
+                 'MIB files of {2} scanned files ({3} read from disk).'
+                 .format(len(raw_mibs_dirs), len(file_map), files_scanned, files_read))
     return file_map.keys()
 
 
-def compile_mib(mib_name, output_dir):
+def _resolve_dependencies(mib_name):
+    # iterative depth first walk, MIBs without a known raw file are assumed to be provided by pysnmp.
+    resolved = []
+    pending = [mib_name]
+    while pending:
+        name = pending.pop()
+        if name in resolved or name not in file_map:
+            continue
+        resolved.append(name)
+        pending.extend(mib_dependency_map.get(name, []))
+    return resolved
+
+
+def _mib_digest(mib_name):
+    if mib_name not in digest_map:
+        with open(file_map[mib_name]) as mib_file:
+            digest_map[mib_name] = hashlib.sha1(mib_file.read()).hexdigest()
+    return digest_map[mib_name]
+
+
+def compile_mib(mib_name, output_dir, workers=None):
     """
     Compiles the given mib_name if it is found in the internal MIB file map. If the MIB depends on other MIBs,
-    these will get compiled automatically.
+    these will get compiled automatically. MIBs already present in output_dir with a matching content hash
+    are not compiled again, the remaining ones are compiled concurrently.
     :param mib_name: Name of mib to compile (string).
-    :param output_dir: Output directory (string).
+    :param output_dir: Output directory, also used as persistent cache (string).
+    :param workers: Maximum number of concurrent compiler processes, defaults to the number of CPUs (int).
     """
-    # resolve dependencies recursively
-    for dependency in mib_dependency_map[mib_name]:
-        if dependency not in compiled_mibs and dependency in file_map:
-            compile_mib(dependency, output_dir)
-    _compile_mib(mib_name, output_dir)
+    index = _load_index(output_dir)
+    pending = []
+    for name in _resolve_dependencies(mib_name):
+        output_file = os.path.join(output_dir, _output_filename(name))
+        if index['compiled'].get(name) == _mib_digest(name) and os.path.isfile(output_file):
+            logger.debug('Using cached compiled MIB: %s', name)
+            if name not in compiled_mibs:
+                compiled_mibs.append(name)
+        else:
+            # new, changed since it was compiled or missing from output_dir
+            pending.append(name)
+
+    if pending:
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        pool = Pool(workers)
+        for name in pool.imap_unordered(lambda name: _compile_mib(name, output_dir), pending):
+            index['compiled'][name] = _mib_digest(name)
+        _save_index(output_dir, index)
+
+
+def _output_filename(mib_name):
+    return os.path.basename(os.path.splitext(mib_name)[0]) + '.py'
 
 
 def _compile_mib(mib_name, output_dir):
     pysnmp_str_obj = mib2pysnmp(file_map[mib_name])
-    output_filename = os.path.basename(os.path.splitext(mib_name)[0]) + '.py'
-    with open(os.path.join(output_dir, output_filename), 'w') as output:
+    output_path = os.path.join(output_dir, _output_filename(mib_name))
+    with open(output_path + '.tmp', 'w') as output:
         output.write(pysnmp_str_obj)
+    os.rename(output_path + '.tmp', output_path)
+    if mib_name not in compiled_mibs:
         compiled_mibs.append(mib_name)
+    return mib_name
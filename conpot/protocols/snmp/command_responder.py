@@ -12,12 +12,12 @@ import gevent
 
 from conpot.protocols.snmp import conpot_cmdrsp
 from conpot.protocols.snmp.databus_mediator import DatabusMediator
-from gevent.server import DatagramServer
+from conpot.core.udp_server import UDPServer
 
 logger = logging.getLogger(__name__)
 
 
-class SNMPDispatcher(DatagramServer):
+class SNMPDispatcher(UDPServer):
     def __init__(self):
         self.__timerResolution = 0.5
 
@@ -31,14 +31,14 @@ class SNMPDispatcher(DatagramServer):
             logger.info("SNMP Exception: %s", e)
 
     def registerTransport(self, tDomain, transport):
-        DatagramServer.__init__(self, transport, self.handle)
+        UDPServer.__init__(self, transport, self.handle)
         self.transportDomain = tDomain
 
     def registerTimerCbFun(self, timerCbFun, tickInterval=None):
         pass
 
     def sendMessage(self, outgoingMessage, transportDomain, transportAddress):
-        self.socket.sendto(outgoingMessage, transportAddress)
+        self.sendto(outgoingMessage, transportAddress)
 
     def getTimerResolution(self):
         return self.__timerResolution
@@ -153,7 +153,7 @@ class CommandResponder(object):
         self.snmpEngine.transportDispatcher.serve_forever()
 
     def stop(self):
-        self.snmpEngine.transportDispatcher.stop_accepting()
+        self.snmpEngine.transportDispatcher.stop()
 
 
 if __name__ == "__main__":
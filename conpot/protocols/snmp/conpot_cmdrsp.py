@@ -1,13 +1,16 @@
 import sys
 import logging
 import random
+import bisect
 from datetime import datetime
 
 from pysnmp.entity.rfc3413 import cmdrsp
 from pysnmp.proto import error
 from pysnmp.proto.api import v2c
+from pysnmp.smi import exval
 import pysnmp.smi.error
 from pysnmp import debug
+from pyasn1.codec.ber import encoder
 import gevent
 import conpot.core as conpot_core
 
@@ -193,14 +196,55 @@ class c_NextCommandResponder(cmdrsp.NextCommandResponder, conpot_extension):
 
 
 class c_BulkCommandResponder(cmdrsp.BulkCommandResponder, conpot_extension):
+    # upper bound for the encoded size of the var-binds in a single response, small enough to
+    # keep a response in one unfragmented UDP datagram.
+    max_response_size = 1400
+    # reserved for message, security and PDU headers when honoring the requesters max message size.
+    header_reserve = 128
+
     def __init__(self, snmpEngine, snmpContext, databus_mediator):
         self.databus_mediator = databus_mediator
         self.tarpit = '0;0'
         self.threshold = '0;0'
+        # sorted list of all instance OIDs, rebuilt whenever the MIB builder changes.
+        self.oid_index = []
+        self.oid_index_build_id = None
 
         cmdrsp.BulkCommandResponder.__init__(self, snmpEngine, snmpContext)
         conpot_extension.__init__(self)
 
+    def get_oid_index(self, mibInstrum):
+        mibBuilder = mibInstrum.mibBuilder
+        if self.oid_index_build_id != (mibBuilder.lastBuildId, len(self.databus_mediator.oid_map)):
+            MibScalarInstance, = mibBuilder.importSymbols('SNMPv2-SMI', 'MibScalarInstance')
+            oids = set(tuple(oid) for oid in self.databus_mediator.oid_map)
+            for symbols in mibBuilder.mibSymbols.values():
+                for symbol in symbols.values():
+                    if isinstance(symbol, MibScalarInstance):
+                        oids.add(tuple(symbol.name))
+            self.oid_index = sorted(oids)
+            self.oid_index_build_id = (mibBuilder.lastBuildId, len(self.databus_mediator.oid_map))
+            logger.debug('SNMP OID walk index rebuilt with %s entries.', len(self.oid_index))
+        return self.oid_index
+
+    def read_next(self, mibInstrum, oid_index, oid, acInfo):
+        # returns the first readable instance lexicographically following oid.
+        position = bisect.bisect_right(oid_index, tuple(oid))
+        while position < len(oid_index):
+            try:
+                name, value = mibInstrum.readVars([(oid_index[position], None)], acInfo)[0]
+            except (pysnmp.smi.error.NoAccessError,
+                    pysnmp.smi.error.NoSuchInstanceError,
+                    pysnmp.smi.error.NoSuchObjectError):
+                position += 1
+                continue
+
+            response = self.databus_mediator.get_response(value.__class__.__name__, tuple(name))
+            if response:
+                value = response
+            return name, value
+        return oid, exval.endOfMib
+
     def handleMgmtOperation(self, snmpEngine, stateReference, contextName, PDU, acInfo):
         (acFun, acCtx) = acInfo
         nonRepeaters = v2c.apiBulkPDU.getNonRepeaters(PDU)
@@ -216,7 +260,8 @@ class c_BulkCommandResponder(cmdrsp.BulkCommandResponder, conpot_extension):
         evasion_state = self.databus_mediator.update_evasion_table(addr)
         if self.check_evasive(evasion_state, self.threshold, addr, str(snmp_version)+' Bulk'):
             return None
-        raise Exception('This class is not converted to new architecture')
+
+        rspVarBinds = []
         try:
             N = min(int(nonRepeaters), len(reqVarBinds))
             M = int(maxRepetitions)
@@ -226,22 +271,33 @@ class c_BulkCommandResponder(cmdrsp.BulkCommandResponder, conpot_extension):
 
             debug.logger & debug.flagApp and debug.logger('handleMgmtOperation: N %d, M %d, R %d' % (N, M, R))
 
-            mgmtFun = self.snmpContext.getMibInstrum(contextName).readNextVars
+            max_size = self.max_response_size
+            max_size_scoped_pdu = self._CommandResponderBase__pendingReqs[stateReference][9]
+            if max_size_scoped_pdu:
+                max_size = min(max_size, max_size_scoped_pdu - self.header_reserve)
 
-            if N:
-                rspVarBinds = mgmtFun(reqVarBinds[:N], (acFun, acCtx))
-            else:
-                rspVarBinds = []
+            mibInstrum = self.snmpContext.getMibInstrum(contextName)
+            oid_index = self.get_oid_index(mibInstrum)
 
-            varBinds = reqVarBinds[-R:]
+            size = 0
+            for oid, _ in reqVarBinds[:N]:
+                rspVarBinds.append(self.read_next(mibInstrum, oid_index, oid, (acFun, acCtx)))
+                size += self._varbind_size(rspVarBinds[-1])
+
+            varBinds = reqVarBinds[N:]
             while M and R:
-                rspVarBinds.extend(
-                    mgmtFun(varBinds, (acFun, acCtx))
-                )
-                varBinds = rspVarBinds[-R:]
+                repetition = [self.read_next(mibInstrum, oid_index, oid, (acFun, acCtx)) for oid, _ in varBinds]
+                size += sum(self._varbind_size(varBind) for varBind in repetition)
+                # never send an empty response, but otherwise stop before exceeding the size limit.
+                if rspVarBinds and size > max_size:
+                    break
+                rspVarBinds.extend(repetition)
+                if all(value is exval.endOfMib for _, value in repetition):
+                    break
+                varBinds = repetition
                 M = M - 1
         finally:
-            self.log(snmp_version, 'Bulk', addr, varBinds, rspVarBinds)
+            self.log(snmp_version, 'Bulk', addr, reqVarBinds, rspVarBinds)
 
         # apply tarpit delay
         if self.tarpit is not 0:
@@ -254,6 +310,11 @@ class c_BulkCommandResponder(cmdrsp.BulkCommandResponder, conpot_extension):
         else:
             raise pysnmp.smi.error.SmiError()
 
+    def _varbind_size(self, varBind):
+        name, value = varBind
+        # var-bind sequence header plus encoded name and value
+        return 4 + len(encoder.encode(v2c.ObjectIdentifier(name))) + len(encoder.encode(value))
+
 class c_SetCommandResponder(cmdrsp.SetCommandResponder, conpot_extension):
     def __init__(self, snmpEngine, snmpContext, databus_mediator):
         self.databus_mediator = databus_mediator
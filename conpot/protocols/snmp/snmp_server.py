@@ -19,6 +19,7 @@ import logging
 import tempfile
 import shutil
 import os
+import stat
 
 from lxml import etree
 
@@ -30,6 +31,21 @@ import conpot.core as conpot_core
 logger = logging.getLogger()
 
 
+def private_directory(path):
+    """
+    Creates the directory if it is missing.
+    :return: True if the directory is owned by this user and nobody else can write to it (bool).
+    """
+    if not os.path.lexists(path):
+        try:
+            os.makedirs(path, 0700)
+        except OSError:
+            return False
+    path_stat = os.lstat(path)
+    return (stat.S_ISDIR(path_stat.st_mode) and path_stat.st_uid == os.getuid() and
+            not path_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH))
+
+
 class SNMPServer(object):
     def __init__(self, template, template_directory, args):
         """
@@ -42,7 +58,7 @@ class SNMPServer(object):
         self.cmd_responder = None
 
         if args.mibpaths:
-            self.compiled_mibs = args.mibpaths
+            self.compiled_mibs = list(args.mibpaths)
         else:
             self.compiled_mibs = [os.path.join(template_directory, 'snmp', 'mibs_compiled')]
 
@@ -51,6 +67,18 @@ class SNMPServer(object):
         else:
             self.raw_mibs = [os.path.join(template_directory, 'snmp', 'mibs_raw')]
 
+        # compiled raw mibs are kept between runs in the --mibcache directory, keyed on the content hash of the raw
+        # mib file. They are loaded as python modules, so nobody else may write to that directory.
+        self.mib_cache = getattr(args, 'mibcache', None)
+        self.temporary_mib_cache = None
+        if self.mib_cache and not private_directory(self.mib_cache):
+            logger.warning('MIB cache %s is not a directory owned and only writable by this user, compiling the MIBs '
+                           'to a temporary directory.', self.mib_cache)
+            self.mib_cache = None
+        if not self.mib_cache:
+            self.mib_cache = self.temporary_mib_cache = tempfile.mkdtemp(prefix='conpot_mibs')
+        self.compiled_mibs.append(self.mib_cache)
+
     def xml_general_config(self, dom):
         snmp_config = dom.xpath('//snmp/config/*')
         if snmp_config:
@@ -81,45 +109,42 @@ class SNMPServer(object):
                         self.cmd_responder.resp_app_bulk.threshold = self.config_sanitize_threshold(entity.text)
 
     def xml_mib_config(self, dom, mibpaths, rawmibs_dirs):
-        try:
-            mibs = dom.xpath('//snmp/mibs/*')
-            tmp_mib_dir = tempfile.mkdtemp()
-            mibpaths.append(tmp_mib_dir)
-            available_mibs = find_mibs(rawmibs_dirs)
-
-            databus = conpot_core.get_databus()
-            # parse mibs and oid tables
-            for mib in mibs:
-                mib_name = mib.attrib['name']
-                # compile the mib file if it is found and not already loaded.
-                if mib_name in available_mibs and not self.cmd_responder.has_mib(mib_name):
-                    compile_mib(mib_name, tmp_mib_dir)
-                for symbol in mib:
-                    symbol_name = symbol.attrib['name']
-
-                    # retrieve instance from template
-                    if 'instance' in symbol.attrib:
-                        # convert instance to (int-)tuple
-                        symbol_instance = symbol.attrib['instance'].split('.')
-                        symbol_instance = tuple(map(int, symbol_instance))
-                    else:
-                        # use default instance (0)
-                        symbol_instance = (0,)
-
-
-                    # retrieve value from databus
-                    value = databus.get_value(symbol.xpath('./value/text()')[0])
-                    profile_map_name = symbol.xpath('./value/text()')[0]
-
-                    # register this MIB instance to the command responder
-                    self.cmd_responder.register(mib_name,
-                                                symbol_name,
-                                                symbol_instance,
-                                                value,
-                                                profile_map_name)
-        finally:
-            # cleanup compiled mib files
-            shutil.rmtree(tmp_mib_dir)
+        mibs = dom.xpath('//snmp/mibs/*')
+        available_mibs = find_mibs(rawmibs_dirs, cache_dir=self.mib_cache)
+
+        # compile (or fetch from cache) all referenced mibs before loading any of them.
+        for mib in mibs:
+            mib_name = mib.attrib['name']
+            if mib_name in available_mibs and not self.cmd_responder.has_mib(mib_name):
+                compile_mib(mib_name, self.mib_cache)
+
+        databus = conpot_core.get_databus()
+        # parse mibs and oid tables
+        for mib in mibs:
+            mib_name = mib.attrib['name']
+            for symbol in mib:
+                symbol_name = symbol.attrib['name']
+
+                # retrieve instance from template
+                if 'instance' in symbol.attrib:
+                    # convert instance to (int-)tuple
+                    symbol_instance = symbol.attrib['instance'].split('.')
+                    symbol_instance = tuple(map(int, symbol_instance))
+                else:
+                    # use default instance (0)
+                    symbol_instance = (0,)
+
+
+                # retrieve value from databus
+                value = databus.get_value(symbol.xpath('./value/text()')[0])
+                profile_map_name = symbol.xpath('./value/text()')[0]
+
+                # register this MIB instance to the command responder
+                self.cmd_responder.register(mib_name,
+                                            symbol_name,
+                                            symbol_instance,
+                                            value,
+                                            profile_map_name)
 
     def config_sanitize_tarpit(self, value):
 
@@ -187,6 +212,9 @@ class SNMPServer(object):
     def stop(self):
         if self.cmd_responder:
             self.cmd_responder.stop()
+        if self.temporary_mib_cache:
+            shutil.rmtree(self.temporary_mib_cache, ignore_errors=True)
+            self.temporary_mib_cache = None
 
     def get_port(self):
         if self.cmd_responder:
@@ -0,0 +1,50 @@
+# Connection rate of an S7 port, opening a COTP connection for every request
+# Usage: python -m conpot.tests.helpers.connection_benchmark <host> <port> [seconds] [concurrency]
+
+import gevent.monkey
+gevent.monkey.patch_all()
+
+import socket
+import sys
+import time
+
+from gevent.pool import Pool
+
+from conpot.tests.helpers.s7comm_client import TPKTPacket, COTPConnectionPacket
+
+CONNECTION_REQUEST = TPKTPacket(COTPConnectionPacket(0, 10, 0x102, 0x100, 0x0a)).pack()
+
+
+def connect(host, port):
+    sock = socket.create_connection((host, port), timeout=5)
+    try:
+        sock.sendall(CONNECTION_REQUEST)
+        return bool(sock.recv(1024))
+    finally:
+        sock.close()
+
+
+def benchmark(host, port, seconds=10, concurrency=50):
+    """ :return: Completed connections per second. """
+    completed = [0]
+    deadline = time.time() + seconds
+
+    def client():
+        while time.time() < deadline:
+            try:
+                if connect(host, port):
+                    completed[0] += 1
+            except socket.error:
+                pass
+
+    pool = Pool(concurrency)
+    for _ in range(concurrency):
+        pool.spawn(client)
+    pool.join()
+    return completed[0] / float(seconds)
+
+
+if __name__ == '__main__':
+    print('{0:.0f} connections/s'.format(benchmark(sys.argv[1], int(sys.argv[2]),
+                                                   int(sys.argv[3]) if len(sys.argv) > 3 else 10,
+                                                   int(sys.argv[4]) if len(sys.argv) > 4 else 50)))
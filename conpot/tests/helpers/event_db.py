@@ -0,0 +1,92 @@
+# Synthetic event databases for conpot_playback
+# Usage as a benchmark: python -m conpot.tests.helpers.event_db <db path> <size in MB> [decoding workers]
+
+import os
+import random
+import sqlite3
+import struct
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from conpot.core.loggers.sqlite_log import create_db
+from conpot.protocols.s7comm.tpkt import TPKT
+from conpot.protocols.s7comm.cotp import COTP
+from conpot.protocols.s7comm.s7 import S7
+from conpot.utils.playback import ConpotPlayback
+
+START = datetime(2015, 1, 1)
+
+
+def modbus_event(transaction_id):
+    # read holding registers 0-9 of slave 1
+    request = struct.pack('>HHHBBHH', transaction_id, 0, 6, 1, 3, 0, 10)
+    response = struct.pack('>BB', 3, 20) + '\x00' * 20
+    return request.encode('hex'), response.encode('hex')
+
+
+def s7comm_event(request_id):
+    # SZL read, the parameters are those of the 0x001c identity request
+    parameters = '\x00\x01\x12\x04\x11\x44\x01\x00'
+    request = TPKT(3, COTP(0xf0, 0x80, S7(7, 0, request_id, 0, parameters, '\xff\x09\x00\x04\x00\x1c\x00\x00').pack())
+                   .pack()).pack()
+    response = TPKT(3, COTP(0xf0, 0x80, S7(7, 0, request_id, 0, parameters, os.urandom(200)).pack()).pack()).pack()
+    return request.encode('hex'), response.encode('hex')
+
+
+def snmp_event(_):
+    return 'SNMPv2c Get: 1.3.6.1.2.1.1.1.0 ', 'SNMPv2c response: 1.3.6.1.2.1.1.1.0 Siemens, SIMATIC, S7-200'
+
+
+EVENTS = {'modbus': modbus_event, 's7comm': s7comm_event, 'snmp': snmp_event}
+
+
+def fill(db_path, events, sessions=1000, events_per_session=20):
+    """ Adds events spread over sessions of random protocols and sources. :return: List of the session ids. """
+    conn = sqlite3.connect(db_path)
+    create_db(conn)
+    session_ids = []
+    rows = []
+    last = conn.execute('SELECT MAX(timestamp) FROM events').fetchone()[0]
+    timestamp = datetime.strptime(last, '%Y-%m-%d %H:%M:%S') if last else START
+    for session in xrange(sessions):
+        session_id = str(uuid.uuid4())
+        session_ids.append(session_id)
+        protocol = random.choice(sorted(EVENTS))
+        remote = str(('10.0.{0}.{1}'.format(session / 250 % 250, session % 250 + 1), random.randint(1024, 65535)))
+        for n in xrange(events_per_session):
+            if len(rows) == events:
+                break
+            timestamp += timedelta(seconds=random.randint(0, 2))
+            request, response = EVENTS[protocol](n)
+            rows.append((session_id, timestamp.strftime('%Y-%m-%d %H:%M:%S'), remote, protocol, request, response))
+    conn.executemany('INSERT INTO events(session, timestamp, remote, protocol, request, response) '
+                     'VALUES (?, ?, ?, ?, ?, ?)', rows)
+    conn.commit()
+    conn.close()
+    return session_ids
+
+
+def benchmark(db_path, size_mb, workers=0):
+    """ Fills the database up to size_mb and prints the time taken by the playback queries. """
+    session_ids = fill(db_path, 100000, sessions=5000)
+    while os.path.getsize(db_path) < size_mb * 1024 * 1024:
+        session_ids = fill(db_path, 100000, sessions=5000)
+    cplay = ConpotPlayback(db_path, workers=workers)
+    count = cplay.conn.execute('SELECT COUNT(*) FROM events').fetchone()[0]
+    print('{0} events, {1:.0f} MB'.format(count, os.path.getsize(db_path) / 1024.0 / 1024))
+    for name, filters in (('session', {'session': session_ids[-1]}),
+                          ('remote', {'remote': '10.0.0.1'}),
+                          ('protocol and hour', {'protocol': 'modbus', 'start': START + timedelta(days=1),
+                                                 'end': START + timedelta(days=1, hours=1)})):
+        start = time.time()
+        lines = sum(1 for _ in cplay.decode(cplay.select(**filters)))
+        print('{0}: {1} lines in {2:.3f}s'.format(name, lines, time.time() - start))
+    start = time.time()
+    lines = sum(1 for _ in cplay.decode(cplay.select()))
+    print('all: {0:.0f} lines/s'.format(lines / (time.time() - start)))
+
+
+if __name__ == '__main__':
+    benchmark(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]) if len(sys.argv) > 3 else 0)
@@ -0,0 +1,76 @@
+# RMCP+ session establishment (IPMI v2.0 specification, section 13.15 - 13.20)
+# Usage as a microbenchmark: python -m conpot.tests.helpers.ipmi_client <host> <port> [handshakes]
+
+import hashlib
+import hmac
+import os
+import struct
+import sys
+import time
+
+from gevent import socket
+
+from conpot.protocols.ipmi import codec
+
+
+class IPMIClient(object):
+    def __init__(self, host, port, username='Administrator', password='Password', timeout=5):
+        self.address = (host, port)
+        self.username = username
+        self.password = password
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.settimeout(timeout)
+
+    def _request(self, payload_type, payload):
+        packet = codec.IPMI20_HEADER.pack(codec.RMCP_HEADER, 6, payload_type, 0, 0, len(payload)) + payload
+        self.sock.sendto(packet, self.address)
+        data, _ = self.sock.recvfrom(1024)
+        return data[codec.IPMI20_HEADER.size:]
+
+    def handshake(self):
+        """ Runs open session request, RAKP 1 and RAKP 3. Returns the managed system session id. """
+        client_session_id = struct.unpack('<I', os.urandom(4))[0] | 1
+        response = self._request(0x10, codec.OPEN_SESSION_REQUEST.pack(0, 4, client_session_id) +
+                                 codec.CIPHER_SUITE_3)
+        _, status, _, _, managed_session_id = codec.OPEN_SESSION_RESPONSE.unpack_from(response)
+        assert status == 0, 'open session request failed'
+
+        # role: administrator, name only lookup
+        role = 0x14
+        rm = os.urandom(16)
+        response = self._request(0x12, codec.RAKP1.pack(0, managed_session_id, rm, role, len(self.username)) +
+                                 self.username)
+        _, status, _, rc, guid = codec.RAKP2.unpack_from(response)
+        assert status == 0, 'RAKP 1 failed'
+        hmacdata = codec.RAKP2_AUTHCODE.pack(client_session_id, managed_session_id, rm, rc, guid, role,
+                                             len(self.username))
+        expected = hmac.new(self.password, hmacdata + self.username, hashlib.sha1).digest()
+        assert response[codec.RAKP2.size:] == expected, 'RAKP 2 key exchange authentication code mismatch'
+
+        hmacdata = codec.RAKP3_AUTHCODE.pack(rc, client_session_id, role, len(self.username))
+        authcode = hmac.new(self.password, hmacdata + self.username, hashlib.sha1).digest()
+        response = self._request(0x14, codec.RAKP3.pack(0, 0, managed_session_id) + authcode)
+        _, status, _ = codec.RAKP4.unpack_from(response)
+        assert status == 0, 'RAKP 3 failed'
+        hmacdata = codec.SESSION_INTEGRITY_KEY.pack(rm, rc, role, len(self.username))
+        sik = hmac.new(self.password, hmacdata + self.username, hashlib.sha1).digest()
+        expected = hmac.new(sik, codec.RAKP4_INTEGRITY_CHECK.pack(rm, managed_session_id, guid),
+                            hashlib.sha1).digest()[:codec.AUTHCODE_SIZE]
+        assert response[codec.RAKP4.size:] == expected, 'RAKP 4 integrity check value mismatch'
+        return managed_session_id
+
+    def benchmark(self, count=1000):
+        """ Returns the number of completed handshakes per second. """
+        start = time.time()
+        for _ in xrange(count):
+            self.handshake()
+        return count / (time.time() - start)
+
+    def close(self):
+        self.sock.close()
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+    client = IPMIClient(sys.argv[1], int(sys.argv[2]))
+    print('{0:.0f} handshakes/s'.format(client.benchmark(count)))
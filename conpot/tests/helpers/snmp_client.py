@@ -84,6 +84,19 @@ class SNMPClient(object):
             callback,
         )
 
+    def bulk_command(self, OID, non_repeaters=0, max_repetitions=10, callback=None):
+        if not callback:
+            callback = self.cbFun
+        cmdgen.BulkCommandGenerator().sendReq(
+            self.snmpEngine,
+            'my-router',
+            non_repeaters,
+            max_repetitions,
+            (OID,),
+            callback,
+        )
+        self.snmpEngine.transportDispatcher.runDispatcher()
+
 
 if __name__ == "__main__":
     snmp_client = SNMPClient('127.0.0.1', 161)
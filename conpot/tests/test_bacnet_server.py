@@ -35,6 +35,7 @@ from bacpypes.constructeddata import Any
 from bacpypes.primitivedata import Real
 
 import socket
+from StringIO import StringIO
 
 monkey.patch_all()
 
@@ -152,5 +153,108 @@ class TestBase(unittest.TestCase):
 
         self.assertEquals(exp_pdu.pduData, received_data)
 
+    def test_readProperty_cached(self):
+        """
+        Objective: Test that cached ReadProperty responses carry the invoke id of the request.
+        """
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for invoke_id in (101, 102):
+            request = ReadPropertyRequest(objectIdentifier=('analogInput', 14), propertyIdentifier=85)
+            request.apduMaxResp = 1024
+            request.apduInvokeID = invoke_id
+            apdu = APDU()
+            request.encode(apdu)
+            pdu = PDU()
+            apdu.encode(pdu)
+            s.sendto(pdu.pduData, ('127.0.0.1', self.bacnet_server.server.server_port))
+            received_data = s.recvfrom(1024)[0]
+
+            expected = ReadPropertyACK()
+            expected.pduDestination = GlobalBroadcast()
+            expected.apduInvokeID = invoke_id
+            expected.objectIdentifier = 14
+            expected.objectName = 'AI 01'
+            expected.propertyIdentifier = 85
+            expected.propertyValue = Any(Real(68.0))
+            exp_apdu = APDU()
+            expected.encode(exp_apdu)
+            exp_pdu = PDU()
+            exp_apdu.encode(exp_pdu)
+
+            self.assertEquals(exp_pdu.pduData, received_data)
+        self.assertEqual(1, len(self.bacnet_server.bacnet_app.response_cache))
+
+        self.databus.set_value(self.bacnet_server.device_name_key, 'changed')
+        gevent.sleep(0)
+        self.assertEqual(0, len(self.bacnet_server.bacnet_app.response_cache))
+
+    def test_concurrent_requests(self):
+        """
+        Objective: Test that concurrently processed requests are answered with their own responses.
+        """
+        who_is = WhoIsRequest()
+        read_property = ReadPropertyRequest(objectIdentifier=('analogInput', 14), propertyIdentifier=85)
+        read_property.apduMaxResp = 1024
+        read_property.apduInvokeID = 7
+        requests = []
+        for request in (who_is, read_property):
+            apdu = APDU()
+            request.encode(apdu)
+            pdu = PDU()
+            apdu.encode(pdu)
+            requests.append(pdu.pduData)
+
+        who_is_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        read_property_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for _ in range(10):
+            who_is_socket.sendto(requests[0], ('127.0.0.1', self.bacnet_server.server.server_port))
+            read_property_socket.sendto(requests[1], ('127.0.0.1', self.bacnet_server.server.server_port))
+        who_is_replies = set(who_is_socket.recvfrom(1024)[0] for _ in range(10))
+        read_property_replies = set(read_property_socket.recvfrom(1024)[0] for _ in range(10))
+        self.assertEqual(1, len(who_is_replies))
+        self.assertEqual(1, len(read_property_replies))
+        self.assertNotEqual(who_is_replies, read_property_replies)
+
+    def test_databus_device_info(self):
+        """
+        Objective: Test that cached responses and the device name mapping follow databus backed device properties.
+        """
+        self.bacnet_server.stop()
+        gevent.joinall([self.server_greenlet])
+        with open('conpot/templates/default/bacnet/bacnet.xml') as template:
+            template = template.read().replace('<vendor_identifier>15</vendor_identifier>',
+                                               '<vendor_identifier>BacnetVendorIdentifier</vendor_identifier>')
+        self.databus.set_value('BacnetVendorIdentifier', 15)
+        args = namedtuple('FakeArgs', '')
+        self.bacnet_server = bacnet_server.BacnetServer(StringIO(template), 'none', args)
+        self.server_greenlet = gevent.spawn(self.bacnet_server.start, '0.0.0.0', 0)
+        gevent.sleep(1)
+
+        apdu = APDU()
+        WhoIsRequest().encode(apdu)
+        pdu = PDU()
+        apdu.encode(pdu)
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        vendor_ids = []
+        for vendor_id in (15, 42):
+            self.databus.set_value('BacnetVendorIdentifier', vendor_id)
+            gevent.sleep(0)
+            s.sendto(pdu.pduData, ('127.0.0.1', self.bacnet_server.server.server_port))
+            response = PDU()
+            response.pduData = s.recvfrom(1024)[0]
+            response_apdu = APDU()
+            response_apdu.decode(response)
+            i_am = IAmRequest()
+            i_am.decode(response_apdu)
+            vendor_ids.append(i_am.vendorID)
+        self.assertEqual([15, 42], vendor_ids)
+
+        device = self.bacnet_server.thisDevice
+        self.databus.set_value(self.bacnet_server.device_name_key, 'changed')
+        gevent.sleep(0)
+        self.assertEqual('changed', device.objectName)
+        self.assertEqual({'changed': device}, dict((name, obj) for name, obj in
+                                                   self.bacnet_server.bacnet_app.objectName.items() if obj is device))
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,143 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import gevent.monkey
+gevent.monkey.patch_all()
+
+import os
+import unittest
+import tempfile
+import shutil
+from collections import namedtuple
+
+import gevent
+from gevent.server import StreamServer
+from lxml import etree
+from pysnmp.entity.rfc3413.oneliner import cmdgen
+
+import conpot.core as conpot_core
+from conpot.protocols.modbus import modbus_server
+from conpot.protocols.snmp.snmp_server import SNMPServer
+from conpot.utils.cloner import ConpotCloner, MODBUS_TABLES, format_value
+
+
+class TestCloner(unittest.TestCase):
+    def setUp(self):
+        conpot_core.get_sessionManager().purge_sessions()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.databus = conpot_core.get_databus()
+        self.databus.initialize('conpot/templates/default/template.xml')
+        self.args = namedtuple('FakeArgs', 'mibpaths raw_mib')
+        self.args.mibpaths = [self.tmp_dir]
+        self.args.raw_mib = [self.tmp_dir]
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+        self.databus.reset()
+        conpot_core.get_sessionManager().purge_sessions()
+        shutil.rmtree(self.tmp_dir)
+
+    def start_snmp(self, template):
+        snmp = SNMPServer(template, 'none', self.args)
+        gevent.spawn(snmp.start, '127.0.0.1', 0)
+        gevent.sleep(1)
+        self.servers.append(snmp)
+        return snmp.get_port()
+
+    def start_modbus(self):
+        modbus = modbus_server.ModbusServer('conpot/templates/default/modbus/modbus.xml', 'none', self.args,
+                                            timeout=2)
+        server = StreamServer(('127.0.0.1', 0), modbus.handle)
+        server.start()
+        self.servers.append(server)
+        return server.server_port
+
+    def cloner(self, modbus_port=502, snmp_port=161):
+        # the start of every table is enough to find the blocks of the default template
+        tables = [table._replace(addresses=(table.addresses[0], table.addresses[0] + 999)) for table in MODBUS_TABLES]
+        snmp_auth = cmdgen.UsmUserData('usr-sha-aes128', 'authkey1', 'privkey1',
+                                       authProtocol=cmdgen.usmHMACSHAAuthProtocol,
+                                       privProtocol=cmdgen.usmAesCfb128Protocol)
+        return ConpotCloner('127.0.0.1', modbus_port, snmp_port, snmp_auth,
+                            modbus_options={'slaves': range(0, 4), 'tables': tables, 'rate': 0},
+                            snmp_options={'rate': 0})
+
+    def validate(self, template, schema):
+        xsd = etree.XMLSchema(etree.parse(schema))
+        self.assertTrue(xsd.validate(etree.parse(template)), xsd.error_log)
+
+    def test_snmp_clone(self):
+        """
+        Objective: Test that a cloned SNMP template serves the values of the cloned device
+        """
+        cloner = self.cloner(snmp_port=self.start_snmp('conpot/templates/default/snmp/snmp.xml'))
+        output = os.path.join(self.tmp_dir, 'clone')
+        cloner.clone(output, modbus=False)
+        self.assertFalse(os.path.exists(os.path.join(output, 'modbus')))
+        self.validate(os.path.join(output, 'template.xml'), 'conpot/tests/template_schemas/core.xsd')
+        self.validate(os.path.join(output, 'snmp', 'snmp.xml'), 'conpot/protocols/snmp/snmp.xsd')
+        snmp_template = etree.parse(os.path.join(output, 'snmp', 'snmp.xml'))
+        symbols = snmp_template.xpath('//mib[@name="SNMPv2-MIB"]/symbol/@name')
+        for symbol in ('sysDescr', 'sysUpTime', 'sysContact', 'sysName', 'sysLocation'):
+            self.assertIn(symbol, symbols)
+
+        self.databus.reset()
+        self.databus.initialize(os.path.join(output, 'template.xml'))
+        self.assertEqual('Siemens, SIMATIC, S7-200', self.databus.get_value('sysDescr'))
+        self.assertLess(self.databus.get_value('sysUpTime'), 60)
+        cloner = self.cloner(snmp_port=self.start_snmp(os.path.join(output, 'snmp', 'snmp.xml')))
+        values = dict((oid, value.prettyPrint()) for oid, value in cloner.snmp_walker.walk(['1.3.6.1.2.1.1']))
+        self.assertEqual('Siemens, SIMATIC, S7-200', values[(1, 3, 6, 1, 2, 1, 1, 1, 0)])
+        self.assertEqual('Venus', values[(1, 3, 6, 1, 2, 1, 1, 6, 0)])
+
+    def test_snmp_walk_columns(self):
+        """
+        Objective: Test that walking more subtrees than fit in one request returns every value once
+        """
+        cloner = self.cloner(snmp_port=self.start_snmp('conpot/templates/default/snmp/snmp.xml'))
+        cloner.snmp_walker.columns = 2
+        cloner.snmp_walker.max_repetitions = 1
+        oids = ['1.3.6.1.2.1.1.{0}.0'.format(n) for n in (1, 3, 4, 5, 6, 7)] + ['1.3.6.1.2.1.2.2.1.1']
+        walked = [oid for oid, _ in cloner.snmp_walker.walk(oids)]
+        self.assertEqual([(1, 3, 6, 1, 2, 1, 1, n, 0) for n in (1, 3, 4, 5, 6, 7)], walked)
+
+    def test_modbus_clone(self):
+        """
+        Objective: Test that the Modbus scanner finds every block of the cloned slaves
+        """
+        self.databus.set_value('memoryModbusSlave1BlockA', [1, 0] * 64)
+        self.databus.set_value('memoryModbusSlave2BlockD', range(32))
+        cloner = self.cloner(modbus_port=self.start_modbus())
+        output = os.path.join(self.tmp_dir, 'clone')
+        cloner.clone(output, snmp=False)
+        self.validate(os.path.join(output, 'modbus', 'modbus.xml'), 'conpot/protocols/modbus/modbus.xsd')
+        dom = etree.parse(os.path.join(output, 'modbus', 'modbus.xml'))
+        self.assertEqual(['1', '2'], dom.xpath('//slave/@id'))
+        self.assertEqual('serial', dom.xpath('//mode/text()')[0])
+        self.assertEqual('Siemens', dom.xpath('//VendorName/text()')[0])
+        blocks = [(block.xpath('../../@id')[0], block.findtext('type'), int(block.findtext('starting_address')),
+                   int(block.findtext('size'))) for block in dom.xpath('//block')]
+        self.assertEqual([('1', 'COILS', 1, 128), ('1', 'DISCRETE_INPUTS', 10001, 32),
+                          ('2', 'ANALOG_INPUTS', 30001, 8), ('2', 'HOLDING_REGISTERS', 40001, 32)], blocks)
+        contents = dom.xpath('//block/content/text()')
+        template = etree.parse(os.path.join(output, 'template.xml'))
+        self.assertEqual(format_value([1, 0] * 64),
+                         template.xpath('//key[@name="{0}"]/value/text()'.format(contents[0]))[0])
+        self.assertEqual(format_value(range(32)),
+                         template.xpath('//key[@name="{0}"]/value/text()'.format(contents[3]))[0])
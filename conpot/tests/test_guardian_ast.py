@@ -0,0 +1,109 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import gevent.monkey
+gevent.monkey.patch_all()
+
+import unittest
+
+import gevent
+from gevent import socket
+
+import conpot.core as conpot_core
+from conpot.protocols.guardian_ast.guardian_ast_server import GuardianASTServer
+
+
+class TestGuardianAST(unittest.TestCase):
+    def setUp(self):
+        # clean up before we start...
+        conpot_core.get_sessionManager().purge_sessions()
+
+        self.databus = conpot_core.get_databus()
+        self.databus.initialize('conpot/templates/guardian_ast/template.xml')
+        self.guardian_ast_server = GuardianASTServer(None, None, None)
+        self.guardian_ast_server.start('127.0.0.1', 0)
+
+    def tearDown(self):
+        self.guardian_ast_server.stop()
+        self.databus.reset()
+        conpot_core.get_sessionManager().purge_sessions()
+
+    def connect(self):
+        sock = socket.create_connection(('127.0.0.1', self.guardian_ast_server.server.server_port))
+        sock.settimeout(5)
+        return sock
+
+    def send_command(self, sock, command):
+        sock.send('\x01' + command + '\n')
+        return sock.recv(4096)
+
+    def test_inventory_report(self):
+        """
+        Objective: Test the in-tank inventory report and that it is served from cache
+        """
+        sock = self.connect()
+        report = self.send_command(sock, 'I20100')
+        self.assertTrue(report.startswith('\nI20100\n'))
+        self.assertIn('STATOIL STATION', report)
+        self.assertIn('\n  1  SUPER                 {0}'.format(self.databus.get_value('vol1')), report)
+        reports = self.guardian_ast_server.reports
+        self.assertIs(reports.render('I20100'), reports.render('I20100'))
+        sock.close()
+
+    def test_databus_change(self):
+        """
+        Objective: Test that a changed databus value is reflected in the next report
+        """
+        sock = self.connect()
+        self.assertIn('DIESEL', self.send_command(sock, 'I20300'))
+        self.databus.set_value('product3', 'BIODIESEL')
+        # observers are notified asynchronously
+        gevent.sleep(0)
+        self.assertIn('TANK 3    BIODIESEL', self.send_command(sock, 'I20300'))
+        sock.close()
+
+    def test_change_product_name(self):
+        """
+        Objective: Test that a renamed tank is only visible to the connection renaming it
+        """
+        sock = self.connect()
+        sock.send('\x01S60202FUEL\n')
+        self.assertIn('  2    FUEL                    HIGH WATER ALARM', self.send_command(sock, 'I20500'))
+        self.assertIn('  2    UNLEAD', self.guardian_ast_server.reports.render('I20500'))
+        sock.close()
+
+    def test_pipelined_commands(self):
+        """
+        Objective: Test that several commands received in one read are all answered
+        """
+        sock = self.connect()
+        sock.send('\x01S60201FUEL\n\x01I20300\x01I20500\r\n')
+        response = ''
+        while not response.endswith('NORMAL\n\n'):
+            response += sock.recv(4096)
+        self.assertIn('TANK 1    FUEL', response)
+        self.assertIn('\nI20500\n', response)
+        sock.close()
+
+    def test_command_length_limit(self):
+        """
+        Objective: Test that a client never sending a newline is disconnected
+        """
+        sock = self.connect()
+        sock.send('\x01S60201' + 'A' * (self.guardian_ast_server.max_command_length + 1))
+        self.assertEqual(sock.recv(4096), '')
+        sock.close()
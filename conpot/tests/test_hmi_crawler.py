@@ -0,0 +1,136 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import gevent.monkey
+gevent.monkey.patch_all()
+
+import os
+import time
+import unittest
+import tempfile
+import shutil
+from collections import Counter
+
+import gevent
+from gevent.pywsgi import WSGIServer
+
+from conpot.utils.hmi_crawler import Crawler
+
+
+LOGO = '\x89PNG\r\n' + os.urandom(200000)
+SITE = {
+    '/index.html': ('text/html', '<html><head><link rel="stylesheet" type="text/css" href="style.css"></head>'
+                                 '<body><a href="/status.html">status</a><a href="http://example.com/">ext</a>'
+                                 '<img src="img/logo.png"><iframe src="/frames/"></iframe>'
+                                 '<a href="status.html#top">again</a></body></html>'),
+    '/status.html': ('text/html', '<html><body><a href="/index.html">back</a><img src="/img/copy.png">'
+                                  '<a href="/missing.html">gone</a></body></html>'),
+    '/style.css': ('text/css', 'body { background: url("img/bg.png") }'),
+    '/img/logo.png': ('image/png', LOGO),
+    '/img/copy.png': ('image/png', LOGO),
+    '/img/bg.png': ('image/png', '\x89PNG\r\nbackground'),
+    '/frames/': ('text/html', '<html><body><a href="../index.html">home</a></body></html>'),
+}
+
+
+class TestHMICrawler(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.requests = Counter()
+        self.delay = 0
+        self.site = SITE
+        self.server = WSGIServer(('127.0.0.1', 0), self.application, log=None)
+        self.server.start()
+        self.target = 'http://127.0.0.1:{0}'.format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def application(self, environ, start_response):
+        path = environ['PATH_INFO']
+        self.requests[path] += 1
+        gevent.sleep(self.delay)
+        if path == '/':
+            start_response('302 Found', [('Location', '/index.html')])
+            return ['']
+        if path not in self.site:
+            start_response('404 Not Found', [('Content-Type', 'text/html')])
+            return ['not found']
+        content_type, body = self.site[path]
+        start_response('200 OK', [('Content-Type', content_type), ('Last-Modified', 'Tue, 19 May 1993 09:00:00 GMT')])
+        return [body]
+
+    def test_crawl(self):
+        """
+        Objective: Test that the crawler mirrors every resource of the HMI once and lists it in htdocs
+        """
+        htdocs = Crawler(self.target, self.tmp_dir).work()
+        self.assertEqual(set(['/', '/index.html', '/status.html', '/style.css', '/img/logo.png', '/img/copy.png',
+                              '/img/bg.png', '/frames/', '/missing.html']), set(self.requests))
+        self.assertEqual(1, max(self.requests.values()))
+        for filename, path in (('index.html', '/index.html'), ('status.html', '/status.html'),
+                               ('style.css', '/style.css'), ('img/logo.png', '/img/logo.png'),
+                               ('img/bg.png', '/img/bg.png'), ('frames/index.html', '/frames/')):
+            with open(os.path.join(self.tmp_dir, 'htdocs', filename), 'rb') as f:
+                self.assertEqual(SITE[path][1], f.read())
+        # duplicate content is stored once
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir, 'htdocs', 'img', 'copy.png')))
+        self.assertEqual(['/img/logo.png'], htdocs.xpath('//node[@name="/img/copy.png"]/alias/text()'))
+        self.assertEqual(['/frames/index.html'], htdocs.xpath('//node[@name="/frames/"]/alias/text()'))
+        self.assertEqual(['302'], htdocs.xpath('//node[@name="/"]/status/text()'))
+        self.assertEqual(['/index.html'], htdocs.xpath('//node[@name="/"]/headers/entity[@name="Location"]/text()'))
+        self.assertEqual(['image/png'],
+                         htdocs.xpath('//node[@name="/img/logo.png"]/headers/entity[@name="Content-Type"]/text()'))
+        self.assertFalse(htdocs.xpath('//node[@name="/missing.html"]'))
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir, 'htdocs.xml')))
+
+    def test_concurrent_workers(self):
+        """
+        Objective: Test that the workers fetch the frontier concurrently
+        """
+        self.delay = 0.2
+        start = time.time()
+        Crawler(self.target, self.tmp_dir, workers=8).work()
+        # four breadth-first levels: /, index.html, its links and the links found in those
+        self.assertLess(time.time() - start, 4 * self.delay + 0.5)
+        self.assertEqual(9, len(self.requests))
+
+    def test_file_and_directory(self):
+        """
+        Objective: Test that a path served both as a file and as a directory is stored without stopping the crawl
+        """
+        self.site = {
+            '/index.html': ('text/html', '<html><body><a href="/a">a</a><a href="/b/c">c</a></body></html>'),
+            # stored before /a/b needs the directory
+            '/a': ('text/html', '<html><body><a href="/a/b">b</a></body></html>'),
+            '/a/b': ('text/plain', 'b'),
+            # stored after /b/c created the directory
+            '/b/c': ('text/html', '<html><body><a href="/b">b</a></body></html>'),
+            '/b': ('text/plain', 'the b'),
+        }
+        with gevent.Timeout(10):
+            htdocs = Crawler(self.target, self.tmp_dir, workers=1).work()
+        for filename, path in (('a/index.html', '/a'), ('a/b', '/a/b'), ('b/c', '/b/c'), ('b/index.html', '/b')):
+            with open(os.path.join(self.tmp_dir, 'htdocs', filename), 'rb') as f:
+                self.assertEqual(self.site[path][1], f.read())
+        self.assertEqual(['/a/index.html'], htdocs.xpath('//node[@name="/a"]/alias/text()'))
+        self.assertEqual(['/b/index.html'], htdocs.xpath('//node[@name="/b"]/alias/text()'))
+        self.assertEqual(['text/html'],
+                         htdocs.xpath('//node[@name="/a/index.html"]/headers/entity[@name="Content-Type"]/text()'))
+        # no temporary file is left behind
+        self.assertEqual(['a', 'b', 'index.html'], sorted(os.listdir(os.path.join(self.tmp_dir, 'htdocs'))))
@@ -17,15 +17,28 @@
 
 
 from conpot.protocols.ipmi.ipmi_server import IpmiServer
+from conpot.tests.helpers.ipmi_client import IPMIClient
 import conpot.core as conpot_core
 
 import unittest
+import struct
 from collections import namedtuple
 
 import gevent.monkey
 
 gevent.monkey.patch_all()
 
+from gevent import socket
+
+
+def open_session_request(client_session_id):
+    """ RMCP+ open session request offering HMAC-SHA1, HMAC-SHA1-96 and AES-CBC-128 """
+    payload = struct.pack('<BBxxI', 0, 4, client_session_id)
+    payload += '\x00\x00\x00\x08\x01\x00\x00\x00'
+    payload += '\x01\x00\x00\x08\x01\x00\x00\x00'
+    payload += '\x02\x00\x00\x08\x01\x00\x00\x00'
+    return '\x06\x00\xff\x07\x06\x10' + struct.pack('<IIH', 0, 0, len(payload)) + payload
+
 
 class TestIPMI(unittest.TestCase):
     def setUp(self):
@@ -44,8 +57,10 @@ class TestIPMI(unittest.TestCase):
             args
         )
         self.greenlet = gevent.spawn(self.ipmi_server.start, '127.0.0.1', 0)
+        gevent.sleep(0.5)
 
     def tearDown(self):
+        self.ipmi_server.stop()
         self.greenlet.kill()
         # tidy up (again)...
         conpot_core.get_sessionManager().purge_sessions()
@@ -55,3 +70,76 @@ class TestIPMI(unittest.TestCase):
         Objective: Test the IPMI server
         """
         self.assertTrue(self.ipmi_server != None)
+
+    def open_session(self, sock, client_session_id):
+        sock.sendto(open_session_request(client_session_id), ('127.0.0.1', self.ipmi_server.server.server_port))
+        data, _ = sock.recvfrom(1024)
+        # payload starts at offset 16: tag, status, privilege, reserved, client session id, managed session id
+        self.assertEqual(data[17], '\x00')
+        return struct.unpack('<II', data[20:28])
+
+    def test_session_isolation(self):
+        """
+        Objective: Test that concurrent handshakes from different peers get separate session state
+        """
+        sockets = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for _ in range(2)]
+        for s in sockets:
+            s.settimeout(5)
+        first_client, first_managed = self.open_session(sockets[0], 0x1111)
+        second_client, second_managed = self.open_session(sockets[1], 0x2222)
+        self.assertEqual((first_client, second_client), (0x1111, 0x2222))
+        self.assertNotEqual(first_managed, second_managed)
+        first = self.ipmi_server.sessions[('127.0.0.1', sockets[0].getsockname()[1], first_managed)]
+        second = self.ipmi_server.sessions[('127.0.0.1', sockets[1].getsockname()[1], second_managed)]
+        self.assertEqual(first.clientsessionid, 0x1111)
+        self.assertEqual(second.clientsessionid, 0x2222)
+        for s in sockets:
+            s.close()
+
+    def test_session_table_bounds(self):
+        """
+        Objective: Test that the session table is bounded in size and drops idle sessions
+        """
+        self.ipmi_server.max_sessions = 2
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.settimeout(5)
+        managed_ids = [self.open_session(sock, client_id)[1] for client_id in (1, 2, 3)]
+        port = sock.getsockname()[1]
+        self.assertEqual(self.ipmi_server.sessions.keys(),
+                         [('127.0.0.1', port, managed_id) for managed_id in managed_ids[1:]])
+        self.ipmi_server.session_timeout = 0
+        self.open_session(sock, 4)
+        self.assertEqual(len(self.ipmi_server.sessions), 1)
+        sock.close()
+
+    def test_handshake(self):
+        """
+        Objective: Test RMCP+ session establishment and measure the handshake rate
+        """
+        client = IPMIClient('127.0.0.1', self.ipmi_server.server.server_port)
+        managed_session_id = client.handshake()
+        session = self.ipmi_server.sessions[('127.0.0.1', client.sock.getsockname()[1], managed_session_id)]
+        self.assertEqual(session.sessionid, session.clientsessionid)
+        self.assertTrue(session.integrity)
+        self.assertGreater(client.benchmark(100), 0)
+        client.close()
+
+    def test_truncated_payloads(self):
+        """
+        Objective: Test that truncated payloads are dropped before decoding and the server keeps responding
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.settimeout(5)
+        address = ('127.0.0.1', self.ipmi_server.server.server_port)
+        _, managed_id = self.open_session(sock, 0x1111)
+        rakp1 = struct.pack('<BxxxI', 0, managed_id)
+        for packet in ('\x06\x00\xff\x07\x06\x10' + struct.pack('<IIH', 0, 0, 32) + '\x00' * 4,
+                       '\x06\x00\xff\x07\x06\x10' + struct.pack('<IIH', 0, 0, 4) + '\x00' * 4,
+                       '\x06\x00\xff\x07\x06\x00' + struct.pack('<IIH', 0, 0, 2) + '\x00' * 2,
+                       '\x06\x00\xff\x07\x06\x12' + struct.pack('<IIH', 0, 0, len(rakp1)) + rakp1):
+            sock.sendto(packet, address)
+        self.open_session(sock, 0x2222)
+        self.assertEqual(self.ipmi_server.server.stats['handler_errors'], 0)
+        # the truncated rakp1 closed the session it was sent for
+        self.assertNotIn(('127.0.0.1', sock.getsockname()[1], managed_id), self.ipmi_server.sessions)
+        sock.close()
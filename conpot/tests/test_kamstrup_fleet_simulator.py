@@ -0,0 +1,99 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import logging
+import time
+import unittest
+
+import gevent
+
+import conpot.core as conpot_core
+from conpot.protocols.kamstrup import fleet_simulator
+from conpot.protocols.kamstrup.fleet_simulator import FleetSimulator
+from conpot.protocols.kamstrup.meter_protocol.command_responder import CommandResponder
+from conpot.protocols.kamstrup.meter_protocol.messages import KamstrupRequestGetRegisters
+
+logger = logging.getLogger(__name__)
+
+
+class TestFleetSimulator(unittest.TestCase):
+    def setUp(self):
+        conpot_core.get_sessionManager().purge_sessions()
+        self.databus = conpot_core.get_databus()
+        self.databus.initialize('conpot/templates/kamstrup_382/template.xml')
+
+    def tearDown(self):
+        self.databus.reset()
+
+    def test_databus_registers(self):
+        """
+        Objective: Test that the fleet replaces the single meter registers on the databus and keeps counting
+        """
+        fleet = FleetSimulator(10, seed=1, interval=0.01)
+        gevent.sleep(0.05)
+        energy_in = self.databus.get_value('register_13')
+        self.assertEqual(energy_in, int(fleet.energy_in[0]))
+        self.assertEqual(self.databus.get_value('register_1'), energy_in / 1000)
+        self.assertTrue(200 < self.databus.get_value('register_1054') < 260)
+        fleet.bind(self.databus, 9, 'meter_9_register_{0}')
+        self.assertEqual(self.databus.get_value('meter_9_register_1080'), fleet.values[9, fleet_simulator.COLUMNS[1080]])
+        # the energy register counts whole Wh, how long that takes depends on the load of the hour
+        with gevent.Timeout(10):
+            while self.databus.get_value('register_13') == energy_in:
+                gevent.sleep(0.01)
+        fleet.stop()
+        self.assertGreater(self.databus.get_value('register_13'), energy_in)
+
+    def test_meter_server(self):
+        """
+        Objective: Test that the meter server answers for every meter of the template fleet on its own address
+        """
+        # the fleet of the template publishes its meters once the databus is initialized
+        gevent.sleep(0)
+        fleet = self.databus.get_value('power_simulator')
+        self.assertEqual(32, fleet.meters)
+        responder = CommandResponder('conpot/templates/kamstrup_382/kamstrup_meter/kamstrup_meter.xml')
+        # voltage of phase 1 and the serial number
+        register_bytes = bytearray([2, 0x04, 0x1e, 0x03, 0xe9])
+        for index in (0, 5, 31):
+            response = responder.respond(KamstrupRequestGetRegisters(63 + index, 0x10, register_bytes))
+            self.assertEqual(63 + index, response.communication_address)
+            voltage, serial = response.registers
+            self.assertEqual(fleet.values[index, fleet_simulator.COLUMNS[1054]],
+                             self.databus.get_value(voltage.databus_key))
+            # every meter has its own serial number
+            self.assertEqual(15085488 + index, self.databus.get_value(serial.databus_key))
+            self.assertEqual(63 + index, response.serialize()[1])
+        self.assertIsNone(responder.respond(KamstrupRequestGetRegisters(63 + 32, 0x10, register_bytes)))
+
+    def test_load_curve(self):
+        """
+        Objective: Test that the fleet follows the daily load curve and measure the cost of a step
+        """
+        fleet = FleetSimulator(10000, seed=1, published=1)
+        # stepped by hand below
+        gevent.sleep(0)
+        fleet.stop()
+        fleet.populate(71832712, 0, (228, 229, 224), (511, 422, 144), (1000, 5499, 895), hour=3)
+        night = fleet.power.sum()
+        fleet.step(1, hour=19)
+        self.assertGreater(fleet.power.sum(), 2 * night)
+        self.assertTrue((fleet.values[:, fleet_simulator.COLUMNS[1080]] >= 0).all())
+        start = time.time()
+        for _ in range(100):
+            fleet.step(1)
+        logger.info('Fleet simulator: %.1f us per meter and step', (time.time() - start) / 100 / fleet.meters * 1e6)
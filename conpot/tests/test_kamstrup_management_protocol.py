@@ -0,0 +1,131 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import gevent.monkey
+gevent.monkey.patch_all()
+
+import logging
+import time
+import unittest
+
+import gevent
+from gevent import socket
+
+import conpot.core as conpot_core
+from conpot.core.response_scheduler import ResponseDelay
+from conpot.protocols.kamstrup.management_protocol.command_responder import CommandResponder
+from conpot.protocols.kamstrup.management_protocol.kamstrup_management_server import KamstrupManagementServer
+
+logger = logging.getLogger(__name__)
+
+
+def load_sessions(filename='conpot/tests/data/kamstrup_management_sessions.txt'):
+    """ :return: List of sessions, each a list of command lines. """
+    sessions = []
+    for line in open(filename):
+        line = line.rstrip('\n')
+        if line.startswith('# session'):
+            sessions.append([])
+        elif not line.startswith('#'):
+            sessions[-1].append(line)
+    return sessions
+
+
+class TestKamstrupManagement(unittest.TestCase):
+    def setUp(self):
+        conpot_core.get_sessionManager().purge_sessions()
+        self.databus = conpot_core.get_databus()
+        self.databus.initialize('conpot/templates/kamstrup_382/template.xml')
+        self.server = KamstrupManagementServer(
+            'conpot/templates/kamstrup_382/kamstrup_management/kamstrup_management.xml', None, None)
+        self.server.start('127.0.0.1', 0)
+        self.responder = CommandResponder()
+
+    def tearDown(self):
+        self.server.stop()
+        self.databus.reset()
+        conpot_core.get_sessionManager().purge_sessions()
+
+    def connect(self):
+        sock = socket.create_connection(('127.0.0.1', self.server.server.server_port))
+        sock.settimeout(5)
+        banner = sock.recv(1024)
+        self.assertTrue(banner.startswith('\r\nWelcome...'))
+        return sock
+
+    def receive(self, sock, length):
+        data = ''
+        while len(data) < length:
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def test_pasted_commands(self):
+        """
+        Objective: Test that several commands sent at once are answered in order after a single delay
+        """
+        expected = ''.join(self.responder.respond(command) for command in ('H', '!XX', 'H !GC', 'H'))
+        sock = self.connect()
+        start = time.time()
+        sock.send('H\r\n!XX\r\nH !GC\r\n\r\nH\r\n')
+        self.assertEqual(self.receive(sock, len(expected)), expected)
+        self.assertLess(time.time() - start, 0.5)
+        sock.close()
+
+    def test_byte_at_a_time(self):
+        """
+        Objective: Test a character mode telnet client sending one byte per segment
+        """
+        expected = self.responder.respond('x') + self.responder.respond('h')
+        sock = self.connect()
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        for c in 'x\r\x00h\r':
+            sock.send(c)
+            gevent.sleep(0.001)
+        self.assertEqual(self.receive(sock, len(expected)), expected)
+        sock.close()
+
+    def test_line_length_limit(self):
+        """
+        Objective: Test that a client never sending a line ending is disconnected
+        """
+        sock = self.connect()
+        sock.send('H' * (self.server.max_line_length + 1))
+        self.assertEqual(sock.recv(1024), '')
+        sock.close()
+
+    def test_session_replay(self):
+        """
+        Objective: Replay captured management sessions and measure the command throughput
+        """
+        self.server.response_delay = ResponseDelay('constant', value=0)
+        sessions = load_sessions()
+        rounds = 20
+        commands = 0
+        start = time.time()
+        for _ in range(rounds):
+            for session in sessions:
+                expected = ''.join(self.responder.respond(command) or '' for command in session)
+                sock = self.connect()
+                sock.send(''.join(command + '\r\n' for command in session))
+                # every captured session ends by closing the connection
+                self.assertEqual(self.receive(sock, len(expected) + 1), expected)
+                sock.close()
+                commands += len(session)
+        logger.info('Kamstrup management replay: %.0f commands/s', commands / (time.time() - start))
@@ -15,12 +15,54 @@
 # Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
+import gevent.monkey
+gevent.monkey.patch_all()
+
+from gevent import socket
+
 import conpot.core as conpot_core
 from conpot.protocols.kamstrup.meter_protocol.command_responder import CommandResponder
+from conpot.protocols.kamstrup.meter_protocol.kamstrup_server import KamstrupServer
 from conpot.protocols.kamstrup.meter_protocol import request_parser
+from conpot.protocols.kamstrup.meter_protocol.messages import KamstrupResponseBase
 
+import crc16
+import logging
+import random
+import time
 import unittest
 
+logger = logging.getLogger(__name__)
+
+
+def build_request(registers, communication_address=0x3f, corrupt=False):
+    message = [communication_address, 0x10, len(registers)]
+    for register in registers:
+        message += [register >> 8, register & 0xff]
+    crc = crc16.crc16xmodem(str(bytearray(message)))
+    if corrupt:
+        crc ^= 0x0101
+    message = [0x80] + message + [crc >> 8, crc & 0xff, 0x0d]
+    return bytearray(KamstrupResponseBase.escape(message))
+
+
+def build_traffic(registers, count, seed=1):
+    """ Register requests as sent by a meter reader, mixed with line noise and corrupted requests. """
+    rng = random.Random(seed)
+    noise = [c for c in range(256) if c != 0x80]
+    traffic = bytearray()
+    expected = []
+    for _ in range(count):
+        if rng.random() < 0.2:
+            traffic.extend(rng.choice(noise) for _ in range(rng.randint(1, 16)))
+        request_registers = rng.sample(registers, rng.randint(1, 8))
+        if rng.random() < 0.1:
+            traffic += build_request(request_registers, corrupt=True)
+        else:
+            traffic += build_request(request_registers)
+            expected.append(request_registers)
+    return traffic, expected
+
 
 class TestKamstrup(unittest.TestCase):
     def setUp(self):
@@ -52,3 +94,79 @@ class TestKamstrup(unittest.TestCase):
         self.assertEqual(response.registers[0].name, 1033)
         # we should have no left overs
         self.assertEqual(len(self.request_parser.bytes), 0)
+
+    def test_response_value_cache(self):
+        """
+        Objective: Test that registers are shared between responses and that a changed databus value is encoded
+        """
+        parser = self.request_parser
+        parser.add_bytes(str(build_request([1033])) * 2)
+        first = self.command_responder.respond(parser.get_request())
+        self.assertIs(first.registers[0], self.command_responder.registers[1033])
+        self.databus.set_value(first.registers[0].databus_key, 0x0102)
+        self.assertEqual(first.serialize()[-5:-3], bytearray([0x01, 0x02]))
+        self.databus.set_value(first.registers[0].databus_key, 0x0304)
+        second = self.command_responder.respond(parser.get_request())
+        self.assertEqual(second.serialize()[-5:-3], bytearray([0x03, 0x04]))
+
+    def parse_traffic(self, traffic, chunk_sizes):
+        parsed = []
+        position = 0
+        for chunk_size in chunk_sizes:
+            if position >= len(traffic):
+                break
+            self.request_parser.add_bytes(str(traffic[position:position + chunk_size]))
+            position += chunk_size
+            while True:
+                request = self.request_parser.get_request()
+                if request is None:
+                    break
+                parsed.append(request.registers)
+        return parsed
+
+    def test_request_parser_fuzz(self):
+        """
+        Objective: Test that requests are recovered from noisy traffic split at arbitrary read boundaries
+        """
+        registers = list(self.command_responder.registers.keys()) + [0x0d, 0x1b, 0x1b0d, 0x0680, 0x4040]
+        traffic, expected = build_traffic(registers, 500)
+        rng = random.Random(2)
+        parsed = self.parse_traffic(traffic, (rng.randint(1, 64) for _ in xrange(len(traffic))))
+        self.assertEqual(parsed, expected)
+        self.assertEqual(len(self.request_parser.bytes), 0)
+
+    def test_request_parser_throughput(self):
+        """
+        Objective: Measure the request parser throughput on meter traffic read in 1024 byte chunks
+        """
+        traffic, expected = build_traffic(list(self.command_responder.registers.keys()), 20000)
+        start = time.time()
+        parsed = self.parse_traffic(traffic, [1024] * (len(traffic) / 1024 + 1))
+        elapsed = time.time() - start
+        self.assertEqual(len(parsed), len(expected))
+        logger.info('Kamstrup request parser: %.0f requests/s, %.2f MB/s',
+                    len(parsed) / elapsed, len(traffic) / elapsed / 1048576)
+
+    def test_pipelined_requests(self):
+        """
+        Objective: Test that pipelined requests are answered in order after a single response delay
+        """
+        server = KamstrupServer('conpot/templates/kamstrup_382/kamstrup_meter/kamstrup_meter.xml', None, None)
+        server.start('127.0.0.1', 0)
+        sock = socket.create_connection(('127.0.0.1', server.server.server_port))
+        sock.settimeout(5)
+        # register ids which are not escaped in the response
+        registers = [register for register in sorted(self.command_responder.registers.keys())
+                     if not set((register >> 8, register & 0xff)) & set((0x06, 0x0d, 0x1b, 0x40, 0x80))][:10]
+        start = time.time()
+        sock.sendall(''.join(str(build_request([register])) for register in registers))
+        responses = ''
+        while responses.count('\r') < len(registers):
+            responses += sock.recv(1024)
+        elapsed = time.time() - start
+        sock.close()
+        server.stop()
+        self.assertEqual([ord(response[3]) << 8 | ord(response[4]) for response in responses.split('\r')[:-1]],
+                         registers)
+        self.assertGreaterEqual(elapsed, 0.24)
+        self.assertLess(elapsed, 0.24 * len(registers))
@@ -0,0 +1,118 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+import gevent.monkey
+gevent.monkey.patch_all()
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import conpot.core as conpot_core
+from conpot.core.response_scheduler import ResponseDelay
+from conpot.protocols.kamstrup.meter_protocol.kamstrup_server import KamstrupServer
+from conpot.utils.kamstrup_prober import KamstrupRegisterProber, resume, write_dump
+
+
+class TestKamstrupProber(unittest.TestCase):
+    def setUp(self):
+        conpot_core.get_sessionManager().purge_sessions()
+        self.databus = conpot_core.get_databus()
+        self.databus.initialize('conpot/templates/kamstrup_382/template.xml')
+        self.server = KamstrupServer('conpot/templates/kamstrup_382/kamstrup_meter/kamstrup_meter.xml', None, None)
+        self.server.response_delay = ResponseDelay('constant', value=0.01)
+        self.server.start('127.0.0.1', 0)
+        self.port = self.server.server.server_port
+        # registers of every request received by the server
+        self.requests = []
+        respond = self.server.command_responder.respond
+
+        def counting_respond(request):
+            self.requests.append(request.registers)
+            return respond(request)
+        self.server.command_responder.respond = counting_respond
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+        self.databus.reset()
+        conpot_core.get_sessionManager().purge_sessions()
+        shutil.rmtree(self.tmp_dir)
+
+    def template_registers(self, registers):
+        return set(register for register in registers if register in self.server.command_responder.registers)
+
+    def test_batching(self):
+        """
+        Objective: Test that the prober asks for batch_size registers per request and finds every register
+        """
+        registers = range(1, 61)
+        prober = KamstrupRegisterProber('127.0.0.1', self.port, 0x3f, connections=2, batch_size=8)
+        with gevent.Timeout(10):
+            prober.probe(registers)
+        self.assertEqual(self.template_registers(registers), set(prober.found))
+        self.assertEqual(60, prober.scanned)
+        self.assertEqual(set(), prober.pending)
+        self.assertEqual(8, len(self.requests))
+        self.assertEqual(registers, sorted(register for request in self.requests for register in request))
+
+    def test_give_up(self):
+        """
+        Objective: Test that a register the device never answers is retried on its own and finally given up
+        """
+        respond = self.server.command_responder.respond
+
+        def unanswered(request):
+            if 13 in request.registers:
+                self.requests.append(request.registers)
+                return None
+            return respond(request)
+        self.server.command_responder.respond = unanswered
+        registers = range(1, 17)
+        prober = KamstrupRegisterProber('127.0.0.1', self.port, 0x3f, connections=1, batch_size=8, timeout=0.2,
+                                        max_timeout=1, attempts=2)
+        with gevent.Timeout(20):
+            prober.probe(registers)
+        self.assertEqual(self.template_registers(registers) - set([13]), set(prober.found))
+        self.assertEqual(set(), prober.pending)
+        # the batch with register 13, then register 13 on its own for every attempt
+        self.assertEqual(3, sum(1 for request in self.requests if 13 in request))
+
+    def test_resume(self):
+        """
+        Objective: Test that a scan resumed from its checkpoint probes only the remaining registers
+        """
+        dumpfile = os.path.join(self.tmp_dir, 'dump.json')
+        prober = KamstrupRegisterProber('127.0.0.1', self.port, 0x3f)
+        with gevent.Timeout(10):
+            prober.probe(range(1, 31))
+        # interrupted before the second half was answered
+        prober.pending.update(range(31, 61))
+        write_dump(dumpfile, prober)
+        del self.requests[:]
+
+        prober = KamstrupRegisterProber('127.0.0.1', self.port, 0x3f)
+        remaining = resume(prober, dumpfile)
+        self.assertEqual(range(31, 61), remaining)
+        with gevent.Timeout(10):
+            prober.probe(remaining, lambda p: write_dump(dumpfile, p))
+        self.assertEqual(self.template_registers(range(1, 61)), set(prober.found))
+        self.assertEqual(range(31, 61), sorted(register for request in self.requests for register in request))
+        # the final checkpoint has nothing left to probe
+        self.assertEqual([], resume(KamstrupRegisterProber('127.0.0.1', self.port, 0x3f), dumpfile))
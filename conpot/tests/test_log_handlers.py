@@ -0,0 +1,109 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import logging
+import unittest
+from StringIO import StringIO
+
+import gevent
+
+from conpot.core.log_handlers import QueueHandler, RateLimiter
+
+
+class CountingStream(StringIO):
+    def __init__(self):
+        StringIO.__init__(self)
+        self.writes = 0
+
+    def write(self, data):
+        self.writes += 1
+        StringIO.write(self, data)
+
+
+class Formatted(object):
+    count = 0
+
+    def __str__(self):
+        Formatted.count += 1
+        return 'formatted'
+
+
+class TestLogHandlers(unittest.TestCase):
+    def setUp(self):
+        self.stream = CountingStream()
+        self.target = logging.StreamHandler(self.stream)
+        self.target.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+        self.logger = logging.getLogger('conpot.tests.log_handlers')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+
+    def tearDown(self):
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+            handler.close()
+
+    def handler(self, **kwargs):
+        handler = QueueHandler([self.target], **kwargs)
+        self.logger.addHandler(handler)
+        return handler
+
+    def lines(self):
+        return self.stream.getvalue().splitlines()
+
+    def test_rate_limit(self):
+        """
+        Objective: Test that repeated messages of a source are summarized while other messages pass
+        """
+        rate_limiter = RateLimiter(burst=2, interval=10)
+        handler = self.handler(rate_limiter=rate_limiter)
+        Formatted.count = 0
+        for n in range(5):
+            self.logger.info('Traffic from %s: %s', '10.0.0.1', Formatted(), extra={'source': '10.0.0.1'})
+            self.logger.warning('Warning %s', 1, extra={'source': '10.0.0.1'})
+            # without a source the record is kept, its arguments may be all there is to know about the peer
+            self.logger.info('New connection from %s', '10.0.1.{0}'.format(n))
+        self.logger.info('Traffic from %s: %s', '10.0.0.2', Formatted(), extra={'source': '10.0.0.2'})
+        handler.flush()
+        self.assertEqual(['INFO New connection from 10.0.1.{0}'.format(n) for n in range(5)] +
+                         ['INFO Traffic from 10.0.0.1: formatted'] * 2 + ['INFO Traffic from 10.0.0.2: formatted'] +
+                         ['WARNING Warning 1'] * 5, sorted(self.lines()))
+        # the suppressed records were never formatted
+        self.assertEqual(3, Formatted.count)
+        rate_limiter.started -= 10
+        handler.flush()
+        self.assertEqual('INFO Suppressed 3 messages like "Traffic from %s: %s" from 10.0.0.1 in the last 10 seconds',
+                         self.lines()[-1])
+
+    def test_batched_writes(self):
+        """
+        Objective: Test that records are written in batches by the writer greenlet and dropped when too many wait
+        """
+        self.handler(batch_size=100, flush_interval=10, max_pending=1000)
+        for n in range(250):
+            self.logger.info('Record %d', n)
+        # nothing is written before the greenlet runs
+        self.assertEqual(0, self.stream.writes)
+        gevent.sleep(0)
+        self.assertEqual(1, self.stream.writes)
+        self.assertEqual(['INFO Record {0}'.format(n) for n in range(250)], self.lines())
+        for n in range(1500):
+            self.logger.info('Record %d', n)
+        gevent.sleep(0)
+        self.assertEqual(2, self.stream.writes)
+        self.assertEqual(1251, len(self.lines()))
+        self.assertEqual('WARNING Dropped 500 log records, the log could not be written fast enough',
+                         self.lines()[-1])
@@ -0,0 +1,56 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+import ConfigParser
+import os
+import unittest
+import tempfile
+import shutil
+
+import conpot.core as conpot_core
+from conpot.core.loggers.archive_log import ArchiveReader
+from conpot.core.loggers.log_worker import LogWorker
+from conpot.tests.test_logger_archive import event
+
+
+class FailingLogger(object):
+    def log(self, event):
+        raise IOError('disk full')
+
+
+class TestLogWorker(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.archive_dir = os.path.join(self.tmp_dir, 'archive')
+        config = ConfigParser.ConfigParser()
+        config.read('conpot/conpot.cfg')
+        config.set('archive', 'enabled', 'True')
+        config.set('archive', 'directory', self.archive_dir)
+        self.log_worker = LogWorker(config, None, conpot_core.get_sessionManager(), None)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_failing_sink(self):
+        """
+        Objective: Test that the log worker passes an event to the remaining sinks when one of them fails
+        """
+        self.log_worker.sqlite_logger = FailingLogger()
+        self.log_worker._log(event('guardian_ast', None, None, command='I2\xff\xfe01'))
+        self.log_worker.archive_logger.close()
+        self.assertEqual(1, len(list(ArchiveReader(self.archive_dir).scan())))
@@ -0,0 +1,110 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import os
+import unittest
+import tempfile
+import shutil
+import uuid
+from datetime import datetime, timedelta
+
+from conpot.core.loggers.archive_log import ArchiveLogger, ArchiveReader, decode_row
+
+
+START = datetime(2015, 3, 1, 10, 59, 0)
+
+
+def event(protocol, request, response, remote=('10.1.2.3', 4321), **extra):
+    data = dict(extra, request=request, response=response)
+    return {'id': uuid.uuid4(), 'remote': remote, 'data_type': protocol, 'timestamp': START, 'public_ip': None,
+            'data': data}
+
+
+class TestArchiveLogger(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.archive_dir = os.path.join(self.tmp_dir, 'archive')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_round_trip(self):
+        """
+        Objective: Test that archived events are read back with binary payloads and decoded addresses
+        """
+        archive = ArchiveLogger(self.archive_dir)
+        modbus = event('modbus', '000100000006010300000001', '03020000', slave_id=1, function_code=3)
+        http = event('http', 'GET / HTTP/1.1', None, remote=('2001:db8::1', 80))
+        archive.log(modbus, START)
+        archive.log(http, START + timedelta(seconds=1))
+        archive.log(event('modbus', None, None, type='NEW_CONNECTION'), START + timedelta(seconds=2))
+        archive.close()
+        rows = [decode_row(row) for row in ArchiveReader(self.archive_dir).scan()]
+        self.assertEqual(3, len(rows))
+        http_row, modbus_row, connection_row = rows
+        self.assertEqual('\x00\x01\x00\x00\x00\x06\x01\x03\x00\x00\x00\x01', modbus_row['request'])
+        self.assertEqual('\x03\x02\x00\x00', modbus_row['response'])
+        self.assertEqual({'slave_id': 1, 'function_code': 3}, modbus_row['extra'])
+        self.assertEqual(modbus['id'], modbus_row['session'])
+        self.assertEqual('10.1.2.3', modbus_row['remote'])
+        self.assertEqual(4321, modbus_row['remote_port'])
+        self.assertEqual(START, modbus_row['timestamp'])
+        self.assertEqual('GET / HTTP/1.1', http_row['request'])
+        self.assertEqual('', http_row['response'])
+        self.assertEqual('2001:db8::1', http_row['remote'])
+        self.assertEqual({'type': 'NEW_CONNECTION'}, connection_row['extra'])
+
+    def test_non_utf8_extra(self):
+        """
+        Objective: Test that event data holding bytes which are not valid UTF-8 is archived hex encoded
+        """
+        archive = ArchiveLogger(self.archive_dir)
+        archive.log(event('guardian_ast', None, None, command='I2\xff\xfe01'), START)
+        archive.close()
+        rows = [decode_row(row) for row in ArchiveReader(self.archive_dir).scan()]
+        self.assertEqual([{'command': '4932fffe3031'}], [row['extra'] for row in rows])
+
+    def test_rotation(self):
+        """
+        Objective: Test that events are partitioned by hour and written when the hour is over
+        """
+        archive = ArchiveLogger(self.archive_dir)
+        archive.log(event('s7comm', '0300', '0300'), START)
+        archive.log(event('s7comm', '0301', '0301'), START + timedelta(minutes=2))
+        first_hour = os.path.join(self.archive_dir, 's7comm', '2015-03-01', '10.cpa')
+        self.assertTrue(os.path.exists(first_hour))
+        self.assertFalse(os.path.exists(os.path.join(self.archive_dir, 's7comm', '2015-03-01', '11.cpa')))
+        archive.close()
+        reader = ArchiveReader(self.archive_dir)
+        self.assertEqual(2, len(reader.partitions('s7comm')))
+        rows = list(reader.scan(start=START + timedelta(minutes=1)))
+        self.assertEqual(['\x03\x01'], [row['request'] for row in rows])
+
+    def test_scan_columns(self):
+        """
+        Objective: Test that a scan over row groups of a time range returns only the requested columns
+        """
+        archive = ArchiveLogger(self.archive_dir, row_group_size=10, codec='bz2')
+        for n in range(100):
+            archive.log(event('modbus', '{0:04x}'.format(n), ''), START + timedelta(seconds=n / 2.0))
+        archive.close()
+        reader = ArchiveReader(self.archive_dir)
+        rows = list(reader.scan('modbus', START + timedelta(seconds=10), START + timedelta(seconds=20),
+                                columns=['request']))
+        self.assertEqual(['{0:04x}'.format(n).decode('hex') for n in range(20, 40)], [row['request'] for row in rows])
+        self.assertEqual(set(['request', 'protocol']), set(rows[0]))
+        self.assertFalse(list(reader.scan('s7comm')))
@@ -0,0 +1,144 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+import json
+import time
+import unittest
+import uuid
+from datetime import datetime
+
+import gevent
+from gevent.queue import Queue
+from gevent.server import DatagramServer, StreamServer
+
+from conpot.core.loggers.syslog import SysLogger
+
+
+def read_frames(data):
+    """ :return: The messages of octet counting framed syslog data. """
+    messages = []
+    while data:
+        length, data = data.split(' ', 1)
+        messages.append(data[:int(length)])
+        data = data[int(length):]
+    return messages
+
+
+class TestSysLogger(unittest.TestCase):
+    def setUp(self):
+        self.received = Queue()
+        self.event = {'id': uuid.UUID('d4d0a2e7-3a3d-4b39-a6cd-5c0d5e39ff2a'), 'remote': ('10.0.0.1', 5000),
+                      'data_type': 'modbus', 'public_ip': None, 'timestamp': datetime(2015, 1, 1),
+                      'data': {'request': '0001', 'response': 'with "quotes" and ]'}}
+
+    def handle_stream(self, sock, address):
+        data = ''
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+        self.received.put(data)
+
+    def test_tcp(self):
+        """
+        Objective: Test that events are sent as RFC 5424 messages with octet counting framing over TCP
+        """
+        server = StreamServer(('127.0.0.1', 0), self.handle_stream)
+        server.start()
+        syslog = SysLogger('127.0.0.1', server.server_port, 'local0', '/dev/log', 'tcp', sensorid='sensor-1')
+        try:
+            for n in range(3):
+                event = dict(self.event, data={'request': n})
+                syslog.log(event, datetime(2015, 1, 1, 12, 0, n))
+            syslog.close()
+            messages = read_frames(self.received.get(timeout=5))
+        finally:
+            server.stop()
+        self.assertEqual(3, len(messages))
+        header, message = messages[2].split('\xef\xbb\xbf', 1)
+        self.assertTrue(header.startswith('<134>1 2015-01-01T12:00:02Z '))
+        self.assertIn(' conpot ', header)
+        self.assertIn(' modbus [conpot@32473 session="d4d0a2e7-3a3d-4b39-a6cd-5c0d5e39ff2a" protocol="modbus" '
+                      'remote_ip="10.0.0.1" remote_port="5000" sensor="sensor-1"] ', header)
+        self.assertEqual({'request': 2}, json.loads(message))
+
+    def test_udp(self):
+        """
+        Objective: Test that every event is sent in its own datagram over UDP
+        """
+        server = DatagramServer(('127.0.0.1', 0), lambda data, address: self.received.put(data))
+        server.start()
+        syslog = SysLogger('127.0.0.1', server.server_port, 'local7', '/dev/log', 'udp')
+        try:
+            syslog.log(self.event)
+            syslog.log(self.event)
+            first = self.received.get(timeout=5)
+            self.received.get(timeout=5)
+        finally:
+            syslog.close()
+            server.stop()
+        header, message = first.split('\xef\xbb\xbf', 1)
+        self.assertTrue(header.startswith('<190>1 '))
+        self.assertNotIn('sensor=', header)
+        self.assertEqual(self.event['data'], json.loads(message))
+
+    def test_invalid_events(self):
+        """
+        Objective: Test that bytes which are not valid UTF-8 are sent hex encoded and events which cannot be formatted
+        are dropped without stopping the delivery of later events
+        """
+        class Unprintable(object):
+            def __repr__(self):
+                raise ValueError('unprintable')
+
+        server = DatagramServer(('127.0.0.1', 0), lambda data, address: self.received.put(data))
+        server.start()
+        syslog = SysLogger('127.0.0.1', server.server_port, 'local0', '/dev/log', 'udp')
+        try:
+            syslog.log(dict(self.event, data_type='guardian_ast', data={'command': 'I2\xff\xfe01'}))
+            syslog.log(dict(self.event, data={'value': Unprintable()}))
+            syslog.log(self.event)
+            messages = [self.received.get(timeout=5).split('\xef\xbb\xbf', 1)[1] for _ in range(2)]
+        finally:
+            syslog.close()
+            server.stop()
+        self.assertEqual([{'command': '4932fffe3031'}, self.event['data']], [json.loads(m) for m in messages])
+        self.assertEqual(1, syslog.invalid)
+
+    def test_bounded_buffer(self):
+        """
+        Objective: Test that logging does not block while the relay is unreachable and events over the limit are dropped
+        """
+        # nothing listens on the port of a closed server
+        server = StreamServer(('127.0.0.1', 0), self.handle_stream)
+        server.start()
+        port = server.server_port
+        server.stop()
+        syslog = SysLogger('127.0.0.1', port, 'local0', '/dev/log', 'tcp', max_buffer=100, retry_interval=10)
+        try:
+            started = time.time()
+            for _ in range(1000):
+                syslog.log(self.event)
+            gevent.sleep(0.1)
+            self.assertLess(time.time() - started, 1)
+            self.assertEqual(100, len(syslog.buffer))
+            # the failed batch was put back
+            self.assertEqual(0, syslog.in_flight)
+        finally:
+            syslog.close(timeout=0)
@@ -0,0 +1,121 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import gevent.monkey
+gevent.monkey.patch_all()
+
+import unittest
+from collections import namedtuple
+
+import gevent
+import requests
+
+import conpot.core as conpot_core
+from conpot.core.metrics import Histogram, Metrics, MetricsServer
+from conpot.protocols.s7comm.s7_server import S7Server
+from conpot.tests.helpers import s7comm_client
+
+
+def samples(text):
+    """ :return: Dict of the sample lines of a Prometheus text page. """
+    result = {}
+    for line in text.splitlines():
+        if not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            result[name] = float(value)
+    return result
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram(self):
+        """
+        Objective: Test that the latency histogram keeps the quantiles within its relative error
+        """
+        histogram = Histogram()
+        for value in range(1, 100001):
+            histogram.record(value)
+        self.assertEqual(100000, histogram.count())
+        for quantile in (0.5, 0.9, 0.99):
+            expected = quantile * 100000
+            self.assertLessEqual(abs(histogram.value_at_quantile(quantile) - expected), expected / 16)
+        self.assertEqual([10, 1023, 100000], histogram.cumulative_counts([11, 1024, 10 ** 7]))
+        # small values are exact, larger ones are capped
+        histogram = Histogram()
+        histogram.record(7)
+        histogram.record(10 ** 9)
+        self.assertEqual(7, histogram.value_at_quantile(0.5))
+        self.assertEqual(Histogram.MAX_VALUE, histogram.value_at_quantile(1))
+
+    def test_render(self):
+        """
+        Objective: Test that the metrics of this and other processes are rendered in the Prometheus text format
+        """
+        metrics = Metrics()
+        metrics.gauge('sessions', 'Sessions.', lambda: {'modbus': 2})
+        metrics.gauge('log_queue_length', 'Events.', lambda: 3)
+        metrics.count('requests', 'modbus')
+        metrics.count('bytes_received', 'modbus', 12)
+        metrics.observe('modbus', 0.002)
+        worker = Metrics()
+        worker.gauge('sessions', 'Sessions.', lambda: {'modbus': 1, 's7comm': 4})
+        worker.count('requests', 'modbus', 2)
+        worker.observe('modbus', 0.2)
+        metrics.update_remote(1234, worker.snapshot())
+        result = samples(metrics.render())
+        self.assertEqual(3, result['conpot_requests_total{protocol="modbus"}'])
+        self.assertEqual(12, result['conpot_bytes_received_total{protocol="modbus"}'])
+        self.assertEqual(3, result['conpot_sessions{protocol="modbus"}'])
+        self.assertEqual(4, result['conpot_sessions{protocol="s7comm"}'])
+        self.assertEqual(3, result['conpot_log_queue_length'])
+        self.assertEqual(2, result['conpot_request_duration_seconds_count{protocol="modbus"}'])
+        self.assertEqual(1, result['conpot_request_duration_seconds_bucket{protocol="modbus",le="0.0025"}'])
+        self.assertEqual(2, result['conpot_request_duration_seconds_bucket{protocol="modbus",le="0.25"}'])
+        self.assertAlmostEqual(0.202, result['conpot_request_duration_seconds_sum{protocol="modbus"}'])
+
+    def test_endpoint(self):
+        """
+        Objective: Test that the traffic of a protocol server is counted and served on /metrics
+        """
+        conpot_core.get_sessionManager().purge_sessions()
+        metrics = conpot_core.get_metrics()
+        metrics.reset()
+        databus = conpot_core.get_databus()
+        databus.initialize('conpot/templates/default/template.xml')
+        s7_instance = S7Server('conpot/templates/default/s7comm/s7comm.xml', 'none', namedtuple('FakeArgs', ''))
+        gevent.spawn(s7_instance.start, '127.0.0.1', 0)
+        metrics_server = MetricsServer(metrics)
+        gevent.spawn(metrics_server.start, '127.0.0.1', 0)
+        gevent.sleep(0.5)
+        try:
+            s7comm_client.GetIdentity('127.0.0.1', s7_instance.server.server_port, 0x100, 0x102)
+            response = requests.get('http://127.0.0.1:{0}/metrics'.format(metrics_server.server.server_port))
+            self.assertEqual(200, response.status_code)
+            result = samples(response.text)
+            self.assertEqual(1, result['conpot_connections_total{protocol="s7comm"}'])
+            requests_handled = result['conpot_requests_total{protocol="s7comm"}']
+            self.assertGreater(requests_handled, 2)
+            self.assertGreater(result['conpot_bytes_sent_total{protocol="s7comm"}'], 0)
+            # the connection request and PDU negotiation are not S7 requests
+            self.assertEqual(requests_handled - 2, result['conpot_request_duration_seconds_count{protocol="s7comm"}'])
+            self.assertEqual(404, requests.get('http://127.0.0.1:{0}/'.format(
+                metrics_server.server.server_port)).status_code)
+        finally:
+            metrics_server.stop()
+            s7_instance.stop()
+            databus.reset()
+            metrics.reset()
+            conpot_core.get_sessionManager().purge_sessions()
@@ -0,0 +1,149 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import gevent.monkey
+gevent.monkey.patch_all()
+
+import logging
+import os
+import sqlite3
+import subprocess
+import sys
+import unittest
+import tempfile
+import shutil
+from collections import namedtuple, Counter
+from datetime import timedelta
+
+import gevent
+
+import conpot.core as conpot_core
+from conpot.core.loggers.sqlite_log import SQLiteLogger, INDEXES
+from conpot.protocols.s7comm.s7_server import S7Server
+from conpot.tests.helpers import s7comm_client, event_db
+from conpot.utils.playback import ConpotPlayback
+
+
+class LocalSQLiteLogger(SQLiteLogger):
+    def _chown_db(self, path, uid_name='nobody', gid_name='nogroup'):
+        pass
+
+
+class TestPlayback(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, 'conpot.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_select(self):
+        """
+        Objective: Test that the filters select the matching events in timestamp order using the indexes
+        """
+        session_ids = event_db.fill(self.db_path, 2000, sessions=100)
+        cplay = ConpotPlayback(self.db_path)
+        rows = list(cplay.select(session=session_ids[3]))
+        self.assertEqual(20, len(rows))
+        self.assertEqual(set([session_ids[3]]), set(row[1] for row in rows))
+        self.assertEqual(sorted(rows, key=lambda row: (row[2], row[0])), rows)
+        rows = list(cplay.select(remote='10.0.0.4'))
+        self.assertEqual(set(["('10.0.0.4'"]), set(row[3].split(',')[0] for row in rows))
+        self.assertEqual(20, len(rows))
+        start, end = event_db.START + timedelta(minutes=5), event_db.START + timedelta(minutes=10)
+        rows = list(cplay.select(protocol='modbus', start=start, end=end))
+        self.assertTrue(rows)
+        self.assertTrue(all(row[4] == 'modbus' and '2015-01-01 00:05:00' <= row[2] < '2015-01-01 00:10:00'
+                            for row in rows))
+        for filters in ({'session': 'x'}, {'remote': '10.0.0.1'}, {'protocol': 'modbus', 'start': start, 'end': end},
+                        {}):
+            query, params = cplay.query(**filters)
+            plan = [row[-1] for row in cplay.conn.execute('EXPLAIN QUERY PLAN ' + query, params)]
+            self.assertFalse([step for step in plan if step.startswith('SCAN events') and 'INDEX' not in step], plan)
+
+    def test_missing_indexes(self):
+        """
+        Objective: Test that playback reads a database without indexes and only creates them when asked to
+        """
+        event_db.fill(self.db_path, 100, sessions=10)
+        conn = sqlite3.connect(self.db_path)
+        for name, _ in INDEXES:
+            conn.execute('DROP INDEX {0}'.format(name))
+        conn.commit()
+        conn.close()
+        warnings = []
+        handler = logging.Handler()
+        handler.emit = warnings.append
+        playback_logger = logging.getLogger('conpot.utils.playback')
+        playback_logger.addHandler(handler)
+        try:
+            cplay = ConpotPlayback(self.db_path)
+        finally:
+            playback_logger.removeHandler(handler)
+        self.assertEqual(1, len(warnings))
+        self.assertEqual(100, len(list(cplay.select())))
+        self.assertEqual([name for name, _ in INDEXES], cplay.missing_indexes())
+        cplay = ConpotPlayback(self.db_path, create_indexes=True)
+        self.assertEqual([], cplay.missing_indexes())
+
+    def test_decode(self):
+        """
+        Objective: Test that the decoding workers return the lines of every event in order
+        """
+        event_db.fill(self.db_path, 300, sessions=30, events_per_session=10)
+        cplay = ConpotPlayback(self.db_path, batch_size=7)
+        lines = list(cplay.decode(cplay.select()))
+        # the worker pool does not run in a monkey patched process
+        output = subprocess.check_output([sys.executable, 'bin/conpot_playback', '-d', self.db_path, '-n', '2'],
+                                         env=dict(os.environ, PYTHONPATH=os.getcwd()))
+        self.assertEqual(lines, output.splitlines())
+        # every event has a request and a response line
+        self.assertEqual(600, len(lines))
+        self.assertFalse([line for line in lines if 'undecodable' in line])
+        self.assertEqual(set(['modbus', 's7comm', 'snmp']), set(line[1:line.index(']')] for line in lines))
+
+    def test_replay(self):
+        """
+        Objective: Test that replaying a logged S7 session gets the logged responses from the honeypot
+        """
+        conpot_core.get_sessionManager().purge_sessions()
+        databus = conpot_core.get_databus()
+        databus.initialize('conpot/templates/default/template.xml')
+        s7_instance = S7Server('conpot/templates/default/s7comm/s7comm.xml', 'none', namedtuple('FakeArgs', ''))
+        gevent.spawn(s7_instance.start, '127.0.0.1', 0)
+        gevent.sleep(0.5)
+        try:
+            port = s7_instance.server.server_port
+            s7comm_client.GetIdentity('127.0.0.1', port, 0x100, 0x102)
+            sqlite_logger = LocalSQLiteLogger(self.db_path)
+            log_queue = conpot_core.get_sessionManager().log_queue
+            # the session is complete once the server logged the closed connection
+            with gevent.Timeout(5):
+                event = None
+                while not event or event['data'].get('type') != 'CONNECTION_LOST':
+                    event = log_queue.get()
+                    sqlite_logger.log(event)
+            cplay = ConpotPlayback(self.db_path)
+            session_id = Counter(row[1] for row in cplay.select()).most_common(1)[0][0]
+            results = cplay.replay(session_id, '127.0.0.1', port, speed=0)
+            self.assertGreater(len(results), 2)
+            for request, logged, replayed in results:
+                self.assertEqual(logged, replayed)
+        finally:
+            s7_instance.stop()
+            databus.reset()
+            conpot_core.get_sessionManager().purge_sessions()
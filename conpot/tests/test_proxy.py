@@ -18,8 +18,10 @@
 import gevent.monkey
 gevent.monkey.patch_all()
 
+import logging
 import unittest
 import os
+import time
 
 import gevent
 from gevent.server import StreamServer
@@ -28,9 +30,11 @@ from gevent.ssl import wrap_socket
 from conpot.helpers import fix_sslwrap
 
 import conpot
+import conpot.core as conpot_core
 from conpot.emulators.proxy import Proxy
 
 package_directory = os.path.dirname(os.path.abspath(conpot.__file__))
+logger = logging.getLogger(__name__)
 
 
 class TestProxy(unittest.TestCase):
@@ -77,3 +81,74 @@ class TestProxy(unittest.TestCase):
     def echo_server(self, sock, address):
         r = sock.recv(len(self.test_input))
         sock.send(r)
+
+    def stream_echo_server(self, sock, address):
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            sock.sendall(data)
+        sock.close()
+
+    def test_proxy_decoder(self):
+        """
+        Objective: Test that traffic is logged in aggregated events and decoded as reassembled messages
+        """
+        conpot_core.get_sessionManager().purge_sessions()
+        mock_service = StreamServer(('127.0.0.1', 0), self.stream_echo_server)
+        mock_service.start()
+        proxy = Proxy('decoder proxy', '127.0.0.1', mock_service.server_port,
+                      'conpot.protocols.kamstrup.meter_protocol.decoder_382.Decoder382')
+        proxy.flush_interval = 0.1
+        server = proxy.get_server('127.0.0.1', 0)
+        server.start()
+
+        # two register requests, the first one split over two segments
+        requests = '803f1001041e7abb0d'.decode('hex') + '803f10010434ff930d'.decode('hex')
+        s = socket()
+        s.connect(('127.0.0.1', server.server_port))
+        s.sendall(requests[:4])
+        gevent.sleep(0.01)
+        s.sendall(requests[4:])
+        received = ''
+        while len(received) < len(requests):
+            received += s.recv(1024)
+        self.assertEqual(received, requests)
+        gevent.sleep(0.2)
+
+        log_queue = conpot_core.get_sessionManager().log_queue
+        events = [log_queue.get()['data'] for _ in range(log_queue.qsize())]
+        self.assertIn({'raw_request': requests.encode('hex'), 'raw_response': ''}, events)
+        self.assertIn({'request': 'Request for 1 register(s): 1054 (Voltage p1) [0x3f]\n'
+                                  'Request for 1 register(s): 1076 (Current p1) [0x3f]',
+                       'raw_response': ''}, events)
+        s.close()
+        server.stop()
+        mock_service.stop()
+
+    def test_relay_throughput(self):
+        """
+        Objective: Measure the proxy throughput against a local echo service
+        """
+        mock_service = StreamServer(('127.0.0.1', 0), self.stream_echo_server)
+        mock_service.start()
+        proxy = Proxy('proxy', '127.0.0.1', mock_service.server_port)
+        server = proxy.get_server('127.0.0.1', 0)
+        server.start()
+
+        total = 16 * 1024 * 1024
+        chunk = os.urandom(65536)
+        s = socket()
+        s.connect(('127.0.0.1', server.server_port))
+        start = time.time()
+        sender = gevent.spawn(lambda: [s.sendall(chunk) for _ in xrange(total / len(chunk))])
+        received = 0
+        while received < total:
+            received += len(s.recv(65536))
+        elapsed = time.time() - start
+        sender.join()
+        self.assertEqual(received, total)
+        logger.info('Proxy relay throughput: %.1f MB/s', total / elapsed / 1048576)
+        s.close()
+        server.stop()
+        mock_service.stop()
@@ -23,7 +23,8 @@ import tempfile
 import shutil
 import os
 
-from conpot.protocols.snmp.build_pysnmp_mib_wrapper import mib2pysnmp, find_mibs, compile_mib
+from conpot.protocols.snmp import build_pysnmp_mib_wrapper
+from conpot.protocols.snmp.build_pysnmp_mib_wrapper import mib2pysnmp, find_mibs, compile_mib, INDEX_FILE
 from conpot.protocols.snmp import command_responder
 
 
@@ -86,3 +87,54 @@ class TestBase(unittest.TestCase):
         finally:
             shutil.rmtree(input_dir)
             shutil.rmtree(output_dir)
+
+
+    def test_find_cached(self):
+        """
+        Tests that unchanged mib files are neither read nor compiled again and that changed ones are recompiled.
+        """
+        input_dir = None
+        cache_dir = None
+        compiled = []
+
+        def fake_mib2pysnmp(mib_file):
+            with open(mib_file) as raw_mib:
+                compiled.append(raw_mib.read())
+            return '# compiled {0}\n'.format(len(compiled))
+
+        try:
+            input_dir = tempfile.mkdtemp()
+            cache_dir = tempfile.mkdtemp()
+            build_pysnmp_mib_wrapper.mib2pysnmp = fake_mib2pysnmp
+            mib_path = os.path.join(input_dir, 'VOGON-POEM-MIB.mib')
+            shutil.copy('conpot/tests/data/VOGON-POEM-MIB.mib', mib_path)
+            with open(mib_path) as raw_mib:
+                original = raw_mib.read()
+            mtime = 1420070400
+            os.utime(mib_path, (mtime, mtime))
+            find_mibs([input_dir], cache_dir=cache_dir)
+            compile_mib('VOGON-POEM-MIB', cache_dir)
+            self.assertIn(INDEX_FILE, os.listdir(cache_dir))
+            self.assertEqual(1, len(compiled))
+
+            # same size and mtime: the index is trusted, the file is not read again
+            with open(mib_path, 'w') as raw_mib:
+                raw_mib.write(original.replace('poem', 'POEM'))
+            os.utime(mib_path, (mtime, mtime))
+            available_mibs = find_mibs([input_dir], cache_dir=cache_dir)
+            self.assertIn('VOGON-POEM-MIB', available_mibs)
+            compile_mib('VOGON-POEM-MIB', cache_dir)
+            self.assertEqual(1, len(compiled))
+
+            # a changed mib is recompiled, even though its compiled module exists
+            os.utime(mib_path, (mtime + 10, mtime + 10))
+            find_mibs([input_dir], cache_dir=cache_dir)
+            compile_mib('VOGON-POEM-MIB', cache_dir)
+            self.assertEqual(2, len(compiled))
+            self.assertIn('POEM', compiled[1])
+            with open(os.path.join(cache_dir, 'VOGON-POEM-MIB.py')) as compiled_mib:
+                self.assertEqual('# compiled 2\n', compiled_mib.read())
+        finally:
+            build_pysnmp_mib_wrapper.mib2pysnmp = mib2pysnmp
+            shutil.rmtree(input_dir)
+            shutil.rmtree(cache_dir)
@@ -0,0 +1,79 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+import time
+import unittest
+
+import gevent
+from gevent import socket
+
+from conpot.core.response_scheduler import ResponseScheduler
+
+
+class TestResponseScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = ResponseScheduler(send_timeout=1)
+        self.sockets = []
+
+    def tearDown(self):
+        for sock in self.sockets:
+            sock.close()
+
+    def socketpair(self):
+        server_end, client_end = socket.socketpair()
+        self.sockets += [server_end, client_end]
+        return server_end, client_end
+
+    def test_order(self):
+        """
+        Objective: Test that responses are sent in scheduling order once they are due
+        """
+        server_end, client_end = self.socketpair()
+        connection = self.scheduler.open(server_end)
+        start = time.time()
+        connection.send('a', 0.1)
+        connection.send('b', 0)
+        connection.drain()
+        self.assertGreaterEqual(time.time() - start, 0.1)
+        self.assertEqual('ab', client_end.recv(2))
+
+    def test_stalled_peer(self):
+        """
+        Objective: Test that a peer which does not read stalls neither the other connections nor drain
+        """
+        stalled, _ = self.socketpair()
+        stalled.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        stalled_connection = self.scheduler.open(stalled)
+        stalled_connection.send('x' * 4 * 1024 * 1024, 0)
+        stalled_connection.send('y', 0)
+        gevent.sleep(0.01)
+
+        server_end, client_end = self.socketpair()
+        connection = self.scheduler.open(server_end)
+        start = time.time()
+        for _ in range(5):
+            connection.send('z', 0.01)
+        connection.drain()
+        self.assertLess(time.time() - start, 0.5)
+        self.assertEqual('zzzzz', client_end.recv(5))
+
+        start = time.time()
+        stalled_connection.drain(timeout=0.2)
+        self.assertLess(time.time() - start, 0.5)
+        self.assertTrue(stalled_connection.closed)
+        self.assertFalse(stalled_connection.send('y', 0))
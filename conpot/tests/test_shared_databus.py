@@ -0,0 +1,150 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import gevent.monkey
+gevent.monkey.patch_all()
+
+import json
+import os
+import unittest
+
+import gevent
+
+import conpot.core as conpot_core
+from conpot.core.shared_databus import SharedDatabus
+from conpot.protocols.modbus.modbus_block_databus_mediator import ModbusBlockDatabusMediator
+from conpot.tests.test_workers import wait_for
+
+
+class TestSharedDatabus(unittest.TestCase):
+    def setUp(self):
+        self.databus = SharedDatabus(size=64 * 1024, slots=64, poll_interval=0.01)
+
+    def tearDown(self):
+        self.databus.reset()
+
+    def fork(self, run):
+        pid = gevent.fork()
+        if pid == 0:
+            status = 1
+            try:
+                run()
+                status = 0
+            finally:
+                os._exit(status)
+        return pid
+
+    def test_values(self):
+        """
+        Objective: Test that the shared databus stores scalars and arrays and versions every write
+        """
+        self.databus.initialize('conpot/templates/default/template.xml')
+        self.assertEqual('Technodrome', self.databus.get_value('SystemName'))
+        # computed by an object of the process
+        self.assertTrue(isinstance(self.databus.get_value('Uptime'), int))
+        self.databus.set_value('registers', [0] * 10)
+        value, version = self.databus.get_versioned_value('registers')
+        self.assertEqual([0] * 10, value)
+        self.databus.set_value('registers', range(1000))
+        self.assertEqual(range(1000), self.databus.get_value('registers'))
+        self.assertFalse(self.databus.compare_and_set('registers', [], version))
+        value, version = self.databus.get_versioned_value('registers')
+        self.assertTrue(self.databus.compare_and_set('registers', [], version))
+        self.assertEqual(([], version + 2), self.databus.get_versioned_value('registers'))
+        self.assertEqual([], json.loads(self.databus.get_shapshot())['registers'])
+        self.assertRaises(ValueError, self.databus.set_value, 'x' * 65, 1)
+        self.assertRaises(MemoryError, self.databus.set_value, 'registers', range(100000))
+
+    def test_processes(self):
+        """
+        Objective: Test that the writes of one process are seen and observed by another
+        """
+        self.databus.set_value('parent', 0)
+        changes = []
+        self.databus.observe_value('child', lambda key: changes.append(self.databus.get_value(key)))
+
+        def child():
+            self.databus.observe_value('parent', lambda key: self.databus.set_value('child', 'ack'))
+            self.databus.set_value('child', 'started')
+            wait_for(lambda: self.databus.get_value('child') == 'ack')
+
+        pid = self.fork(child)
+        wait_for(lambda: changes == ['started'])
+        self.databus.set_value('parent', 1)
+        self.assertEqual(0, os.waitpid(pid, 0)[1])
+        wait_for(lambda: changes == ['started', 'ack'])
+
+    def test_write_before_watch(self):
+        """
+        Objective: Test that a write of another process made before the watcher polled the first time is observed
+        """
+        self.databus.set_value('value', 0)
+        changes = []
+        self.databus.observe_value('value', lambda key: changes.append(self.databus.get_value(key)))
+        pid = self.fork(lambda: self.databus.set_value('value', 1))
+        # waits without yielding to the watcher greenlet
+        self.assertEqual(0, gevent.monkey.get_original('os', 'waitpid')(pid, 0)[1])
+        wait_for(lambda: changes == [1])
+
+    def test_atomic_writes(self):
+        """
+        Objective: Test that concurrent read-modify-write cycles of several processes lose no update
+        """
+        self.databus.set_value('counter', 0)
+
+        def increment():
+            for _ in range(200):
+                while True:
+                    value, version = self.databus.get_versioned_value('counter')
+                    if self.databus.compare_and_set('counter', value + 1, version):
+                        break
+                gevent.sleep(0)
+
+        pids = [self.fork(increment) for _ in range(3)]
+        for pid in pids:
+            self.assertEqual(0, os.waitpid(pid, 0)[1])
+        self.assertEqual(600, self.databus.get_value('counter'))
+
+    def test_modbus_block(self):
+        """
+        Objective: Test that Modbus register writes are stored in the shared databus and seen by other processes
+        """
+        session_manager = conpot_core.get_sessionManager()
+        in_process_databus = session_manager._databus
+        session_manager._databus = self.databus
+        try:
+            self.databus.set_value('memoryModbusSlave1BlockA', [0, 0, 1])
+            block = ModbusBlockDatabusMediator('memoryModbusSlave1BlockA', 0)
+            block[0] = 4242
+            self.assertEqual([4242, 0, 1], self.databus.get_value('memoryModbusSlave1BlockA'))
+            block[1:3] = [7, 8]
+            self.assertEqual([4242, 7, 8], block[0:3])
+
+            def child():
+                for n in range(200):
+                    block[0] = n
+                    gevent.sleep(0)
+
+            # writes of other registers of the block by another process are not overwritten
+            pid = self.fork(child)
+            for n in range(200):
+                block[2] = n
+                gevent.sleep(0)
+            self.assertEqual(0, os.waitpid(pid, 0)[1])
+            self.assertEqual([199, 7, 199], self.databus.get_value('memoryModbusSlave1BlockA'))
+        finally:
+            session_manager._databus = in_process_databus
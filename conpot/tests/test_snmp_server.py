@@ -21,6 +21,7 @@ gevent.monkey.patch_all()
 import unittest
 import tempfile
 import shutil
+import os
 from collections import namedtuple
 
 import gevent
@@ -47,6 +48,7 @@ class TestBase(unittest.TestCase):
         self.port = self.snmp_server.get_port()
 
     def tearDown(self):
+        self.snmp_server.stop()
         shutil.rmtree(self.tmp_dir)
 
     def test_snmp_get(self):
@@ -69,6 +71,51 @@ class TestBase(unittest.TestCase):
         databus = conpot_core.get_databus()
         self.assertEqual('TESTVALUE', databus.get_value('sysLocation'))
 
+    def test_snmp_bulk(self):
+        """
+        Objective: Test if we can walk the system group via snmp_bulk
+        """
+        client = snmp_client.SNMPClient(self.host, self.port)
+        oid = ((1, 3, 6, 1, 2, 1, 1), None)
+        client.bulk_command(oid, max_repetitions=5, callback=self.bulk_callback)
+        self.assertEqual(5, len(self.result))
+        self.assertEqual((1, 3, 6, 1, 2, 1, 1, 1, 0), tuple(self.result[0][0]))
+        self.assertEqual("Siemens, SIMATIC, S7-200", self.result[0][1].prettyPrint())
+        # the response must be in lexicographic order
+        oids = [tuple(oid) for oid, _ in self.result]
+        self.assertEqual(sorted(oids), oids)
+
+    def test_mib_cache(self):
+        """
+        Objective: Test that compiled MIBs are only cached in a directory nobody else can write to
+        """
+        args = namedtuple('FakeArgs', 'mibpaths raw_mib mibcache')
+        args.mibpaths = [self.tmp_dir]
+        args.raw_mib = [self.tmp_dir]
+        args.mibcache = os.path.join(self.tmp_dir, 'cache')
+        server = SNMPServer('conpot/templates/default/snmp/snmp.xml', 'none', args)
+        self.assertEqual(args.mibcache, server.mib_cache)
+        self.assertEqual(0700, os.stat(args.mibcache).st_mode & 0777)
+        self.assertIn(args.mibcache, server.compiled_mibs)
+        os.chmod(args.mibcache, 0777)
+        server = SNMPServer('conpot/templates/default/snmp/snmp.xml', 'none', args)
+        self.assertNotIn(args.mibcache, server.compiled_mibs)
+        self.assertEqual(0700, os.stat(server.mib_cache).st_mode & 0777)
+        server.stop()
+        self.assertFalse(os.path.exists(server.mib_cache))
+        # without --mibcache nothing is kept between runs
+        self.assertNotEqual(self.snmp_server.mib_cache, server.mib_cache)
+        self.assertTrue(self.snmp_server.temporary_mib_cache)
+
+    def bulk_callback(self, sendRequestHandle, errorIndication, errorStatus, errorIndex, varBindTable, cbCtx):
+        self.result = None
+        if errorIndication:
+            self.result = errorIndication
+        elif errorStatus:
+            self.result = errorStatus.prettyPrint()
+        else:
+            self.result = [varBindRow[0] for varBindRow in varBindTable]
+
     def mock_callback(self, sendRequestHandle, errorIndication, errorStatus, errorIndex, varBindTable, cbCtx):
         self.result = None
         if errorIndication:
@@ -0,0 +1,92 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import gevent.monkey
+gevent.monkey.patch_all()
+
+import unittest
+import socket
+
+import gevent
+
+from conpot.core.udp_server import UDPServer
+
+
+class TestUDPServer(unittest.TestCase):
+    def setUp(self):
+        self.server = UDPServer(('127.0.0.1', 0), self.echo, workers=2)
+        self.server.start()
+        self.client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.client.settimeout(2)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def echo(self, data, address):
+        self.server.sendto(data.upper(), address)
+
+    def test_echo(self):
+        """
+        Objective: Test if datagrams are dispatched to the handler and replies are delivered.
+        """
+        for i in range(10):
+            self.client.sendto('ping {0}'.format(i), ('127.0.0.1', self.server.server_port))
+        replies = sorted(self.client.recvfrom(1024)[0] for _ in range(10))
+        self.assertEqual(sorted('PING {0}'.format(i) for i in range(10)), replies)
+        stats = self.server.get_stats()
+        self.assertEqual(10, stats['received'])
+        self.assertEqual(10, stats['sent'])
+        self.assertEqual(0, stats['dropped'])
+
+    def test_drop_when_queue_full(self):
+        """
+        Objective: Test if datagrams exceeding the queue bound are dropped and counted.
+        """
+        server = UDPServer(('127.0.0.1', 0), lambda data, address: gevent.sleep(1), workers=2, queue_size=4)
+        server.start()
+        try:
+            for i in range(20):
+                self.client.sendto('flood', ('127.0.0.1', server.server_port))
+            gevent.sleep(0.2)
+            stats = server.get_stats()
+            self.assertEqual(20, stats['received'])
+            # at most two datagrams are being processed by the workers and four are queued.
+            self.assertGreaterEqual(stats['dropped'], 14)
+            self.assertLessEqual(stats['queue_depth'], 4)
+        finally:
+            server.stop()
+
+    def test_drop_when_send_queue_full(self):
+        """
+        Objective: Test if replies exceeding the send queue bound are dropped and counted.
+        """
+        server = UDPServer(('127.0.0.1', 0), self.echo, workers=2, send_queue_size=4)
+        server.start()
+        self.client.bind(('127.0.0.1', 0))
+        try:
+            # the sender greenlet does not run before this loop yields
+            for i in range(10):
+                server.sendto('reply {0}'.format(i), self.client.getsockname())
+            stats = server.get_stats()
+            self.assertEqual(6, stats['send_dropped'])
+            self.assertEqual(4, stats['send_queue_depth'])
+            replies = [self.client.recvfrom(1024)[0] for _ in range(4)]
+            self.assertEqual(['reply {0}'.format(i) for i in range(4)], replies)
+            self.assertEqual(4, server.get_stats()['sent'])
+        finally:
+            server.stop()
@@ -0,0 +1,170 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import gevent.monkey
+gevent.monkey.patch_all()
+
+import os
+import time
+import unittest
+
+import gevent
+from gevent import socket
+from gevent.server import StreamServer
+
+import conpot.core as conpot_core
+from conpot.core import workers
+from conpot.core.session_manager import SessionManager
+from conpot.protocols.modbus.modbus_block_databus_mediator import ModbusBlockDatabusMediator
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError('Timed out')
+        gevent.sleep(0.05)
+
+
+class TestWorkers(unittest.TestCase):
+    def tearDown(self):
+        workers._reuse_port = False
+
+    def test_reuse_port(self):
+        """
+        Objective: Test that servers of several workers can listen on the same port
+        """
+        workers.enable_reuse_port()
+        first = StreamServer(workers.get_listener(('127.0.0.1', 0)), lambda sock, address: sock.sendall('1'))
+        first.start()
+        second = StreamServer(workers.get_listener(('127.0.0.1', first.server_port)),
+                              lambda sock, address: sock.sendall('2'))
+        second.start()
+        try:
+            answers = set()
+            for _ in range(50):
+                client = socket.create_connection(('127.0.0.1', first.server_port))
+                answers.add(client.recv(1))
+                client.close()
+            # the kernel balances new connections over both listeners
+            self.assertEqual(set(['1', '2']), answers)
+        finally:
+            first.stop()
+            second.stop()
+
+    def test_supervisor(self):
+        """
+        Objective: Test that the supervisor collects the events of its workers and keeps their databus consistent
+        """
+        session_manager = SessionManager()
+        databus = session_manager._databus
+
+        def run_worker(channel):
+            worker = workers.Worker(channel, session_manager)
+            worker.start()
+            session = session_manager.get_session('test', '10.0.0.1', os.getpid())
+            session.add_event({'request': 'ping'})
+            databus.set_value('worker_{0}'.format(os.getpid()), os.getpid())
+            wait_for(lambda: 'supervisor' in databus._data)
+            # the write of the other worker arrived before the one of the supervisor
+            databus.set_value('ack_{0}'.format(os.getpid()),
+                              sorted(value for key, value in databus._data.items() if key.startswith('worker_')))
+            worker.join()
+
+        supervisor = workers.Supervisor(2, run_worker, session_manager)
+        supervisor.fork()
+        greenlets = supervisor.start()
+        try:
+            pids = sorted(supervisor.sockets)
+            wait_for(lambda: all('worker_{0}'.format(pid) in databus._data for pid in pids))
+            databus.set_value('supervisor', 'ok')
+            wait_for(lambda: all('ack_{0}'.format(pid) in databus._data for pid in pids))
+            for pid in pids:
+                self.assertEqual(pids, databus.get_value('ack_{0}'.format(pid)))
+            self.assertEqual(2, session_manager.log_queue.qsize())
+            self.assertEqual(2, supervisor.session_counts['test'])
+        finally:
+            gevent.killall(greenlets)
+            supervisor.stop()
+            for pid in supervisor.sockets:
+                os.waitpid(pid, 0)
+
+    def test_concurrent_writes(self):
+        """
+        Objective: Test that concurrent writes of a key converge on all processes and are applied once by the writer
+        """
+        session_manager = SessionManager()
+        databus = session_manager._databus
+
+        def run_worker(channel):
+            worker = workers.Worker(channel, session_manager)
+            worker.start()
+            notified = []
+            own_key = 'once_{0}'.format(os.getpid())
+            databus.observe_value(own_key, lambda key: notified.append(key))
+            databus.set_value(own_key, 1)
+            for n in range(50):
+                databus.set_value('shared', [os.getpid(), n])
+                gevent.sleep(0)
+            databus.set_value('done_{0}'.format(os.getpid()), True)
+            # sent after every write of the other worker
+            wait_for(lambda: 'report' in databus._data)
+            databus.set_value('final_{0}'.format(os.getpid()), [databus.get_value('shared'), len(notified)])
+            worker.join()
+
+        supervisor = workers.Supervisor(2, run_worker, session_manager)
+        supervisor.fork()
+        greenlets = supervisor.start()
+        try:
+            pids = sorted(supervisor.sockets)
+            wait_for(lambda: all('done_{0}'.format(pid) in databus._data for pid in pids))
+            databus.set_value('report', True)
+            wait_for(lambda: all('final_{0}'.format(pid) in databus._data for pid in pids))
+            for pid in pids:
+                self.assertEqual([databus.get_value('shared'), 1], databus.get_value('final_{0}'.format(pid)))
+        finally:
+            gevent.killall(greenlets)
+            supervisor.stop()
+            for pid in supervisor.sockets:
+                os.waitpid(pid, 0)
+
+    def test_modbus_block(self):
+        """
+        Objective: Test that Modbus register writes in one worker are replicated to the other processes
+        """
+        session_manager = conpot_core.get_sessionManager()
+        databus = session_manager._databus
+        databus.set_value('memoryModbusSlave1BlockA', [0, 0, 1])
+
+        def run_worker(channel):
+            worker = workers.Worker(channel, session_manager)
+            worker.start()
+            ModbusBlockDatabusMediator('memoryModbusSlave1BlockA', 0)[0] = 4242
+            worker.join()
+
+        supervisor = workers.Supervisor(1, run_worker, session_manager)
+        supervisor.fork()
+        greenlets = supervisor.start()
+        try:
+            wait_for(lambda: databus.get_value('memoryModbusSlave1BlockA') == [4242, 0, 1])
+        finally:
+            gevent.killall(greenlets)
+            supervisor.stop()
+            for pid in supervisor.sockets:
+                os.waitpid(pid, 0)
+            databus.replicate = None
+            databus.reset()
@@ -0,0 +1,585 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# modbus_tk and the pysnmp dispatcher use the standard socket and select modules, gevent.monkey.patch_all()
+# must be called before this module is imported for the scanners to run concurrently.
+
+import logging
+import os
+import struct
+import time
+from collections import namedtuple, deque
+
+import gevent
+from gevent import socket
+from gevent.pool import Pool
+from gevent.queue import Queue, Empty
+from lxml import etree
+import modbus_tk.defines as cst
+import modbus_tk.modbus_tcp as modbus_tcp
+from modbus_tk.modbus import ModbusError, ModbusInvalidResponseError
+from pysnmp.entity.rfc3413.oneliner import cmdgen
+from pysnmp.proto import rfc1902
+from pysnmp.proto.rfc1905 import EndOfMibView, NoSuchObject, NoSuchInstance
+from pysnmp.smi import builder, view
+from pyasn1.type import univ
+
+
+logger = logging.getLogger(__name__)
+
+# read function code, template block type, default address range and maximum quantity per request
+ModbusTable = namedtuple('ModbusTable', 'function_code block_type addresses max_quantity')
+MODBUS_TABLES = (
+    ModbusTable(cst.READ_COILS, 'COILS', (0, 9999), 2000),
+    ModbusTable(cst.READ_DISCRETE_INPUTS, 'DISCRETE_INPUTS', (10000, 19999), 2000),
+    ModbusTable(cst.READ_INPUT_REGISTERS, 'ANALOG_INPUTS', (30000, 39999), 125),
+    ModbusTable(cst.READ_HOLDING_REGISTERS, 'HOLDING_REGISTERS', (40000, 49999), 125),
+)
+
+ModbusBlock = namedtuple('ModbusBlock', 'slave_id block_type starting_address values')
+
+# MIB modules used to name the walked OIDs, in addition to the modules found in the mib paths
+SNMP_MIBS = ('SNMPv2-MIB', 'IF-MIB', 'IP-MIB', 'TCP-MIB', 'UDP-MIB', 'HOST-RESOURCES-MIB')
+
+
+class NoResponse(Exception):
+    pass
+
+
+class RateLimiter(object):
+    """ Spaces the requests of all greenlets sharing the limiter to at most rate per second, 0 disables it. """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self._next = 0
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.time()
+        due = max(now, self._next)
+        self._next = due + self.interval
+        if due > now:
+            gevent.sleep(due - now)
+
+
+class ModbusScanner(object):
+    """
+    Finds the slaves of a Modbus TCP device and the register blocks of every slave.
+
+    Every table is probed with single reads every stride addresses. A hit is extended backwards to the first
+    address of the block and forwards with reads of max_quantity, both narrowed down by bisection, so a block
+    costs a few requests per max_quantity addresses. Blocks shorter than stride can fall between two probes.
+    Each worker owns one connection, all of them share the rate limit.
+    """
+
+    def __init__(self, host, port=502, slaves=range(1, 248), tables=MODBUS_TABLES, stride=8, workers=10,
+                 rate=100, timeout=1.0):
+        self.host = host
+        self.port = port
+        self.slaves = slaves
+        self.tables = tables
+        self.stride = stride
+        self.workers = workers
+        self.timeout = timeout
+        self.limiter = RateLimiter(rate)
+        self.response_times = []
+        self._masters = Queue()
+
+    def scan(self):
+        """ :return: List of ModbusBlock ordered by slave, table and address. """
+        pool = Pool(self.workers)
+        slaves = [slave_id for slave_id, found in zip(self.slaves, pool.map(self.probe_slave, self.slaves))
+                  if found]
+        logger.info('Modbus slaves found: %s', slaves)
+        jobs = [(slave_id, table) for slave_id in slaves for table in self.tables]
+        blocks = []
+        for table_blocks in pool.imap(lambda job: self.scan_table(*job), jobs):
+            blocks.extend(table_blocks)
+        self._close()
+        return blocks
+
+    def probe_slave(self, slave_id):
+        """ :return: True if the slave answers, with data or with an exception response. """
+        table = self.tables[0]
+        try:
+            self.read(slave_id, table.function_code, table.addresses[0], 1)
+        except NoResponse:
+            return False
+        return True
+
+    def scan_table(self, slave_id, table):
+        start, end = table.addresses
+        blocks = []
+        last_miss = start - 1
+        address = start
+        try:
+            while address <= end:
+                if self.read(slave_id, table.function_code, address, 1) is None:
+                    last_miss = address
+                    address += self.stride
+                    continue
+                first = self._find_start(slave_id, table, last_miss + 1, address)
+                values = self._read_block(slave_id, table, first)
+                logger.info('Modbus slave %s: %s block at %s (%s)', slave_id, table.block_type, first, len(values))
+                blocks.append(ModbusBlock(slave_id, table.block_type, first, values))
+                address = first + len(values)
+                last_miss = address - 1
+        except NoResponse:
+            logger.warning('Modbus slave %s stopped responding, %s scan incomplete', slave_id, table.block_type)
+        return blocks
+
+    def _find_start(self, slave_id, table, low, high):
+        # smallest address from which the block reaches up to high
+        while low < high:
+            middle = (low + high) // 2
+            if self.read(slave_id, table.function_code, middle, high - middle + 1) is None:
+                low = middle + 1
+            else:
+                high = middle
+        return high
+
+    def _read_block(self, slave_id, table, first):
+        values = []
+        address = first
+        end = table.addresses[1]
+        while address <= end:
+            quantity = min(table.max_quantity, end - address + 1)
+            chunk = self.read(slave_id, table.function_code, address, quantity)
+            if chunk is None:
+                chunk = self._read_longest(slave_id, table, address, quantity - 1)
+            values.extend(chunk)
+            if len(chunk) < quantity:
+                break
+            address += quantity
+        return values
+
+    def _read_longest(self, slave_id, table, address, quantity):
+        longest = []
+        low, high = 1, quantity
+        while low <= high:
+            middle = (low + high) // 2
+            chunk = self.read(slave_id, table.function_code, address, middle)
+            if chunk is None:
+                high = middle - 1
+            else:
+                longest = chunk
+                low = middle + 1
+        return longest
+
+    def read(self, slave_id, function_code, address, quantity):
+        """
+        :return: List of values, None if the slave answered with an exception.
+        Raises NoResponse if the slave did not answer or closed the connection.
+        """
+        try:
+            master = self._masters.get_nowait()
+        except Empty:
+            master = modbus_tcp.TcpMaster(host=self.host, port=self.port)
+            master.set_timeout(self.timeout)
+        self.limiter.wait()
+        start = time.time()
+        try:
+            values = master.execute(slave_id, function_code, address, quantity)
+            if values is None:
+                # modbus_tk does not wait for a response to broadcasts (slave 0)
+                raise NoResponse('broadcast')
+            values = list(values)
+        except ModbusError:
+            values = None
+        except (NoResponse, socket.error, ModbusInvalidResponseError), e:
+            # the connection is reopened by the next request
+            master.close()
+            self._masters.put(master)
+            raise NoResponse(e)
+        self.response_times.append(time.time() - start)
+        self._masters.put(master)
+        return values
+
+    def read_device_info(self, slave_id):
+        """
+        Reads the basic device identification (function 43/14), not supported by modbus_tk.
+        :return: Dictionary of object id and value, empty if the slave does not support it.
+        """
+        # transaction 1, protocol 0, length 5, unit, function 43, MEI type 14, read basic device id, object 0
+        request = struct.pack('>HHHBBBBB', 1, 0, 5, slave_id, 0x2B, 0x0E, 0x01, 0x00)
+        self.limiter.wait()
+        try:
+            sock = socket.create_connection((self.host, self.port), self.timeout)
+        except socket.error:
+            return {}
+        try:
+            sock.settimeout(self.timeout)
+            sock.sendall(request)
+            response = ''
+            while len(response) < 6 or len(response) < struct.unpack('>H', response[4:6])[0] + 6:
+                data = sock.recv(1024)
+                if not data:
+                    return {}
+                response += data
+        except socket.error:
+            return {}
+        finally:
+            sock.close()
+        pdu = response[7:]
+        if len(pdu) < 7 or ord(pdu[0]) != 0x2B:
+            return {}
+        objects = {}
+        offset = 7
+        for _ in range(ord(pdu[6])):
+            object_id, length = struct.unpack('>BB', pdu[offset:offset + 2])
+            objects[object_id] = pdu[offset + 2:offset + 2 + length]
+            offset += 2 + length
+        return objects
+
+    def _close(self):
+        while not self._masters.empty():
+            self._masters.get().close()
+
+
+def subtree(oid):
+    """ Scalar instances (ending with .0) are walked from their object so the instance itself is returned. """
+    oid = tuple(int(n) for n in oid.split('.')) if isinstance(oid, basestring) else tuple(oid)
+    return oid[:-1] if oid[-1] == 0 else oid
+
+
+class SNMPWalker(object):
+    """
+    Walks OID subtrees with GETBULK. Up to columns subtrees are walked side by side in one request and every
+    request returns up to max_repetitions rows of them. Subtrees leaving their root are dropped from the next
+    request and replaced by subtrees still waiting.
+    """
+
+    def __init__(self, host, port=161, auth_data=None, max_repetitions=10, columns=8, rate=10, timeout=1,
+                 retries=2):
+        self.auth_data = auth_data or cmdgen.CommunityData('public')
+        self.target = cmdgen.UdpTransportTarget((host, port), timeout=timeout, retries=retries)
+        self.max_repetitions = max_repetitions
+        self.columns = columns
+        self.limiter = RateLimiter(rate)
+        self.generator = cmdgen.AsynCommandGenerator()
+
+    def walk(self, oids):
+        """ :return: List of (OID tuple, value) sorted by OID. """
+        results = {}
+        pending = deque((root, root) for root in sorted(set(subtree(oid) for oid in oids)))
+        while pending:
+            batch = [pending.popleft() for _ in range(min(self.columns, len(pending)))]
+            table = self.bulk([last for _, last in batch])
+            if not table:
+                logger.warning('No SNMP response for %s', ', '.join(format_oid(root) for root, _ in batch))
+                continue
+            for column, (root, last) in enumerate(batch):
+                for row in table:
+                    oid, value = row[column]
+                    oid = tuple(oid)
+                    if isinstance(value, (EndOfMibView, NoSuchObject, NoSuchInstance)) or \
+                            oid[:len(root)] != root or oid <= last:
+                        break
+                    results[oid] = value
+                    last = oid
+                else:
+                    pending.append((root, last))
+        return sorted(results.items())
+
+    def bulk(self, oids):
+        """ :return: The rows of a single GETBULK response, empty on errors. """
+        response = {}
+
+        def callback(send_request_handle, error_indication, error_status, error_index, var_bind_table, cb_ctx):
+            if error_indication or error_status:
+                logger.debug('SNMP error: %s', error_indication or error_status.prettyPrint())
+            else:
+                # rows cut short by the agent are incomplete for the other columns
+                response['table'] = [row for row in var_bind_table if len(row) == len(oids)]
+            # the next request is built by walk()
+            return False
+
+        self.limiter.wait()
+        self.generator.bulkCmd(self.auth_data, self.target, 0, self.max_repetitions, oids, (callback, None))
+        self.generator.snmpEngine.transportDispatcher.runDispatcher()
+        return response.get('table', [])
+
+
+def format_oid(oid):
+    return '.'.join(str(n) for n in oid)
+
+
+def format_value(value):
+    """ :return: Python expression of an SNMP or Modbus value, as evaluated by the databus. """
+    if isinstance(value, (univ.Integer, int, long)):
+        return str(int(value))
+    if isinstance(value, list):
+        return '[{0}]'.format(', '.join(format_value(v) for v in value))
+    if isinstance(value, (rfc1902.IpAddress, univ.ObjectIdentifier)):
+        value = value.prettyPrint()
+    value = str(value)
+    if all(32 <= ord(c) < 127 for c in value) and '"' not in value and '\\' not in value:
+        return '"{0}"'.format(value)
+    return repr(value)
+
+
+class MibResolver(object):
+    """ Names OIDs after the MIB objects they are instances of. """
+
+    def __init__(self, mibpaths=()):
+        self.mib_builder = builder.MibBuilder()
+        sources = self.mib_builder.getMibSources() + tuple(builder.DirMibSource(path) for path in mibpaths)
+        self.mib_builder.setMibSources(*sources)
+        modules = list(SNMP_MIBS)
+        for path in mibpaths:
+            modules.extend(os.path.splitext(name)[0] for name in os.listdir(path) if name.endswith('.py'))
+        self.mib_builder.loadModules(*modules)
+        self.view = view.MibViewController(self.mib_builder)
+        self.mib_scalar, = self.mib_builder.importSymbols('SNMPv2-SMI', 'MibScalar')
+
+    def resolve(self, oid):
+        """ :return: Tuple of MIB name, symbol name and instance, None if no loaded MIB defines the object. """
+        mib_name, symbol_name, instance = self.view.getNodeLocation(oid)
+        node, = self.mib_builder.importSymbols(mib_name, symbol_name)
+        if not isinstance(node, self.mib_scalar) or not instance:
+            return None
+        return mib_name, symbol_name, tuple(instance)
+
+
+class ConpotCloner(object):
+
+    def __init__(self, host, modbus_port=502, snmp_port=161, snmp_auth=None, mibpaths=(), modbus_options=None,
+                 snmp_options=None):
+        self.host = host
+        self.mibpaths = mibpaths
+        self.modbus_scanner = ModbusScanner(host, modbus_port, **(modbus_options or {}))
+        self.snmp_walker = SNMPWalker(host, snmp_port, snmp_auth, **(snmp_options or {}))
+        self.modbus_slave_range = self.modbus_scanner.slaves
+        self.snmp_OIDs = {
+            # General
+            '1.3.6.1.2.1.1.5.0': "Hostname",
+            '1.3.6.1.2.1.1.1.0': "Description",
+            '1.3.6.1.2.1.1.4.0': "Contact",
+            '1.3.6.1.2.1.1.6.0': "Location",
+            '1.3.6.1.2.1.1.3.0': "Uptime system",
+            '1.3.6.1.2.1.25.1.1.0': "Uptime snmp",
+            '1.3.6.1.2.1.25.1.2.0': "System date",
+            # Windows related
+            '1.3.6.1.4.1.77.1.4.1.0': "Domain",
+            "1.3.6.1.4.1.77.1.2.25.1.1": "User accounts",
+            "1.3.6.1.4.1.77.1.2.25.1": "User accounts",
+            # Network
+            '1.3.6.1.2.1.4.1.0': "IP forwarding enabled",  # 1 is yes
+            '1.3.6.1.2.1.4.2.0': "Default TTL",
+            '1.3.6.1.2.1.6.10.0': "TCP segments received",
+            '1.3.6.1.2.1.6.11.0': "TCP segments sent",
+            '1.3.6.1.2.1.6.12.0': "TCP segments retrans",
+            '1.3.6.1.2.1.4.3.0': "Input datagrams",
+            '1.3.6.1.2.1.4.9.0': "Delivered datagrams",
+            '1.3.6.1.2.1.4.10.0': "Output datagrams",
+            "1.3.6.1.2.1.2.2.1.1": "If Id",
+            "1.3.6.1.2.1.2.2.1.2": "Interface",
+            "1.3.6.1.2.1.2.2.1.6": "Mac Address",
+            "1.3.6.1.2.1.2.2.1.3": "If Type",
+            "1.3.6.1.2.1.2.2.1.4": "MTU",
+            "1.3.6.1.2.1.2.2.1.5": "Speed Mbps",
+            "1.3.6.1.2.1.2.2.1.10": "In octets",
+            "1.3.6.1.2.1.2.2.1.16": "Out octets",
+            "1.3.6.1.2.1.2.2.1.7": "If Status",
+            "1.3.6.1.2.1.4.20.1.2": "Network Id",
+            "1.3.6.1.2.1.4.20.1.1": "IP Address",
+            "1.3.6.1.2.1.4.20.1.3": "Netmask",
+            "1.3.6.1.2.1.4.20.1.4": "Broadcast",
+            "1.3.6.1.2.1.4.21.1.1": "Routing Destination",
+            "1.3.6.1.2.1.4.21.1.7": "Routing Next hop",
+            "1.3.6.1.2.1.4.21.1.11": "Routing Mask",
+            "1.3.6.1.2.1.4.21.1.3": "Routing Metric",
+            "1.3.6.1.2.1.6.13.1.2": "Local address",
+            "1.3.6.1.2.1.6.13.1.3": "Local port",
+            "1.3.6.1.2.1.6.13.1.4": "Remote address",
+            "1.3.6.1.2.1.6.13.1.5": "Remote port",
+            "1.3.6.1.2.1.6.13.1.1": "Connection State",
+            "1.3.6.1.2.1.7.5.1.1": "Listen UDP local address",
+            "1.3.6.1.2.1.7.5.1.2": "Listen UDP local port",
+            # IIS server information
+            "1.3.6.1.4.1.77.1.2.3.1.1": "Network Service Index",
+            "1.3.6.1.4.1.77.1.2.3.1.2": "Network Service Name",
+            "1.3.6.1.4.1.77.1.2.27.1.1": "Share Name",
+            "1.3.6.1.4.1.77.1.2.27.1.2": "Share Path",
+            "1.3.6.1.4.1.77.1.2.27.1.3": "Share Comment",
+            '1.3.6.1.4.1.311.1.7.3.1.2.0': "TotalBytesSentLowWord",
+            '1.3.6.1.4.1.311.1.7.3.1.4.0': "TotalBytesReceivedLowWord",
+            '1.3.6.1.4.1.311.1.7.3.1.5.0': "TotalFilesSent",
+            '1.3.6.1.4.1.311.1.7.3.1.6.0': "CurrentAnonymousUsers",
+            '1.3.6.1.4.1.311.1.7.3.1.7.0': "CurrentNonAnonymousUsers",
+            '1.3.6.1.4.1.311.1.7.3.1.8.0': "TotalAnonymousUsers",
+            '1.3.6.1.4.1.311.1.7.3.1.9.0': "TotalNonAnonymousUsers",
+            '1.3.6.1.4.1.311.1.7.3.1.10.0': "MaxAnonymousUsers",
+            '1.3.6.1.4.1.311.1.7.3.1.11.0': "MaxNonAnonymousUsers",
+            '1.3.6.1.4.1.311.1.7.3.1.12.0': "CurrentConnections",
+            '1.3.6.1.4.1.311.1.7.3.1.13.0': "MaxConnections",
+            '1.3.6.1.4.1.311.1.7.3.1.14.0': "ConnectionAttempts",
+            '1.3.6.1.4.1.311.1.7.3.1.15.0': "LogonAttempts",
+            '1.3.6.1.4.1.311.1.7.3.1.16.0': "Gets",
+            '1.3.6.1.4.1.311.1.7.3.1.17.0': "Posts",
+            '1.3.6.1.4.1.311.1.7.3.1.18.0': "Heads",
+            '1.3.6.1.4.1.311.1.7.3.1.19.0': "Others",
+            '1.3.6.1.4.1.311.1.7.3.1.20.0': "CGIRequests",
+            '1.3.6.1.4.1.311.1.7.3.1.21.0': "BGIRequests",
+            '1.3.6.1.4.1.311.1.7.3.1.22.0': "NotFoundErrors"
+        }
+
+    def clone(self, output_directory, modbus=True, snmp=True):
+        """
+        Scans Modbus and walks SNMP concurrently and writes template.xml, modbus/modbus.xml and snmp/snmp.xml
+        to output_directory, laid out like the templates shipped with conpot.
+        """
+        modbus_job = gevent.spawn(self.clone_modbus) if modbus else None
+        snmp_job = gevent.spawn(self.clone_snmp) if snmp else None
+        gevent.joinall([job for job in (modbus_job, snmp_job) if job is not None], raise_error=True)
+
+        databus = []
+        protocols = []
+        device_info = {}
+        if modbus_job is not None:
+            modbus_xml, modbus_keys, device_info = modbus_job.value
+            if modbus_keys:
+                self._write(modbus_xml, output_directory, 'modbus', 'modbus.xml')
+                databus.extend(modbus_keys)
+                protocols.append('MODBUS')
+        if snmp_job is not None:
+            snmp_xml, snmp_keys = snmp_job.value
+            if snmp_keys:
+                self._write(snmp_xml, output_directory, 'snmp', 'snmp.xml')
+                databus.extend(snmp_keys)
+                protocols.append('SNMP')
+        core_xml = core_template(databus, device_info.get(1, 'unknown'), device_info.get(0, 'unknown'),
+                                 'Clone of {0}'.format(self.host), ', '.join(protocols))
+        self._write(core_xml, output_directory, 'template.xml')
+
+    def clone_modbus(self):
+        """ :return: Modbus template, its databus keys and the device identification. """
+        blocks = self.modbus_scanner.scan()
+        slaves = sorted(set(block.slave_id for block in blocks))
+        device_info = {}
+        for slave_id in slaves:
+            device_info = self.modbus_scanner.read_device_info(slave_id)
+            if device_info:
+                break
+        # conpot answers every slave in serial mode but only 0 and 255 in tcp mode
+        mode = 'tcp' if slaves and set(slaves) <= set([0, 255]) else 'serial'
+        times = sorted(self.modbus_scanner.response_times)
+        delay = int(times[len(times) // 2] * 1000) if times else 0
+        return modbus_template(blocks, device_info, mode, delay)
+
+    def clone_snmp(self):
+        """ :return: SNMP template and its databus keys. """
+        resolver = MibResolver(self.mibpaths)
+        values = self.snmp_walker.walk(self.snmp_OIDs.keys())
+        symbols = []
+        for oid, value in values:
+            location = resolver.resolve(oid)
+            if location:
+                symbols.append(location + (value,))
+            else:
+                logger.info('Skipped SNMP OID %s, not defined by a loaded MIB', format_oid(oid))
+        return snmp_template(symbols)
+
+    def _write(self, element, *path):
+        filename = os.path.join(*path)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        etree.ElementTree(element).write(filename, pretty_print=True)
+        logger.info('Wrote %s', filename)
+
+
+def databus_key(element, name, value):
+    key = etree.SubElement(element, 'key', name=name)
+    etree.SubElement(key, 'value', type='value').text = format_value(value)
+    return key
+
+
+def core_template(databus_keys, unit, vendor, description, protocols):
+    """
+    :param databus_keys: List of (key, value) or (key, lxml value element) tuples.
+    """
+    root = etree.Element('core')
+    template = etree.SubElement(root, 'template')
+    for name, text in (('unit', unit), ('vendor', vendor), ('description', description),
+                       ('protocols', protocols), ('creator', 'conpot_cloner')):
+        etree.SubElement(template, 'entity', name=name).text = text
+    mappings = etree.SubElement(etree.SubElement(root, 'databus'), 'key_value_mappings')
+    for name, value in databus_keys:
+        if etree.iselement(value):
+            etree.SubElement(mappings, 'key', name=name).append(value)
+        else:
+            databus_key(mappings, name, value)
+    return root
+
+
+def modbus_template(blocks, device_info, mode, delay):
+    """ :return: Tuple of the modbus element, its databus keys and the device identification. """
+    root = etree.Element('modbus', enabled='True', host='0.0.0.0', port='502')
+    info = etree.SubElement(root, 'device_info')
+    for object_id, name in enumerate(('VendorName', 'ProductCode', 'MajorMinorRevision')):
+        etree.SubElement(info, name).text = device_info.get(object_id, 'unknown')
+    etree.SubElement(root, 'mode').text = mode
+    # the template schema limits the delay to a byte
+    etree.SubElement(root, 'delay').text = str(min(delay, 127))
+    slaves = etree.SubElement(root, 'slaves')
+    databus_keys = []
+    slave_blocks = None
+    for block in blocks:
+        if slave_blocks is None or slave_blocks.getparent().get('id') != str(block.slave_id):
+            slave = etree.SubElement(slaves, 'slave', id=str(block.slave_id))
+            slave_blocks = etree.SubElement(slave, 'blocks')
+        name = 'memoryModbusSlave{0}Block{1}'.format(block.slave_id, chr(ord('A') + len(slave_blocks)))
+        element = etree.SubElement(slave_blocks, 'block', name=name)
+        etree.SubElement(element, 'type').text = block.block_type
+        etree.SubElement(element, 'starting_address').text = str(block.starting_address)
+        etree.SubElement(element, 'size').text = str(len(block.values))
+        etree.SubElement(element, 'content').text = name
+        databus_keys.append((name, block.values))
+    return root, databus_keys, device_info
+
+
+def snmp_template(symbols):
+    """
+    :param symbols: List of (MIB name, symbol name, instance, value) tuples.
+    :return: Tuple of the snmp element and its databus keys.
+    """
+    root = etree.Element('snmp', enabled='True', host='0.0.0.0', port='161')
+    config = etree.SubElement(root, 'config')
+    for command, delay in (('get', '0.1;0.2'), ('set', '0.1;0.2'), ('next', '0.0;0.1'), ('bulk', '0.2;0.4')):
+        etree.SubElement(config, 'entity', name='tarpit', command=command).text = delay
+    mibs = etree.SubElement(root, 'mibs')
+    mib_elements = {}
+    databus_keys = []
+    for mib_name, symbol_name, instance, value in symbols:
+        if mib_name not in mib_elements:
+            mib_elements[mib_name] = etree.SubElement(mibs, 'mib', name=mib_name)
+        symbol = etree.SubElement(mib_elements[mib_name], 'symbol', name=symbol_name)
+        key = symbol_name
+        if instance != (0,):
+            symbol.set('instance', format_oid(instance))
+            key = '{0}_{1}'.format(symbol_name, '_'.join(str(n) for n in instance))
+        etree.SubElement(symbol, 'value').text = key
+        if symbol_name == 'sysUpTime':
+            # keep the uptime running from the boot time of the cloned device
+            started = int(time.time() - int(value) / 100)
+            uptime = etree.Element('value', type='function', param='[{0}]'.format(started))
+            uptime.text = 'conpot.emulators.misc.uptime.Uptime'
+            databus_keys.append((key, uptime))
+        else:
+            databus_keys.append((key, value))
+    return root, databus_keys
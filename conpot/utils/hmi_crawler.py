@@ -0,0 +1,265 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# requests uses the standard socket module, gevent.monkey.patch_all() must be called before this module is
+# imported for the workers to run concurrently.
+
+import hashlib
+import logging
+import os
+import posixpath
+import re
+import tempfile
+import urllib
+from collections import namedtuple
+from urlparse import urljoin, urldefrag, urlparse
+
+from gevent.pool import Pool
+from gevent.queue import JoinableQueue
+from lxml import etree
+import requests
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup
+
+
+logger = logging.getLogger(__name__)
+
+# tags and attributes referencing other resources of the HMI
+LINK_ATTRIBUTES = (('a', 'href'), ('area', 'href'), ('frame', 'src'), ('iframe', 'src'), ('img', 'src'),
+                   ('script', 'src'), ('link', 'href'), ('embed', 'src'), ('object', 'data'))
+CSS_URL = re.compile(r'url\(\s*[\'"]?([^\'")\s]+)')
+REDIRECTS = (301, 302, 303, 307, 308)
+# response headers kept in the htdocs nodes
+HEADERS = ('Content-Type', 'Last-Modified')
+CHUNK_SIZE = 65536
+
+# status is only set for redirects, alias names the node serving the same content
+Node = namedtuple('Node', 'status headers alias')
+
+
+class Crawler(object):
+    """
+    Copies the pages and assets of a web HMI into a conpot http template directory.
+
+    The crawl is breadth-first: a frontier queue is drained by a bounded pool of workers sharing one keep-alive
+    session. Every path is fetched once, resources are streamed to base_dir/htdocs while being hashed and
+    content already stored under another path becomes an alias of it. Only resources on the host of the start
+    URL are fetched. conpot serves by path, so query strings are ignored.
+    """
+
+    def __init__(self, start, base_dir, workers=8, max_pages=0, timeout=10, retries=3):
+        self.start = start if '://' in start else 'http://' + start
+        parsed = urlparse(self.start)
+        self.origin = (parsed.scheme, parsed.netloc)
+        self.base_dir = base_dir
+        self.htdocs = os.path.join(base_dir, 'htdocs')
+        self.workers = workers
+        self.max_pages = max_pages
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=retries)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.frontier = JoinableQueue()
+        # paths queued so far
+        self.seen = set()
+        # md5 of the content -> node name it is stored under
+        self.hashes = {}
+        # node name -> Node
+        self.nodes = {}
+
+    def work(self):
+        """ :return: The htdocs element listing the nodes of the crawled HMI. """
+        if not os.path.isdir(self.htdocs):
+            os.makedirs(self.htdocs)
+        self._enqueue(self.start)
+        pool = Pool(self.workers)
+        for _ in range(self.workers):
+            pool.spawn(self._worker)
+        self.frontier.join()
+        pool.kill()
+        htdocs = htdocs_template(self.nodes)
+        etree.ElementTree(htdocs).write(os.path.join(self.base_dir, 'htdocs.xml'), pretty_print=True)
+        logger.info('Crawled %s paths, %s files stored', len(self.seen), len(self.hashes))
+        return htdocs
+
+    def _worker(self):
+        while True:
+            url = self.frontier.get()
+            try:
+                self._fetch(url)
+            except (requests.RequestException, IOError), e:
+                logger.warning('Failed to fetch %s: %s', url, e)
+            except Exception:
+                # the frontier is only done once every URL was handled, the worker has to carry on
+                logger.exception('Failed to crawl %s', url)
+            finally:
+                self.frontier.task_done()
+
+    def _path(self, url):
+        """ :return: Normalized path of a URL on the crawled host, None for other hosts. """
+        parsed = urlparse(urldefrag(url)[0])
+        if (parsed.scheme, parsed.netloc) != self.origin:
+            return None
+        path = posixpath.normpath(urllib.unquote(parsed.path) or '/')
+        if parsed.path.endswith('/') and path != '/':
+            path += '/'
+        return path
+
+    def _enqueue(self, url):
+        path = self._path(url)
+        if path is None or path in self.seen:
+            return
+        if self.max_pages and len(self.seen) >= self.max_pages:
+            return
+        self.seen.add(path)
+        self.frontier.put(url)
+
+    def _fetch(self, url):
+        path = self._path(url)
+        response = self.session.get(url, stream=True, allow_redirects=False, timeout=self.timeout)
+        try:
+            if response.status_code in REDIRECTS:
+                location = urljoin(url, response.headers.get('Location', ''))
+                # redirects within the HMI have to stay within the clone
+                target = self._path(location) or location
+                self.nodes[path] = Node(response.status_code, [('Location', target)], None)
+                self._enqueue(location)
+                return
+            if response.status_code != 200:
+                logger.info('Skipped %s: %s', url, response.status_code)
+                return
+            content_type = response.headers.get('Content-Type', '').lower()
+            headers = [(header, response.headers[header]) for header in HEADERS if header in response.headers]
+            if 'html' in content_type or 'css' in content_type:
+                data = response.content
+                links = extract_links(data, url, content_type)
+                self._store(path, [data], headers)
+                for link in links:
+                    self._enqueue(link)
+            else:
+                self._store(path, response.iter_content(CHUNK_SIZE), headers)
+        finally:
+            response.close()
+
+    def _store(self, path, chunks, headers):
+        """ Stores the content of a path, unless another node serves the same content, and adds its nodes. """
+        md5 = hashlib.md5()
+        # the name is chosen once the content is complete, the other workers store files meanwhile
+        fd, temporary = tempfile.mkstemp(dir=self.htdocs)
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                for chunk in chunks:
+                    md5.update(chunk)
+                    fh.write(chunk)
+            original = self.hashes.get(md5.hexdigest())
+            if original:
+                self.nodes[path] = Node(None, [], original)
+                return
+            name = self._free_name(content_name(path))
+            if name is None:
+                logger.warning('Skipped %s: another path is stored under the same name', path)
+                return
+            self.hashes[md5.hexdigest()] = name
+            # mkstemp creates the file private, conpot serves it after dropping privileges
+            os.chmod(temporary, 0644)
+            os.rename(temporary, self._filename(name))
+            temporary = None
+        finally:
+            if temporary:
+                os.remove(temporary)
+        self.nodes[name] = Node(None, headers, None)
+        if name != path:
+            self.nodes[path] = Node(None, [], name)
+
+    def _filename(self, name):
+        return os.path.join(self.htdocs, name.lstrip('/'))
+
+    def _free_name(self, name):
+        """
+        An HMI can serve both /a and /a/b, the file /a is then stored as /a/index.html.
+        :return: The name to store content under, None if it is taken.
+        """
+        parts = name.lstrip('/').split('/')
+        for depth in range(1, len(parts)):
+            parent = '/' + '/'.join(parts[:depth])
+            if os.path.isfile(self._filename(parent)):
+                self._move_to_index(parent)
+        if os.path.isdir(self._filename(name)):
+            name += '/index.html'
+        if os.path.exists(self._filename(name)):
+            return None
+        directory = os.path.dirname(self._filename(name))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        return name
+
+    def _move_to_index(self, name):
+        """ Moves the file stored as name to name/index.html, making room for the directory name. """
+        index = name + '/index.html'
+        fd, temporary = tempfile.mkstemp(dir=self.htdocs)
+        os.close(fd)
+        os.rename(self._filename(name), temporary)
+        os.makedirs(self._filename(name))
+        os.rename(temporary, self._filename(index))
+        for digest, stored in self.hashes.items():
+            if stored == name:
+                self.hashes[digest] = index
+        # conpot follows a single alias
+        for node_name, node in self.nodes.items():
+            if node.alias == name:
+                self.nodes[node_name] = node._replace(alias=index)
+        self.nodes[index] = self.nodes[name]
+        self.nodes[name] = Node(None, [], index)
+
+
+def content_name(path):
+    """ Directories are served from their index.html. """
+    return path + 'index.html' if path.endswith('/') else path
+
+
+def extract_links(data, url, content_type):
+    """ :return: Absolute URLs referenced by an HTML page or a stylesheet. """
+    if 'css' in content_type:
+        return [urljoin(url, ref) for ref in CSS_URL.findall(data)]
+    soup = BeautifulSoup(data, 'lxml')
+    links = []
+    for tag_name, attribute in LINK_ATTRIBUTES:
+        for tag in soup.find_all(tag_name):
+            ref = tag.get(attribute)
+            if ref:
+                links.append(urljoin(url, ref.strip()))
+    for style in soup.find_all('style'):
+        links.extend(urljoin(url, ref) for ref in CSS_URL.findall(style.string or ''))
+    return links
+
+
+def htdocs_template(nodes):
+    """ :return: The <htdocs> element of http.xml for the given nodes. """
+    htdocs = etree.Element('htdocs')
+    for name in sorted(nodes):
+        status, headers, alias = nodes[name]
+        node = etree.SubElement(htdocs, 'node', name=name)
+        if status:
+            etree.SubElement(node, 'status').text = str(status)
+        if headers:
+            header_elements = etree.SubElement(node, 'headers')
+            for header, value in headers:
+                etree.SubElement(header_elements, 'entity', name=header).text = value
+        if alias:
+            etree.SubElement(node, 'alias').text = alias
+    return htdocs
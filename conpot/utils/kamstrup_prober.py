@@ -0,0 +1,333 @@
+# Copyright (C) 2014 Johnny Vestergaard <jkv@unixcluster.dk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import json
+import logging
+import os
+import time
+import xml.dom.minidom
+from collections import deque
+from datetime import datetime
+
+import crc16
+import gevent
+from gevent import socket
+
+from conpot.protocols.kamstrup.meter_protocol import kamstrup_constants
+
+
+logger = logging.getLogger(__name__)
+
+
+def escape(message):
+    """ Escapes everything but the leading and trailing magic. """
+    escaped = bytearray(message[:1])
+    for c in message[1:-1]:
+        if c in kamstrup_constants.NEED_ESCAPE:
+            escaped.append(kamstrup_constants.ESCAPE)
+            escaped.append(c ^ 0xff)
+        else:
+            escaped.append(c)
+    escaped.append(message[-1])
+    return escaped
+
+
+def unescape(frame):
+    data = bytearray()
+    escaped = False
+    for c in frame:
+        if escaped:
+            data.append(c ^ 0xff)
+            escaped = False
+        elif c == kamstrup_constants.ESCAPE:
+            escaped = True
+        else:
+            data.append(c)
+    return data
+
+
+def build_request(comm_address, registers):
+    """ A single 0x10 GetRegister request for all registers. """
+    message = bytearray([kamstrup_constants.REQUEST_MAGIC, comm_address, 0x10, len(registers)])
+    for register in registers:
+        message += bytearray([register >> 8, register & 0xff])
+    crc = crc16.crc16xmodem(str(message[1:]))
+    message += bytearray([crc >> 8, crc & 0xff, kamstrup_constants.EOT_MAGIC])
+    return escape(message)
+
+
+def parse_response(frame):
+    """
+    :param frame: Response frame including the leading and trailing magic (bytearray).
+    :return: Dictionary of register id and (units, length, unknown, value), None if the frame is invalid.
+    """
+    data = unescape(frame[1:-1])
+    # communication address, command, at least the crc
+    if len(data) < 4 or crc16.crc16xmodem(str(data)) != 0 or data[1] != 0x10:
+        return None
+    registers = {}
+    payload = data[2:-2]
+    i = 0
+    # register id, units, length, unknown byte followed by length bytes of value
+    while i + 5 <= len(payload):
+        register = payload[i] << 8 | payload[i + 1]
+        units, length, unknown = payload[i + 2], payload[i + 3], payload[i + 4]
+        value = 0
+        for b in payload[i + 5:i + 5 + length]:
+            value = value << 8 | b
+        registers[register] = (units, length, unknown, value)
+        i += 5 + length
+    return registers
+
+
+def to_ranges(registers):
+    """ Compacts register ids into a sorted list of [first, last] ranges. """
+    ranges = []
+    for register in sorted(registers):
+        if ranges and ranges[-1][1] == register - 1:
+            ranges[-1][1] = register
+        else:
+            ranges.append([register, register])
+    return ranges
+
+
+def from_ranges(ranges):
+    registers = []
+    for first, last in ranges:
+        registers.extend(range(first, last + 1))
+    return registers
+
+
+class ConnectionLost(Exception):
+    pass
+
+
+class KamstrupRegisterProber(object):
+    """
+    Sweeps the registers of a meter over a small pool of connections. Every request asks for batch_size
+    registers, each connection keeps up to window requests in flight. The window and the response timeout
+    adapt to the device: the window grows by one for every answered request and falls back to one request,
+    with a doubled timeout, whenever the device does not answer in time. Batches without an answer are
+    retried register by register.
+    """
+
+    def __init__(self, ip_address, port, comm_address, connections=2, window=4, batch_size=8, timeout=2,
+                 max_timeout=30, attempts=3):
+        self.ip_address = ip_address
+        self.port = port
+        self.comm_address = comm_address
+        self.connections = connections
+        self.max_window = window
+        self.batch_size = batch_size
+        self.min_timeout = timeout
+        self.max_timeout = max_timeout
+        self.attempts = attempts
+        # smoothed round trip time of the device, shared by all connections
+        self.rtt = None
+        self.found = {}
+        self.pending = set()
+        self.scanned = 0
+        # batches of (registers, attempt) not yet sent, and the number of batches sent but not answered
+        self._batches = deque()
+        self._inflight = 0
+
+    @property
+    def timeout(self):
+        if self.rtt is None:
+            return self.min_timeout
+        return min(max(self.min_timeout, 4 * self.rtt), self.max_timeout)
+
+    def probe(self, registers, checkpoint=None, checkpoint_interval=10):
+        """
+        :param registers: Register ids to probe.
+        :param checkpoint: Callable invoked with the prober every checkpoint_interval seconds and when done.
+        """
+        self.pending.update(registers)
+        registers = sorted(self.pending)
+        for i in range(0, len(registers), self.batch_size):
+            self._batches.append((registers[i:i + self.batch_size], 0))
+        workers = [gevent.spawn(self._worker) for _ in range(self.connections)]
+        try:
+            while len(gevent.joinall(workers, timeout=checkpoint_interval)) < len(workers):
+                if checkpoint:
+                    checkpoint(self)
+                logger.info('Hang on, still scanning, so far scanned %s and found %s registers, timeout %.1fs',
+                            self.scanned, len(self.found), self.timeout)
+        finally:
+            gevent.killall(workers)
+            if checkpoint:
+                checkpoint(self)
+
+    def _connect(self):
+        delay = 1
+        while True:
+            logger.info('Connecting to %s:%s', self.ip_address, self.port)
+            try:
+                return socket.create_connection((self.ip_address, self.port), timeout=self.timeout)
+            except socket.error as socket_err:
+                logger.warning('Error while connecting: %s', socket_err)
+                gevent.sleep(delay)
+                delay = min(delay * 2, 60)
+
+    def _worker(self):
+        sock = None
+        window = 1
+        while self._batches or self._inflight:
+            if not self._batches:
+                # other connections still have requests in flight which might be handed back
+                gevent.sleep(0.1)
+                continue
+            if sock is None:
+                sock = self._connect()
+                window = 1
+            try:
+                window = self._run(sock, window)
+            except ConnectionLost as err:
+                logger.warning('Error while communicating: %s', err)
+                sock.close()
+                sock = None
+                window = 1
+        if sock is not None:
+            sock.close()
+
+    def _run(self, sock, window):
+        inflight = deque()
+        buf = bytearray()
+        try:
+            while self._batches or inflight:
+                while self._batches and len(inflight) < window:
+                    batch = self._batches.popleft()
+                    sock.sendall(build_request(self.comm_address, batch[0]))
+                    inflight.append((batch, time.time()))
+                    self._inflight += 1
+                frame = self._read_frame(sock, buf)
+                response = parse_response(frame)
+                (registers, attempt), sent = inflight.popleft()
+                self._inflight -= 1
+                # a device skipping a request shifts the responses, they are matched to the batches by their
+                # registers. A response without any register cannot be told apart and goes to the oldest batch.
+                while response and not set(response) <= set(registers) and inflight:
+                    self._retry(registers, attempt)
+                    (registers, attempt), sent = inflight.popleft()
+                    self._inflight -= 1
+                self._update_rtt(time.time() - sent)
+                if response is None or not set(response) <= set(registers):
+                    self._retry(registers, attempt)
+                else:
+                    self._done(registers, response)
+                window = min(window + 1, self.max_window)
+            return window
+        except (socket.error, socket.timeout, ConnectionLost) as err:
+            # hand the unanswered batches back, the device might just be slow
+            for (registers, attempt), _ in reversed(inflight):
+                self._inflight -= 1
+                self._retry(registers, attempt)
+            # doubles the timeout
+            self.rtt = self.timeout / 2.0
+            raise ConnectionLost(str(err) or 'timeout')
+
+    def _read_frame(self, sock, buf):
+        sock.settimeout(self.timeout)
+        while True:
+            end = buf.find(chr(kamstrup_constants.EOT_MAGIC))
+            if end != -1:
+                start = buf.rfind(chr(kamstrup_constants.RESPONSE_MAGIC), 0, end)
+                frame = buf[max(start, 0):end + 1]
+                del buf[:end + 1]
+                return frame
+            data = sock.recv(1024)
+            if not data:
+                raise ConnectionLost('connection closed by device')
+            buf += data
+
+    def _update_rtt(self, sample):
+        if self.rtt is None:
+            self.rtt = sample
+        else:
+            self.rtt = 0.875 * self.rtt + 0.125 * sample
+
+    def _retry(self, registers, attempt):
+        if len(registers) > 1:
+            # retry the registers one by one, a single bad register should not hide the others
+            for register in reversed(registers):
+                self._batches.appendleft(([register], 0))
+        elif attempt + 1 < self.attempts:
+            self._batches.appendleft((registers, attempt + 1))
+        else:
+            logger.warning('Giving up on register %s', hex(registers[0]))
+            self._done(registers, {})
+
+    def _done(self, registers, response):
+        for register in registers:
+            self.pending.discard(register)
+            self.scanned += 1
+            if register in response:
+                units, length, unknown, value = response[register]
+                self.found[register] = {'timestamp': datetime.utcnow(),
+                                        'units': units,
+                                        'value': value,
+                                        'value_length': length,
+                                        'unknown': unknown}
+                logger.info('Found register value at %s:%s', hex(register), value)
+
+
+def json_default(obj):
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    else:
+        return None
+
+
+def load_dump(filename):
+    """ :return: Found registers and the ranges still to be probed, None if the dump is complete. """
+    with open(filename, 'r') as dump_file:
+        dump = json.load(dump_file)
+    if 'registers' not in dump:
+        # dumps without checkpoint only contain the found registers
+        return dump, None
+    return dump['registers'], dump['remaining']
+
+
+def resume(prober, filename):
+    """ Restores the registers found by the scan checkpointed in filename. :return: Registers still to probe. """
+    found, remaining = load_dump(filename)
+    prober.found = dict((int(register), value) for register, value in found.items())
+    return from_ranges(remaining or [])
+
+
+def write_dump(filename, prober):
+    dump = {'registers': prober.found, 'remaining': to_ranges(prober.pending)}
+    with open(filename + '.tmp', 'w') as json_file:
+        json_file.write(json.dumps(dump, indent=4, default=json_default))
+    os.rename(filename + '.tmp', filename)
+
+
+def generate_conpot_config(result_list):
+    config_xml = """<conpot_template name="Kamstrup-Auto382" description="Register clone of an existing Kamstrup meter">
+    <core><databus><key_value_mappings>"""
+    for key, value in result_list.items():
+        config_xml += """<key name="register_{0}"><value type="value">{1}</value></key>""".format(key, value['value'])
+    config_xml += """</key_value_mappings></databus></core><protocols><kamstrup_meter enabled="True" host="0.0.0.0" port="1025"><registers>"""
+
+    for key, value in result_list.items():
+        config_xml += """<register name="{0}" units="{1}" unknown="{2}" length="{3}"><value>register_{0}</value></register>"""\
+            .format(key, value['units'], value['unknown'], value['value_length'])
+    config_xml += "</registers></kamstrup_meter></protocols></conpot_template>"
+
+    parsed_xml = xml.dom.minidom.parseString(config_xml)
+    pretty_xml = parsed_xml.toprettyxml()
+    return pretty_xml
@@ -0,0 +1,274 @@
+# Copyright (C) 2015  MushMush Foundation
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import itertools
+import logging
+import multiprocessing
+import socket
+import sqlite3
+import struct
+import time
+from collections import deque
+from datetime import datetime
+
+import modbus_tk.modbus_tcp as modbus_tcp
+
+from conpot.core.loggers.sqlite_log import create_db, INDEXES
+from conpot.protocols.s7comm.tpkt import TPKT
+from conpot.protocols.s7comm.cotp import COTP as COTP_BASE_packet
+from conpot.protocols.s7comm.cotp import COTP_ConnectionRequest
+from conpot.protocols.s7comm.s7 import S7
+from conpot.protocols.s7comm.exceptions import ParseException
+
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = 'id, session, timestamp, remote, protocol, request, response'
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def decode_s7comm(row):
+    _, session_id, timestamp, _, _, request, response = row
+    tpkt_packet = TPKT().parse(request.decode('hex'))
+    cotp_base_packet = COTP_BASE_packet().parse(tpkt_packet.payload)
+    if cotp_base_packet.tpdu_type == 0xe0:
+        cotp_cr_request = COTP_ConnectionRequest().dissect(cotp_base_packet.payload)
+        return ['[s7comm] {0} - sid: {1} COTP Connection Request: dst-ref:{2} src-ref:{3} dst-tsap:{4} '
+                'src-tsap:{5} tpdu-size:{6}'.format(timestamp, session_id, cotp_cr_request.dst_ref,
+                                                    cotp_cr_request.src_ref, cotp_cr_request.dst_tsap,
+                                                    cotp_cr_request.src_tsap, cotp_cr_request.tpdu_size)]
+    if cotp_base_packet.tpdu_type != 0xf0:
+        return ['[s7comm] {0} - sid: {1} unknown COTP TPDU: {2}'.format(timestamp, session_id,
+                                                                       cotp_base_packet.tpdu_type)]
+    s7_packet = S7().parse(cotp_base_packet.trailer)
+    lines = ['[s7comm] {0} - sid: {1} S7 request: pdu_type:{2} req_id:{3} param:{4:#04x} param_len:{5} '
+             'data_len:{6}'.format(timestamp, session_id, s7_packet.pdu_type, s7_packet.request_id,
+                                   s7_packet.param, s7_packet.param_length, s7_packet.data_length)]
+    if response:
+        cotp_base_packet = COTP_BASE_packet().parse(TPKT().parse(response.decode('hex')).payload)
+        s7_packet = S7().parse(cotp_base_packet.trailer)
+        lines.append('[s7comm] {0} - sid: {1} S7 response: pdu_type:{2} req_id:{3} param_len:{4} '
+                     'data_len:{5}'.format(timestamp, session_id, s7_packet.pdu_type, s7_packet.request_id,
+                                           s7_packet.param_length, s7_packet.data_length))
+    return lines
+
+
+def decode_modbus(row):
+    _, session_id, timestamp, _, _, request, response = row
+    # the request is logged as the complete TCP frame, the response as PDU only
+    slave_id, request_pdu = modbus_tcp.TcpQuery().parse_request(request.decode('hex'))
+    (func_code, ) = struct.unpack('>B', request_pdu[0])
+    lines = ['[modbus] {0} - sid: {1} slave: {2} function code: {3} request: {4}'.format(
+        timestamp, session_id, slave_id, func_code, request_pdu.encode('hex'))]
+    if response:
+        (return_code, ) = struct.unpack('>B', response.decode('hex')[0])
+        lines.append('[modbus] {0} - sid: {1} slave: {2} function code: {3} response: {4}'.format(
+            timestamp, session_id, slave_id, return_code, response))
+    return lines
+
+
+def decode_snmp(row):
+    _, session_id, timestamp, _, _, request, response = row
+    req_prot_version, method, req_content = request.split(' ', 2)
+    lines = ['[snmp] {0} - sid: {1} request: {2} {3} {4}'.format(timestamp, session_id, req_prot_version,
+                                                                 method.rstrip(':'), req_content)]
+    if response:
+        resp_prot_version, _, resp_content = response.split(' ', 2)
+        lines.append('[snmp] {0} - sid: {1} response: {2} {3}'.format(timestamp, session_id, resp_prot_version,
+                                                                      resp_content))
+    return lines
+
+
+DECODERS = {'s7comm': decode_s7comm, 'modbus': decode_modbus, 'snmp': decode_snmp}
+
+
+def decode_rows(rows):
+    """ Module level so the worker processes can unpickle it. :return: The lines describing the rows. """
+    lines = []
+    for row in rows:
+        decoder = DECODERS.get(row[4])
+        if decoder is None:
+            continue
+        try:
+            lines.extend(decoder(row))
+        except (ParseException, modbus_tcp.ModbusInvalidRequestError, struct.error, TypeError, ValueError,
+                IndexError), e:
+            lines.append('[{0}] {1} - sid: {2} undecodable event {3}: {4}'.format(row[4], row[2], row[1], row[0], e))
+    return lines
+
+
+def read_tpkt(sock):
+    header = recv_all(sock, 4)
+    (length, ) = struct.unpack('!H', header[2:4])
+    return header + recv_all(sock, length - 4)
+
+
+def read_modbus(sock):
+    header = recv_all(sock, 6)
+    (length, ) = struct.unpack('>H', header[4:6])
+    # compared against the logged PDU, without the MBAP header and unit id
+    return recv_all(sock, length)[1:]
+
+
+def recv_all(sock, size):
+    data = ''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise socket.error('connection closed by the honeypot')
+        data += chunk
+    return data
+
+
+# protocols logging their requests as raw frames, with the reader for one response frame
+REPLAYABLE = {'s7comm': read_tpkt, 'modbus': read_modbus}
+
+
+class ConpotPlayback(object):
+    """
+    Reads the events logged by the SQLite logger.
+
+    Rows are streamed from a cursor in (timestamp, id) order and every filter is served by an index of the
+    events table, so memory use does not grow with the size of the database.
+    """
+
+    def __init__(self, db_path="logs/conpot.db", workers=0, batch_size=1000, create_indexes=False):
+        """
+        :param create_indexes: Creates the indexes missing in databases of older versions. The database is locked
+                               for writing while they are built, the SQLite logger of a running honeypot waits.
+        """
+        self.conn = sqlite3.connect(db_path)
+        if create_indexes:
+            create_db(self.conn)
+        else:
+            missing = self.missing_indexes()
+            if missing:
+                logger.warning('The events table lacks the indexes %s, queries scan the whole table. '
+                               'Create them with --create-indexes.', ', '.join(missing))
+        self.workers = workers
+        self.batch_size = batch_size
+
+    def missing_indexes(self):
+        existing = set(row[0] for row in
+                       self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'events'"))
+        return [name for name, _ in INDEXES if name not in existing]
+
+    def select(self, **filters):
+        """ :return: Iterator over the matching (id, session, timestamp, remote, protocol, request, response) rows. """
+        return self.conn.execute(*self.query(**filters))
+
+    def query(self, protocol=None, session=None, remote=None, start=None, end=None):
+        """
+        :param remote: IP address of the attacker.
+        :param start: First timestamp included, a datetime or a '%Y-%m-%d %H:%M:%S' string (UTC).
+        :param end: Timestamp the selection ends before.
+        :return: The SQL statement selecting the events and its parameters.
+        """
+        clauses = ['request IS NOT NULL']
+        params = []
+        if protocol:
+            clauses.append('protocol = ?')
+            params.append(protocol)
+        if session:
+            clauses.append('session = ?')
+            params.append(str(session))
+        if remote:
+            # remote is logged as the str() of the (ip, port) tuple
+            clauses.append('(remote = ? OR remote GLOB ?)')
+            params.extend([remote, "('{0}', *".format(remote)])
+        if start:
+            clauses.append('timestamp >= ?')
+            params.append(format_timestamp(start))
+        if end:
+            clauses.append('timestamp < ?')
+            params.append(format_timestamp(end))
+        return 'SELECT {0} FROM events WHERE {1} ORDER BY timestamp, id'.format(COLUMNS, ' AND '.join(clauses)), params
+
+    def decode(self, rows):
+        """
+        :return: Iterator over the lines describing the rows, in the order of the rows. The worker pool does not
+                 work in a process monkey patched by gevent.
+        """
+        rows = iter(rows)
+        batches = iter(lambda: list(itertools.islice(rows, self.batch_size)), [])
+        if self.workers < 2:
+            for batch in batches:
+                for line in decode_rows(batch):
+                    yield line
+            return
+        pool = multiprocessing.Pool(self.workers)
+        pending = deque()
+        try:
+            for batch in batches:
+                pending.append(pool.apply_async(decode_rows, (batch, )))
+                # bounded read ahead, a multi-GB database must not end up in the task queue
+                if len(pending) > 2 * self.workers:
+                    for line in pending.popleft().get():
+                        yield line
+            while pending:
+                for line in pending.popleft().get():
+                    yield line
+        finally:
+            pool.terminate()
+
+    def play(self, **filters):
+        for line in self.decode(self.select(**filters)):
+            print line
+
+    def replay(self, session, host, port, speed=1.0, timeout=5):
+        """
+        Sends the requests of a session to a running honeypot.
+
+        :param speed: Replay speed relative to the logged timing, 0 sends the requests without delay.
+        :return: List of (request, logged response, replayed response) tuples, hex encoded.
+        """
+        rows = list(self.select(session=session))
+        if not rows:
+            raise ValueError('No events logged for session {0}'.format(session))
+        protocol = rows[0][4]
+        if protocol not in REPLAYABLE:
+            raise ValueError('Replay is not supported for {0} sessions'.format(protocol))
+        read_response = REPLAYABLE[protocol]
+        first = parse_timestamp(rows[0][2])
+        started = time.time()
+        results = []
+        sock = socket.create_connection((host, port), timeout)
+        try:
+            for _, _, timestamp, _, _, request, response in rows:
+                if speed:
+                    delay = (parse_timestamp(timestamp) - first).total_seconds() / speed - (time.time() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+                sock.sendall(request.decode('hex'))
+                # requests the honeypot did not answer are not waited for
+                replayed = read_response(sock).encode('hex') if response else ''
+                results.append((request, response, replayed))
+        finally:
+            sock.close()
+        logger.info('Replayed %s requests of session %s, %s responses differ', len(results), session,
+                    sum(1 for _, logged, replayed in results if logged != replayed))
+        return results
+
+
+def format_timestamp(value):
+    if isinstance(value, datetime):
+        return value.strftime(TIMESTAMP_FORMAT)
+    return value
+
+
+def parse_timestamp(value):
+    return datetime.strptime(value[:19], TIMESTAMP_FORMAT)